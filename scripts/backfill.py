@@ -1,6 +1,57 @@
-"""Placeholder for backfill utility.
+"""Backfill utility.
 
-Scans each mailbox for subject match and normalizes labels across team.
+Scans each mailbox for subject match and normalizes labels across team:
+every matching message ends up in every TEAM_USERS mailbox, labelled.
+
+    python -m scripts.backfill --dry-run
+    python -m scripts.backfill --run-id onboarding-2025-09 --since 2023-01-01
 """
+import argparse
+import dataclasses
+import datetime
+import json
+
+from dotenv import load_dotenv
+
+from src.config import Config
+from src.gmail.backfill import Backfill
+from src.main import build_worker_context
+from src.utils.logging import setup_logging
+
+
+def main():
+    load_dotenv()
+    cfg = Config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="scan and report, change nothing")
+    parser.add_argument("--run-id", default="default", help="checkpoint namespace; reuse it to resume")
+    parser.add_argument("--since", help="only messages received on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--max-per-sec", type=float, default=cfg.backfill_max_messages_per_sec)
+    parser.add_argument("--concurrency", type=int, default=cfg.backfill_concurrency)
+    args = parser.parse_args()
+
+    setup_logging(cfg.log_level)
+    after = None
+    if args.since:
+        after = int(datetime.datetime.strptime(args.since, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc).timestamp())
+
+    ctx = build_worker_context(cfg)
+    try:
+        report = Backfill(
+            cfg,
+            ctx.kv,
+            ctx.auth_factory,
+            ctx.processor,
+            run_id=args.run_id,
+            dry_run=args.dry_run,
+            max_messages_per_sec=args.max_per_sec,
+            concurrency=args.concurrency,
+            after=after,
+        ).run()
+    finally:
+        ctx.close()
+    print(json.dumps(dataclasses.asdict(report), indent=2, sort_keys=True))
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Offline load test.
+
+Delivers synthetic mail to N simulated mailboxes (src.sim.gmail), pushes the
+resulting watch notifications through handle_pubsub_message from a simulated
+subscription (src.sim.pubsub), and reports throughput, ack latency and Gmail
+API calls per shared message. Nothing leaves the process.
+
+    python -m scripts.benchmark --mailboxes 4 --messages 2000
+    python -m scripts.benchmark --latency-ms 50 --error-rate 429=0.02 --error-rate 503=0.01
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from src.config import Config
+from src.main import build_quota_limiter, build_resilience, handle_pubsub_message
+from src.sim.gmail import FakeGmailBackend
+from src.sim.pubsub import SimSubscription
+from src.storage.cursors import advance_history_cursor
+from src.storage.memory_kv import InMemoryKV
+from src.utils import metrics
+from src.utils.circuit import configure_resilience
+from src.utils.logging import setup_logging
+from src.utils.ratelimit import configure_limiter
+from src.worker.context import WorkerContext
+
+SUBJECTS = ["Week {n} Training Exercise", "Training Exercise", "Lunch on {n}?", "Re: build {n} failed", "Standup notes {n}"]
+
+
+def _error_rate(value: str):
+    status, rate = value.split("=", 1)
+    return int(status), float(rate)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def _deliver(backend: FakeGmailBackend, users: List[str], count: int, match_ratio: float, rate: float, seed: int) -> List[str]:
+    """Deliver count messages at about rate per second (0: all at once); returns the matching rfc822 ids."""
+    rng = random.Random(seed)
+    matching: List[str] = []
+    started = time.monotonic()
+    for n in range(count):
+        if rate > 0:
+            delay = started + n / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        user = rng.choice(users)
+        if rng.random() < match_ratio:
+            rid = f"<bench-{seed}-{n}@sim.example.net>"
+            matching.append(rid)
+            backend.deliver(user, rng.choice(SUBJECTS[:2]).format(n=n), rfc822_id=rid, body_bytes=rng.randint(1, 64) * 1024)
+        else:
+            backend.deliver(user, rng.choice(SUBJECTS[2:]).format(n=n), body_bytes=rng.randint(1, 16) * 1024)
+    return matching
+
+
+def _verify(backend: FakeGmailBackend, users: List[str], matching: List[str], label_name: str) -> Dict[str, int]:
+    """Every matching message should be in every mailbox exactly once, with the label."""
+    missing = duplicates = unlabelled = 0
+    wanted = {rid.strip("<>") for rid in matching}
+    for user in users:
+        box = backend.mailbox(user)
+        label_id = box.label_id(label_name)
+        copies: Dict[str, int] = {}
+        for msg in box.messages.values():
+            rid = msg.header("Message-Id").strip("<>")
+            if rid in wanted:
+                copies[rid] = copies.get(rid, 0) + 1
+                if label_id is None or label_id not in msg.label_ids:
+                    unlabelled += 1
+        missing += len(wanted - set(copies))
+        duplicates += sum(n - 1 for n in copies.values())
+    return {"missing": missing, "duplicates": duplicates, "unlabelled": unlabelled}
+
+
+def main():
+    load_dotenv()
+    cfg = Config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mailboxes", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000, help="messages delivered across all mailboxes")
+    parser.add_argument("--match-ratio", type=float, default=0.3, help="share of messages with a matching subject")
+    parser.add_argument("--rate", type=float, default=0, help="deliveries per second (0: deliver everything up front)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="per Gmail round trip")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=_error_rate, action="append", default=[], metavar="STATUS=P",
+                        help="inject this HTTP status with probability P per call (repeatable)")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds on injected 429/403")
+    parser.add_argument("--concurrency", type=int, default=cfg.pull_concurrency, help="callback threads, all replicas")
+    parser.add_argument("--replicas", type=int, default=1, help="worker contexts sharing the subscription and KV")
+    parser.add_argument("--lease-seconds", type=int, default=None,
+                        help="mailbox lease TTL with several replicas (default MAILBOX_LEASE_SECONDS; 0 disables)")
+    parser.add_argument("--max-outstanding", type=int, default=cfg.pull_max_messages)
+    parser.add_argument("--watch-label-ids", type=lambda v: [lb for lb in v.split(",") if lb],
+                        default=cfg.watch_label_ids, help="watch filter (comma separated; empty: every change)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+    os.environ["STORE_BACKEND"] = "memory"
+    cfg.store_backend = "memory"
+    cfg.team_users = [f"user{i}@example.com" for i in range(args.mailboxes)]
+
+    subscription = SimSubscription(
+        max_outstanding=args.max_outstanding,
+        concurrency=args.concurrency,
+        max_delivery_attempts=cfg.max_delivery_attempts,
+    )
+    backend = FakeGmailBackend(
+        latency_seconds=args.latency_ms / 1000.0,
+        jitter_seconds=args.jitter_ms / 1000.0,
+        error_rates=dict(args.error_rate),
+        retry_after_seconds=args.retry_after,
+        seed=args.seed,
+        notify=subscription.publish_notification,
+    )
+    exporter = metrics.InMemoryExporter()
+    metrics.configure_metrics(exporter)
+    configure_limiter(build_quota_limiter(cfg))
+    configure_resilience(build_resilience(cfg))
+    if args.replicas > 1 and args.lease_seconds is not None:
+        cfg.mailbox_lease_seconds = args.lease_seconds
+    # Replicas share one store, standing in for Firestore; each has its own coalescer, pools and leases.
+    kv = InMemoryKV()
+    replicas = [WorkerContext(cfg, kv, backend) for _ in range(args.replicas)]
+    for user in cfg.team_users:
+        # What registering the watch does in production: start notifications and the cursor together.
+        history_id = backend.watch(user, args.watch_label_ids, cfg.watch_label_filter_behavior)
+        advance_history_cursor(kv, user, str(history_id))
+
+    matching: List[str] = []
+    delivery = threading.Thread(
+        target=lambda: matching.extend(
+            _deliver(backend, cfg.team_users, args.messages, args.match_ratio, args.rate, args.seed)
+        ),
+        name="bench-delivery",
+    )
+    # Stop once nothing has been published or in flight for this long.
+    idle = 0.5 if args.rate <= 0 else max(0.5, 2.0 / args.rate)
+    started = time.monotonic()
+    delivery.start()
+    if args.rate <= 0:
+        delivery.join()
+    try:
+        # Pub/Sub hands each message to whichever replica is pulling.
+        stats = subscription.run(
+            lambda message: handle_pubsub_message(message, replicas[int(message.message_id) % len(replicas)]),
+            idle_timeout=idle,
+        )
+    finally:
+        delivery.join()
+        for ctx in replicas:
+            ctx.close()
+    elapsed = time.monotonic() - started - idle  # the final idle wait is not work
+
+    calls = sum(backend.calls.values())
+    shared = len(matching)
+    report = {
+        "mailboxes": args.mailboxes,
+        "replicas": args.replicas,
+        "messages_delivered": args.messages,
+        "messages_shared": shared,
+        "notifications": stats.published,
+        "acked": stats.acked,
+        "nacks": stats.nacks,
+        "dead_lettered": stats.dead_lettered,
+        "seconds": round(elapsed, 3),
+        "shared_messages_per_sec": round(shared / elapsed, 2) if elapsed > 0 else 0.0,
+        "ack_latency_ms": {
+            "p50": round(_percentile(stats.ack_latencies, 50) * 1000, 1),
+            "p99": round(_percentile(stats.ack_latencies, 99) * 1000, 1),
+        },
+        "api_calls": calls,
+        "http_requests": backend.http_requests,
+        "api_calls_per_shared_message": round(calls / shared, 2) if shared else 0.0,
+        "api_calls_by_method": dict(sorted(backend.calls.items())),
+        "injected_errors": {f"{method} {status}": n for (method, status), n in sorted(backend.errors.items())},
+        "inserted": int(exporter.counter("messages_inserted_total")),
+        "verify": _verify(backend, cfg.team_users, matching, cfg.label_name),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,9 @@ from typing import Dict, Optional
 from dotenv import load_dotenv
 
 import src.main as main_module
+from src.storage.memory_kv import InMemoryKV
+from src.utils import metrics
+from src.worker.context import WorkerContext
 
 
 class FakeMessage:
@@ -28,6 +31,24 @@ class _Exec:
         return self._fn()
 
 
+class _Batch:
+    def __init__(self, callback):
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id=None):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self._requests:
+            try:
+                res = request.execute()
+            except Exception as exc:  # noqa: BLE001
+                self._callback(request_id, None, exc)
+            else:
+                self._callback(request_id, res, None)
+
+
 class _MessagesAPI:
     def __init__(self, user_store: Dict):
         self.store = user_store
@@ -47,8 +68,9 @@ class _MessagesAPI:
                         },
                     }
                 if format == "raw":
-                    raw = base64.urlsafe_b64encode(b"raw-bytes").decode("ascii")
-                    return {"raw": raw}
+                    rfc822 = b"Subject: Training Exercise\r\nMessage-Id: <mid-1>\r\n\r\nraw-bytes"
+                    raw = base64.urlsafe_b64encode(rfc822).decode("ascii")
+                    return {"id": id, "threadId": "src-thread-1", "raw": raw, "sizeEstimate": len(rfc822)}
             # fallback minimal
             return {"id": id, "payload": {"headers": []}}
 
@@ -69,7 +91,7 @@ class _MessagesAPI:
 
         return _Exec(_run)
 
-    def insert(self, userId: str, body: Dict):
+    def insert(self, userId: str, body: Dict, media_body=None):
         def _run():
             # record that we now have this rfc822 id for this user
             rid = "<mid-1>"
@@ -84,6 +106,9 @@ class _MessagesAPI:
 
         return _Exec(_run)
 
+    def batchModify(self, userId: str, body: Dict):
+        return _Exec(lambda: None)
+
 
 class _LabelsAPI:
     def __init__(self, user_store: Dict):
@@ -121,10 +146,13 @@ class _HistoryAPI:
     def __init__(self, user_store: Dict):
         self.store = user_store
 
-    def list(self, userId: str, startHistoryId: str):
+    def list(self, userId: str, startHistoryId: str, **kwargs):
         def _run():
             # Always return one new message for simplicity
-            return {"history": [{"id": "101", "messagesAdded": [{"message": {"id": "src-msg-1"}}]}]}
+            return {
+                "history": [{"id": "101", "messagesAdded": [{"message": {"id": "src-msg-1"}}]}],
+                "historyId": "101",
+            }
 
         return _Exec(_run)
 
@@ -145,6 +173,9 @@ class _UsersAPI:
     def history(self):
         return _HistoryAPI(self.store)
 
+    def getProfile(self, userId: str):
+        return _Exec(lambda: {"emailAddress": userId, "historyId": "101"})
+
     def watch(self, userId: str, body: Dict):
         return _Exec(lambda: {"historyId": "100"})
 
@@ -161,9 +192,12 @@ class StubGmail:
         user_store = self.backing_store.setdefault(self.user_email, {})
         return _UsersAPI(user_store)
 
+    def new_batch_http_request(self, callback=None):
+        return _Batch(callback)
+
 
 def _stub_gmail_client_for(backing_store: Dict[str, Dict]):
-    def factory(user_email: str, _sa_path: str):
+    def factory(user_email: str):
         return StubGmail(user_email, backing_store)
 
     return factory
@@ -175,9 +209,7 @@ def main():
     os.environ["STORE_BACKEND"] = "memory"
     os.environ.setdefault("TEAM_USERS", "user@example.com,B@example.com")
 
-    # Monkey-patch gmail_client_for in main module to our stub
     backing_store: Dict[str, Dict] = {}
-    main_module.gmail_client_for = _stub_gmail_client_for(backing_store)
 
     payload = {
         "source": "gmail",
@@ -186,8 +218,18 @@ def main():
         "eventTime": "2025-08-26T10:11:12Z",
         "projectId": "dev-project",
     }
+    cfg = main_module.Config()
+    cfg.store_backend = "memory"
+    exporter = metrics.PrometheusExporter()
+    metrics.configure_metrics(exporter)
+    ctx = WorkerContext(cfg, InMemoryKV(), _stub_gmail_client_for(backing_store))
     msg = FakeMessage(json.dumps(payload).encode("utf-8"), {"version": "1"})
-    main_module.handle_pubsub_message(msg)
+    try:
+        main_module.handle_pubsub_message(msg, ctx)
+    finally:
+        ctx.close()
+    if os.getenv("SHOW_METRICS"):
+        print(exporter.render())
     print("Dry run completed successfully.")
 
 
@@ -1,20 +1,42 @@
-import os
+"""Register (or renew) the filtered Gmail watch on every TEAM_USERS mailbox.
+
+    python -m scripts.register_watch            # only watches that are missing or due
+    python -m scripts.register_watch --force    # re-register all, e.g. after changing the filter
+    python -m scripts.register_watch --loop     # keep renewing, staggered, until interrupted
+"""
+import argparse
+
 from dotenv import load_dotenv
+
 from src.config import Config
-from src.gmail.auth import gmail_client_for
-from src.gmail.watch import register_watch
+from src.gmail.watch import WatchManager
+from src.main import build_auth_factory, build_kv
+from src.utils.logging import setup_logging
 
 
 def main():
     load_dotenv()
     cfg = Config()
-    topic = f"projects/{cfg.project_id}/topics/{cfg.topic}"
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--force", action="store_true", help="register even if the current watch is not due")
+    parser.add_argument("--loop", action="store_true", help="run the renewal scheduler in the foreground")
+    args = parser.parse_args()
+
+    setup_logging(cfg.log_level)
+    manager = WatchManager(cfg, build_kv(cfg), build_auth_factory(cfg))
+    records = manager.ensure_all(force=args.force)
     for user in cfg.team_users:
-        gmail = gmail_client_for(user, cfg.google_application_credentials)
-        res = register_watch(gmail, topic)
-        print(user, res.get("historyId"))
+        rec = records.get(user)
+        if rec is None:
+            print(user, "FAILED (or being registered by another replica)")
+        else:
+            print(user, rec["history_id"], "expires", rec["expiration"], "renews", int(manager.renew_at(user, rec)))
+    if args.loop:
+        try:
+            manager.run()
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == "__main__":
     main()
-
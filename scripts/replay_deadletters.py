@@ -1,6 +1,65 @@
-"""Placeholder for DLQ replay utility.
+"""DLQ replay utility.
 
-Reads messages from DLQ and attempts reprocessing.
+Reads messages from the DLQ subscription and reprocesses them, one sync per
+mailbox at the highest dead-lettered historyId.
+
+    python -m scripts.replay_deadletters --dry-run
+    python -m scripts.replay_deadletters --user a@example.com --error-class HttpError403
 """
+import argparse
+import dataclasses
+import datetime
+import json
+
+from dotenv import load_dotenv
+
+from src.config import Config
+from src.gcp.dlq import DeadLetterReplayer, ReplayFilter
+from src.main import build_worker_context, handle_pubsub_message
+from src.storage.cursors import get_last_error
+from src.utils.logging import setup_logging
+
+
+def _date(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+
+
+def main():
+    load_dotenv()
+    cfg = Config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="pull and report, replay and ack nothing")
+    parser.add_argument("--subscription", default=cfg.dlq_subscription)
+    parser.add_argument("--user", action="append", default=[], help="only this mailbox (repeatable)")
+    parser.add_argument("--since", type=_date, help="only messages published on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=_date, help="only messages published before this date (YYYY-MM-DD)")
+    parser.add_argument("--error-class", help="only mailboxes whose last failed sync raised this, e.g. HttpError403")
+    parser.add_argument("--max-messages", type=int, default=0, help="stop after pulling this many (0: drain)")
+    parser.add_argument("--concurrency", type=int, default=cfg.pull_concurrency)
+    parser.add_argument("--rate", type=float, default=5.0, help="replays per second")
+    args = parser.parse_args()
+    if not args.subscription:
+        parser.error("set GCP_PUBSUB_DLQ_SUBSCRIPTION or pass --subscription")
+
+    setup_logging(cfg.log_level)
+    ctx = build_worker_context(cfg)
+    try:
+        report = DeadLetterReplayer(
+            cfg.project_id,
+            args.subscription,
+            handler=lambda message: handle_pubsub_message(message, ctx),
+            last_error_of=lambda email: (get_last_error(ctx.kv, email) or {}).get("class"),
+            replay_filter=ReplayFilter(
+                users=args.user, since=args.since, until=args.until, error_class=args.error_class
+            ),
+            concurrency=args.concurrency,
+            replays_per_sec=args.rate,
+            dry_run=args.dry_run,
+        ).run(max_messages=args.max_messages)
+    finally:
+        ctx.close()
+    print(json.dumps(dataclasses.asdict(report), indent=2, sort_keys=True))
 
 
+if __name__ == "__main__":
+    main()
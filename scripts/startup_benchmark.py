@@ -0,0 +1,116 @@
+"""Cold-start benchmark.
+
+Starts fresh interpreters and reports, per phase, how long a new worker
+takes: interpreter start, importing src.main, building the worker context
+(KV, clients, label warm-up), and handling its first notification end to end
+against the offline simulator (src.sim). Then, in the same process, the cost
+of the backends that are imported only when used: the Gmail discovery client
+and the Firestore client library.
+
+    python -m scripts.startup_benchmark --runs 10
+    python -m scripts.startup_benchmark --eager-imports   # import every backend up front, as before
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PHASES = ["process_start_ms", "import_ms", "context_ms", "first_message_ms", "to_first_ack_ms", "gmail_client_ms", "firestore_import_ms"]
+
+
+def _ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 1)
+
+
+def child(args) -> None:
+    started = time.time()
+    report = {"started": started}
+
+    t = time.perf_counter()
+    if args.eager_imports:
+        import src.gmail.auth  # noqa: F401
+        import src.storage.firestore_kv  # noqa: F401
+    from src.config import Config
+    from src.main import build_kv, handle_pubsub_message
+    report["import_ms"] = _ms(t)
+
+    from src.sim.gmail import FakeGmailBackend
+    from src.sim.pubsub import SimSubscription
+    from src.storage.cursors import advance_history_cursor
+    from src.worker.context import WorkerContext
+
+    os.environ["STORE_BACKEND"] = "memory"
+    cfg = Config()
+    cfg.store_backend = "memory"
+    cfg.team_users = ["alice@example.com", "bob@example.com"]
+    subscription = SimSubscription(max_outstanding=1, concurrency=1)
+    backend = FakeGmailBackend(latency_seconds=args.latency_ms / 1000.0, notify=subscription.publish_notification)
+
+    t = time.perf_counter()
+    ctx = WorkerContext(cfg, build_kv(cfg), backend)
+    ctx.labels.warm(cfg.team_users, cfg.label_name)
+    report["context_ms"] = _ms(t)
+
+    for user in cfg.team_users:
+        advance_history_cursor(ctx.kv, user, str(backend.watch(user, cfg.watch_label_ids, cfg.watch_label_filter_behavior)))
+    backend.deliver(cfg.team_users[0], "Training Exercise")
+    stats = subscription.run(lambda message: handle_pubsub_message(message, ctx))
+    ctx.close()
+    if stats.acked != 1:
+        raise SystemExit(f"first message was not acked: {stats}")
+    report["first_message_ms"] = round(stats.ack_latencies[0] * 1000, 1)
+    report["to_first_ack_ms"] = round((time.time() - started) * 1000, 1)
+
+    t = time.perf_counter()
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    from src.gmail.auth import _discovery_document
+
+    build_from_document(_discovery_document(cache_dir=cfg.gmail_discovery_cache_dir), http=httplib2.Http())
+    report["gmail_client_ms"] = _ms(t)
+
+    t = time.perf_counter()
+    import src.storage.firestore_kv  # noqa: F401,F811
+    report["firestore_import_ms"] = _ms(t)
+    print(json.dumps(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated Gmail round trip")
+    parser.add_argument("--eager-imports", action="store_true", help="import the Gmail and Firestore backends first")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    command = [sys.executable, "-m", "scripts.startup_benchmark", "--child", "--latency-ms", str(args.latency_ms)]
+    if args.eager_imports:
+        command.append("--eager-imports")
+    runs = []
+    for _ in range(args.runs):
+        spawned = time.time()
+        out = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        run = json.loads(out.strip().splitlines()[-1])
+        run["process_start_ms"] = round((run.pop("started") - spawned) * 1000, 1)
+        run["to_first_ack_ms"] = round(run["to_first_ack_ms"] + run["process_start_ms"], 1)
+        runs.append(run)
+
+    report = {
+        "runs": args.runs,
+        "eager_imports": args.eager_imports,
+        "python": sys.version.split()[0],
+    }
+    for phase in PHASES:
+        values = [run[phase] for run in runs]
+        report[phase] = {"median": round(statistics.median(values), 1), "max": max(values)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
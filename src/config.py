@@ -9,18 +9,74 @@ class Config:
     topic: str = os.getenv("GCP_PUBSUB_TOPIC", "")
     subscription: str = os.getenv("GCP_PUBSUB_SUBSCRIPTION", "")
     dlq_topic: str = os.getenv("GCP_PUBSUB_DLQ_TOPIC", "")
+    dlq_subscription: str = os.getenv("GCP_PUBSUB_DLQ_SUBSCRIPTION", "")
     team_users: List[str] = None
     label_name: str = os.getenv("GMAIL_LABEL_NAME", "Training Exercise")
+    # Subjects to share: 'kind:pattern' rules separated by ';' (kinds: exact, prefix, suffix, contains, regex)
+    subject_rules: str = os.getenv("SUBJECT_RULES", "")
+    # Watches notify only for messages with these labels ("include") or without them ("exclude"); empty: everything
+    watch_label_ids: List[str] = None
+    watch_label_filter_behavior: str = os.getenv("WATCH_LABEL_FILTER_BEHAVIOR", "include")
+    # Renew each watch this long before it expires, spread over a per-mailbox window; 0 check interval disables renewal
+    watch_renew_before_seconds: int = int(os.getenv("WATCH_RENEW_BEFORE_SECONDS", "86400"))
+    watch_renew_spread_seconds: int = int(os.getenv("WATCH_RENEW_SPREAD_SECONDS", "86400"))
+    watch_renew_check_seconds: int = int(os.getenv("WATCH_RENEW_CHECK_SECONDS", "3600"))
     store_backend: str = os.getenv("STORE_BACKEND", "firestore")
     firestore_collection_prefix: str = os.getenv("FIRESTORE_COLLECTION_PREFIX", "gts")
+    # Local read-through cache in front of the store; KV_CACHE_SIZE=0 disables it
+    kv_cache_size: int = int(os.getenv("KV_CACHE_SIZE", "10000"))
+    kv_cache_ttl_seconds: int = int(os.getenv("KV_CACHE_TTL_SECONDS", "300"))
+    # Processed-message ledger records expire this long after a message was last handled; 0 keeps them forever
+    ledger_ttl_days: int = int(os.getenv("LEDGER_TTL_DAYS", "30"))
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    # Prometheus text endpoint at :METRICS_PORT/metrics; 0 disables metrics
+    metrics_port: int = int(os.getenv("METRICS_PORT", "0"))
     google_application_credentials: str = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "")
+    gmail_pool_max_users: int = int(os.getenv("GMAIL_POOL_MAX_USERS", "256"))
+    gmail_creds_refresh_margin_seconds: int = int(os.getenv("GMAIL_CREDS_REFRESH_MARGIN_SECONDS", "300"))
+    # Where to keep the Gmail discovery document when googleapiclient does not bundle it; empty: fetch per process
+    gmail_discovery_cache_dir: str = os.getenv("GMAIL_DISCOVERY_CACHE_DIR", "")
+    # Gmail quota units per second; 0 disables the limiter
+    gmail_user_quota_units_per_sec: int = int(os.getenv("GMAIL_USER_QUOTA_UNITS_PER_SEC", "250"))
+    gmail_project_quota_units_per_sec: int = int(os.getenv("GMAIL_PROJECT_QUOTA_UNITS_PER_SEC", "20000"))
 
     pull_max_messages: int = int(os.getenv("PULL_MAX_MESSAGES", "50"))
     pull_concurrency: int = int(os.getenv("PULL_CONCURRENCY", "10"))
     ack_deadline_seconds: int = int(os.getenv("ACK_DEADLINE_SECONDS", "60"))
     max_delivery_attempts: int = int(os.getenv("MAX_DELIVERY_ATTEMPTS", "10"))
+    max_lease_seconds: int = int(os.getenv("MAX_LEASE_SECONDS", "600"))
+    drain_timeout_seconds: int = int(os.getenv("DRAIN_TIMEOUT_SECONDS", "30"))
+    # Several replicas on one subscription: each mailbox is synced under a KV lease with this TTL; 0 = single replica
+    mailbox_lease_seconds: int = int(os.getenv("MAILBOX_LEASE_SECONDS", "0"))
+    worker_id: str = os.getenv("WORKER_ID", "")
+
+    # Circuit breakers (per mailbox / per dependency) and the share of calls that may be retries
+    breaker_failure_threshold: int = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    breaker_dependency_failure_threshold: int = int(os.getenv("BREAKER_DEPENDENCY_FAILURE_THRESHOLD", "20"))
+    breaker_reset_seconds: int = int(os.getenv("BREAKER_RESET_SECONDS", "30"))
+    retry_budget_ratio: float = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+
+    # Messages larger than this are not shared; raw fetches are chunked to about RAW_BATCH_MAX_BYTES
+    max_message_bytes: int = int(os.getenv("MAX_MESSAGE_BYTES", str(36 * 1024 * 1024)))
+    raw_batch_max_bytes: int = int(os.getenv("RAW_BATCH_MAX_BYTES", str(16 * 1024 * 1024)))
+
+    # Used only when the history cursor has expired (history.list 404)
+    resync_lookback_days: int = int(os.getenv("RESYNC_LOOKBACK_DAYS", "7"))
+    resync_batch_size: int = int(os.getenv("RESYNC_BATCH_SIZE", "100"))
+
+    # scripts/backfill.py: messages shared per second across all mailboxes, and mailboxes handled at once
+    backfill_max_messages_per_sec: float = float(os.getenv("BACKFILL_MAX_MESSAGES_PER_SEC", "20"))
+    backfill_concurrency: int = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+
+    # "threads" runs syncs on callback threads; "async" runs them as coroutines on one event loop
+    worker_mode: str = os.getenv("WORKER_MODE", "threads")
+    async_max_connections: int = int(os.getenv("ASYNC_MAX_CONNECTIONS", "100"))
+
+    # "parallel" fans out to team mailboxes on a shared pool capped by PULL_CONCURRENCY; "serial" walks them in order
+    fanout_mode: str = os.getenv("FANOUT_MODE", "parallel")
+    fanout_per_target_concurrency: int = int(os.getenv("FANOUT_PER_TARGET_CONCURRENCY", "2"))
 
     def __post_init__(self):
         self.team_users = [u.strip() for u in os.getenv("TEAM_USERS", "").split(",") if u.strip()]
+        self.watch_label_ids = [lb.strip() for lb in os.getenv("WATCH_LABEL_IDS", "INBOX").split(",") if lb.strip()]
 
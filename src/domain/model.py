@@ -0,0 +1,44 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class TargetOutcome:
+    """What one event did to one team mailbox."""
+
+    target: str
+    inserted: List[str] = field(default_factory=list)  # rfc822 Message-Ids inserted
+    skipped: List[str] = field(default_factory=list)  # already present or processed
+    labelled: int = 0
+    # rfc822 Message-Id -> (message id, thread id) in this mailbox, (None, None) where not found
+    located: Dict[str, Tuple[Optional[str], Optional[str]]] = field(default_factory=dict)
+    error: Optional[BaseException] = None
+
+
+class FanoutError(Exception):
+    """Raised after fan-out completes when one or more targets failed."""
+
+    def __init__(self, outcomes: Dict[str, TargetOutcome]):
+        self.outcomes = outcomes
+        failed = {t: o.error for t, o in outcomes.items() if o.error is not None}
+        self.errors = failed
+        super().__init__(f"fan-out failed for {len(failed)} target(s): " + ", ".join(sorted(failed)))
+
+
+@dataclass
+class HistoryPage:
+    """One page of a history scan: new message ids and how far the scan has got."""
+
+    message_ids: List[str]
+    last_history_id: Optional[str]
+
+
+@dataclass
+class RawMessage:
+    """A message fetched with format=raw. ``raw`` stays base64url-encoded as Gmail returned it."""
+
+    id: str
+    raw: str
+    thread_id: Optional[str] = None
+    size_estimate: int = 0
+    headers: Dict[str, str] = field(default_factory=dict)
@@ -1,9 +1,97 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence
+
 TARGET_SUBJECT = "Training Exercise"
 
+RULE_KINDS = ("exact", "prefix", "suffix", "contains", "regex")
+# Subject equals TARGET_SUBJECT or ends with it (after stripping whitespace).
+DEFAULT_RULES = f"suffix:{TARGET_SUBJECT}"
 
-def subject_matches(subject: str) -> bool:
-    if subject is None:
-        return False
-    s = subject.strip()
-    return s == TARGET_SUBJECT or s.endswith(TARGET_SUBJECT)
 
+@dataclass(frozen=True)
+class Rule:
+    kind: str  # one of RULE_KINDS
+    pattern: str
+
+    def regex(self) -> str:
+        if self.kind == "regex":
+            return f"(?:{self.pattern})"
+        text = re.escape(self.pattern)
+        if self.kind == "exact":
+            return rf"^\s*{text}\s*$"
+        if self.kind == "prefix":
+            return rf"^\s*{text}"
+        if self.kind == "suffix":
+            return rf"{text}\s*$"
+        return text
+
+    def gmail_term(self) -> Optional[str]:
+        """A Gmail search term matching at least every subject this rule matches; None for regexes."""
+        if self.kind == "regex":
+            return None
+        return 'subject:"{}"'.format(self.pattern.replace('"', " ").strip())
+
+
+class SubjectRules:
+    """A rule set compiled once into a single regex, plus its Gmail search equivalent."""
+
+    def __init__(self, rules: Sequence[Rule]):
+        if not rules:
+            raise ValueError("at least one subject rule is required")
+        self.rules = tuple(rules)
+        try:
+            self._pattern = re.compile("|".join(r.regex() for r in self.rules))
+        except re.error as exc:
+            raise ValueError(f"invalid subject rule regex: {exc}") from exc
+        terms = [r.gmail_term() for r in self.rules]
+        unique = list(dict.fromkeys(terms))
+        if None in unique:
+            # A regex cannot be pushed to Gmail search: callers must filter every message themselves.
+            self.query: Optional[str] = None
+        elif len(unique) == 1:
+            self.query = unique[0]
+        else:
+            self.query = "{" + " ".join(unique) + "}"
+
+    def matches(self, subject: Optional[str]) -> bool:
+        if subject is None:
+            return False
+        return self._pattern.search(subject) is not None
+
+    def search_query(self, after: Optional[int] = None) -> str:
+        """Gmail q= for matching messages (received after the epoch second, if given)."""
+        parts: List[str] = []
+        if self.query:
+            parts.append(self.query)
+        if after is not None:
+            parts.append(f"after:{int(after)}")
+        return " ".join(parts)
+
+
+def parse_rules(spec: str) -> List[Rule]:
+    """'kind:pattern' entries separated by ';', e.g. 'suffix:Training Exercise;regex:^\\[Drill \\d+\\]'."""
+    rules = []
+    for entry in spec.split(";"):
+        if not entry.strip():
+            continue
+        kind, sep, pattern = entry.strip().partition(":")
+        kind = kind.strip().lower()
+        if not sep or kind not in RULE_KINDS or not pattern.strip():
+            raise ValueError(f"invalid subject rule {entry!r}; expected one of {', '.join(RULE_KINDS)} as 'kind:pattern'")
+        rules.append(Rule(kind, pattern if kind == "regex" else pattern.strip()))
+    return rules
+
+
+@lru_cache(maxsize=None)
+def compile_rules(spec: str = DEFAULT_RULES) -> SubjectRules:
+    return SubjectRules(parse_rules(spec))
+
+
+def rules_for(cfg) -> SubjectRules:
+    return compile_rules(cfg.subject_rules or DEFAULT_RULES)
+
+
+def subject_matches(subject: str) -> bool:
+    return compile_rules().matches(subject)
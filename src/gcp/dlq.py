@@ -0,0 +1,289 @@
+import datetime
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from google.api_core import exceptions as gexc
+from google.cloud import pubsub_v1
+
+from src.utils.ratelimit import TokenBucket
+
+# Ack ids per acknowledge / modifyAckDeadline call, and messages per pull (the API maximum).
+ACK_BATCH_SIZE = 1000
+PULL_BATCH_SIZE = 1000
+# Pulled messages are kept leased with this deadline, extended every third of it, until acked or released.
+HOLD_DEADLINE_SECONDS = 120
+# Pulls in a row that bring nothing new (only redeliveries) before the subscription counts as drained.
+MAX_STALE_PULLS = 3
+
+
+class _ReplayMessage:
+    """The bits of a Pub/Sub message handle_pubsub_message reads."""
+
+    def __init__(self, data: bytes, attributes: Dict[str, str]):
+        self.data = data
+        self.attributes = attributes
+
+
+@dataclass
+class ReplayFilter:
+    users: Sequence[str] = ()  # empty: every mailbox
+    since: Optional[datetime.datetime] = None  # on publish time
+    until: Optional[datetime.datetime] = None
+    error_class: Optional[str] = None  # matches the class recorded by the worker's last failed sync
+
+    def matches(self, email: str, published: Optional[datetime.datetime], last_error: Optional[str]) -> bool:
+        if self.users and email.lower() not in {u.lower() for u in self.users}:
+            return False
+        if published is not None and self.since is not None and published < self.since:
+            return False
+        if published is not None and self.until is not None and published >= self.until:
+            return False
+        if self.error_class is not None and (last_error or "unknown") != self.error_class:
+            return False
+        return True
+
+
+@dataclass
+class ReplayReport:
+    pulled: int = 0
+    unparseable: int = 0
+    filtered_out: int = 0
+    deduped: int = 0  # acked without a replay of their own
+    replayed: Dict[str, str] = field(default_factory=dict)  # mailbox -> historyId replayed
+    failed: Dict[str, str] = field(default_factory=dict)  # mailbox -> error
+    acked: int = 0
+
+
+class _AckKeeper:
+    """Extends the ack deadline of every held ack id on a timer, so Pub/Sub does not redeliver them mid-run."""
+
+    def __init__(self, extend: Callable[[List[str], int], None]):
+        self._extend = extend
+        self._ids: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="dlq-ack-keeper", daemon=True)
+        self._thread.start()
+
+    def hold(self, ack_ids: List[str]) -> None:
+        with self._lock:
+            self._ids.update(ack_ids)
+        # The subscription's own deadline may be shorter than a replay round; extend right away.
+        self._extend(ack_ids, HOLD_DEADLINE_SECONDS)
+
+    def drop(self, ack_ids: List[str]) -> None:
+        with self._lock:
+            self._ids.difference_update(ack_ids)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(HOLD_DEADLINE_SECONDS / 3):
+            with self._lock:
+                ids = list(self._ids)
+            if ids:
+                self._extend(ids, HOLD_DEADLINE_SECONDS)
+
+
+@dataclass
+class _Group:
+    email: str
+    history_id: int = 0
+    data: bytes = b""
+    attributes: Dict[str, str] = field(default_factory=dict)
+    ack_ids: List[str] = field(default_factory=list)
+
+
+class DeadLetterReplayer:
+    """Drain a dead-letter subscription with synchronous pull and replay it.
+
+    Notifications are grouped per mailbox and only the highest historyId is
+    replayed (a sync covers everything before it); on success every message
+    in the group is acked. Failed and filtered-out messages are held until the
+    run ends and then released (ack deadline 0), so nothing is lost. Every
+    message pulled and not yet acked keeps its lease extended meanwhile.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        subscription: str,
+        handler: Callable[[_ReplayMessage], None],
+        last_error_of: Callable[[str], Optional[str]] = lambda email: None,
+        replay_filter: Optional[ReplayFilter] = None,
+        concurrency: int = 8,
+        replays_per_sec: float = 5.0,
+        dry_run: bool = False,
+        client=None,
+    ):
+        self.handler = handler
+        self.last_error_of = last_error_of
+        self._last_errors: Dict[str, Optional[str]] = {}  # per mailbox, looked up once per run
+        self.filter = replay_filter or ReplayFilter()
+        self.concurrency = max(1, concurrency)
+        self.limiter = TokenBucket(replays_per_sec) if replays_per_sec > 0 else None
+        self.dry_run = dry_run
+        self.client = client or pubsub_v1.SubscriberClient()
+        self.path = self.client.subscription_path(project_id, subscription)
+
+    def run(self, max_messages: int = 0) -> ReplayReport:
+        """Pull and replay until the subscription is empty (or max_messages were pulled)."""
+        report = ReplayReport()
+        # mailbox -> highest historyId already replayed successfully in this run
+        done: Dict[str, int] = {}
+        acked: Set[str] = set()  # message ids acked in this run
+        seen: Set[str] = set()
+        held: List[str] = []  # released when the run ends, so later pulls do not return them again
+        keeper = _AckKeeper(self._modify_deadline)
+        stale = 0
+        try:
+            while not max_messages or report.pulled < max_messages:
+                want = PULL_BATCH_SIZE if not max_messages else min(PULL_BATCH_SIZE, max_messages - report.pulled)
+                received = self._pull(want)
+                if not received:
+                    break
+                keeper.hold([rm.ack_id for rm in received])
+                fresh = [rm for rm in received if rm.message.message_id not in seen]
+                # A redelivery of a message handled earlier in the run needs nothing more than its ack;
+                # one of a message still held is held with it.
+                again = [rm.ack_id for rm in received if rm.message.message_id in acked]
+                held.extend(
+                    rm.ack_id for rm in received if rm.message.message_id in seen and rm.message.message_id not in acked
+                )
+                self._settle(again, keeper, report)
+                if not fresh:
+                    stale += 1
+                    if stale >= MAX_STALE_PULLS:
+                        break
+                    continue
+                stale = 0
+                seen.update(rm.message.message_id for rm in fresh)
+                report.pulled += len(fresh)
+                groups, skipped = self._group(fresh, report)
+                to_ack, to_release = self._replay_round(groups, done, report)
+                held.extend(skipped)
+                held.extend(to_release)
+                if self.dry_run:
+                    held.extend(to_ack)
+                else:
+                    message_of = {rm.ack_id: rm.message.message_id for rm in fresh}
+                    acked.update(message_of[ack_id] for ack_id in to_ack)
+                    self._settle(to_ack, keeper, report)
+        finally:
+            keeper.close()
+            self._modify_deadline(held, 0)
+            self.client.close()
+        return report
+
+    def _settle(self, ack_ids: List[str], keeper: _AckKeeper, report: ReplayReport) -> None:
+        if not ack_ids or self.dry_run:
+            return
+        self._ack(ack_ids)
+        keeper.drop(ack_ids)
+        report.acked += len(ack_ids)
+
+    def _pull(self, max_messages: int):
+        try:
+            resp = self.client.pull(request={"subscription": self.path, "max_messages": max_messages}, timeout=30)
+        except gexc.DeadlineExceeded:
+            return []
+        return list(resp.received_messages)
+
+    def _group(self, received, report: ReplayReport):
+        groups: Dict[str, _Group] = {}
+        skipped: List[str] = []
+        for rm in received:
+            msg = rm.message
+            try:
+                payload = json.loads(msg.data.decode("utf-8"))
+                email = payload["emailAddress"]
+                history_id = int(payload["historyId"])
+            except (ValueError, KeyError, TypeError):
+                # Not a Gmail notification at all: replaying would skip it too, so just drop it.
+                report.unparseable += 1
+                groups.setdefault("", _Group(email="")).ack_ids.append(rm.ack_id)
+                continue
+            published = msg.publish_time if msg.publish_time else None
+            last_error = self._last_error(email) if self.filter.error_class is not None else None
+            if not self.filter.matches(email, published, last_error):
+                report.filtered_out += 1
+                skipped.append(rm.ack_id)
+                continue
+            group = groups.setdefault(email.lower(), _Group(email=email))
+            group.ack_ids.append(rm.ack_id)
+            if history_id > group.history_id:
+                group.history_id = history_id
+                group.data = msg.data
+                group.attributes = dict(msg.attributes)
+        return groups, skipped
+
+    def _last_error(self, email: str) -> Optional[str]:
+        key = email.lower()
+        if key not in self._last_errors:
+            self._last_errors[key] = self.last_error_of(email)
+        return self._last_errors[key]
+
+    def _replay_round(self, groups: Dict[str, _Group], done: Dict[str, int], report: ReplayReport):
+        to_ack: List[str] = list(groups.pop("", _Group(email="")).ack_ids)
+        to_release: List[str] = []
+        todo: List[_Group] = []
+        for key, group in groups.items():
+            if done.get(key, -1) >= group.history_id:
+                # An earlier round already synced this mailbox past these notifications.
+                report.deduped += len(group.ack_ids)
+                to_ack.extend(group.ack_ids)
+            else:
+                report.deduped += len(group.ack_ids) - 1
+                todo.append(group)
+
+        if self.dry_run:
+            for group in todo:
+                report.replayed[group.email] = str(group.history_id)
+                to_release.extend(group.ack_ids)
+            return to_ack, to_release
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="dlq-replay") as pool:
+            results = dict(zip((g.email for g in todo), pool.map(self._replay_one, todo)))
+        for group in todo:
+            error = results[group.email]
+            if error is None:
+                done[group.email.lower()] = group.history_id
+                report.replayed[group.email] = str(group.history_id)
+                report.failed.pop(group.email, None)
+                to_ack.extend(group.ack_ids)
+            else:
+                report.failed[group.email] = error
+                to_release.extend(group.ack_ids)
+        return to_ack, to_release
+
+    def _replay_one(self, group: _Group) -> Optional[str]:
+        if self.limiter is not None:
+            self.limiter.acquire()
+        try:
+            self.handler(_ReplayMessage(group.data, group.attributes))
+        except Exception as exc:  # noqa: BLE001
+            logging.warning("Replay for %s at historyId %s failed: %r", group.email, group.history_id, exc)
+            return repr(exc)
+        return None
+
+    def _ack(self, ack_ids: List[str]) -> None:
+        for i in range(0, len(ack_ids), ACK_BATCH_SIZE):
+            self.client.acknowledge(request={"subscription": self.path, "ack_ids": ack_ids[i : i + ACK_BATCH_SIZE]})
+
+    def _modify_deadline(self, ack_ids: List[str], seconds: int) -> None:
+        """Extend the lease of ack_ids, or release them back to the subscription with seconds=0."""
+        for i in range(0, len(ack_ids), ACK_BATCH_SIZE):
+            batch = ack_ids[i : i + ACK_BATCH_SIZE]
+            try:
+                self.client.modify_ack_deadline(
+                    request={"subscription": self.path, "ack_ids": batch, "ack_deadline_seconds": seconds}
+                )
+            except gexc.GoogleAPICallError:
+                # Leases that already expired are back on the subscription anyway.
+                logging.warning("Could not modify the ack deadline of %d dead letters", len(batch), exc_info=True)
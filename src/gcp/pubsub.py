@@ -1,26 +1,113 @@
+import logging
+import signal
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Optional
+
 from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
 
 
 class Subscriber:
-    def __init__(self, project_id: str, subscription: str, callback):
+    def __init__(
+        self,
+        project_id: str,
+        subscription: str,
+        callback,
+        on_shutdown: Optional[Callable[[], None]] = None,
+        max_messages: int = 50,
+        max_workers: int = 10,
+        ack_deadline_seconds: int = 60,
+        max_lease_seconds: int = 600,
+        drain_timeout_seconds: float = 30.0,
+    ):
         self.project_id = project_id
         self.subscription = subscription
         self.callback = callback
+        self.on_shutdown = on_shutdown
+        self.max_workers = max_workers
+        self.drain_timeout_seconds = drain_timeout_seconds
+        # Bound how much is pulled into memory, and keep extending leases for slow
+        # messages (each extension at least one ack deadline) up to max_lease_seconds.
+        self.flow_control = pubsub_v1.types.FlowControl(
+            max_messages=max_messages,
+            max_lease_duration=max_lease_seconds,
+            min_duration_per_lease_extension=ack_deadline_seconds,
+        )
         self.subscriber = pubsub_v1.SubscriberClient()
         self.path = self.subscriber.subscription_path(project_id, subscription)
+        self._stopping = threading.Event()
 
     def start(self):
-        streaming_pull_future = self.subscriber.subscribe(self.path, callback=self._on_message)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pubsub-callback")
+        streaming_pull_future = self.subscriber.subscribe(
+            self.path,
+            callback=self._on_message,
+            flow_control=self.flow_control,
+            scheduler=ThreadScheduler(executor),
+            await_callbacks_on_shutdown=True,
+        )
+        self._install_signal_handlers()
         try:
-            streaming_pull_future.result()  # block
+            while not self._stopping.is_set():
+                try:
+                    streaming_pull_future.result(timeout=1.0)  # block
+                    break
+                except FutureTimeout:
+                    continue
         except KeyboardInterrupt:
-            streaming_pull_future.cancel()
+            pass
+        finally:
+            self._drain(streaming_pull_future)
+            self.close()
+
+    def stop(self):
+        self._stopping.set()
+
+    def close(self):
+        self.subscriber.close()
+        if self.on_shutdown is not None:
+            self.on_shutdown()
+
+    def _install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: self.stop())
+
+    def _drain(self, streaming_pull_future):
+        """Stop pulling, then wait up to drain_timeout_seconds for in-flight callbacks.
+
+        Messages still buffered by flow control are nacked by the client library;
+        callbacks that outlive the timeout are left unacked and will be redelivered.
+        """
+        self._stopping.set()
+        canceller = threading.Thread(target=streaming_pull_future.cancel, name="pubsub-drain", daemon=True)
+        canceller.start()
+        canceller.join(self.drain_timeout_seconds)
+        if canceller.is_alive():
+            logging.warning("Drain timed out after %.0fs; in-flight messages will be redelivered", self.drain_timeout_seconds)
 
     def _on_message(self, message: pubsub_v1.subscriber.message.Message):
+        if self._stopping.is_set():
+            message.nack()
+            return
         try:
-            self.callback(message)
-            message.ack()
+            result = self.callback(message)
         except Exception:  # noqa: BLE001
             # transient error: let Pub/Sub redeliver
             message.nack()
+            return
+        if isinstance(result, Future):
+            # Handed off to the async worker: settle the message when that work finishes.
+            result.add_done_callback(lambda fut: self._settle(message, fut))
+            return
+        message.ack()
 
+    @staticmethod
+    def _settle(message, fut: Future):
+        if fut.cancelled() or fut.exception() is not None:
+            message.nack()
+        else:
+            message.ack()
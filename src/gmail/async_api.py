@@ -0,0 +1,207 @@
+"""Async counterparts of the Gmail helpers in history.py, messages.py and labels.py.
+
+They take an AsyncGmail client, go through the same quota limiter, breakers
+and retry policy (gmail_call_async), and return the same shapes as the sync
+helpers; request parameters and response parsing come from those modules.
+Where the sync code uses the batch endpoint, these issue individual
+requests concurrently instead.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.domain.model import HistoryPage, RawMessage
+from src.gmail.history import MAX_PAGE_SIZE, HistoryScan, history_params
+from src.gmail.labels import label_key, label_named, new_label_body
+from src.gmail.messages import (
+    METADATA_HEADERS,
+    SIMPLE_INSERT_MAX_CHARS,
+    decode_raw,
+    first_location,
+    message_ids,
+    raw_message,
+)
+from src.gmail.quota import gmail_call_async
+from src.utils.retry import http_status
+
+# Requests one *_many helper keeps in flight for a single mailbox.
+FETCH_CONCURRENCY = 10
+
+
+async def _gather_bounded(ids: List[str], fetch: Callable[[str], Awaitable[Dict]]) -> Dict[str, Dict]:
+    """Run fetch(id) for every id, FETCH_CONCURRENCY at a time; ids that 404 are left out."""
+    sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+    results: Dict[str, Dict] = {}
+
+    async def _one(msg_id: str):
+        async with sem:
+            try:
+                results[msg_id] = await fetch(msg_id)
+            except Exception as exc:  # noqa: BLE001
+                if http_status(exc) != 404:
+                    raise
+                logging.info("Message %s no longer exists; skipping", msg_id)
+
+    await _gather_or_cancel([_one(mid) for mid in dict.fromkeys(ids)])
+    return results
+
+
+async def _gather_or_cancel(coros: List[Awaitable]) -> None:
+    """Await every coroutine; on the first error, cancel the rest before raising it."""
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Otherwise they keep spending quota for a result nobody will read.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def iter_history_pages(
+    gmail, start_history_id: str, page_size: int = MAX_PAGE_SIZE, label_id: Optional[str] = None
+) -> AsyncIterator[HistoryPage]:
+    """Async iter_history_pages; same paging, dedupe and last_history_id semantics."""
+    scan = HistoryScan()
+    page_token = None
+    while True:
+        params = history_params(start_history_id, page_size, label_id, page_token)
+        resp = await gmail_call_async(gmail, "history.list", lambda: gmail.history_list(**params))
+        page_token = resp.get("nextPageToken")
+        yield scan.page(resp)
+        if not page_token:
+            break
+
+
+async def get_profile_history_id(gmail) -> Optional[str]:
+    res = await gmail_call_async(gmail, "users.getProfile", gmail.get_profile)
+    hid = res.get("historyId")
+    return str(hid) if hid is not None else None
+
+
+async def get_metadata_many(gmail, msg_ids: List[str]) -> Dict[str, Dict]:
+    async def _fetch(msg_id: str):
+        return await gmail_call_async(
+            gmail,
+            "messages.get",
+            lambda: gmail.messages_get(msg_id, format="metadata", metadataHeaders=METADATA_HEADERS),
+        )
+
+    return await _gather_bounded(msg_ids, _fetch)
+
+
+async def get_minimal_many(gmail, msg_ids: List[str]) -> Dict[str, Dict]:
+    async def _fetch(msg_id: str):
+        return await gmail_call_async(gmail, "messages.get", lambda: gmail.messages_get(msg_id, format="minimal"))
+
+    return await _gather_bounded(msg_ids, _fetch)
+
+
+async def get_raw_messages_many(gmail, msg_ids: List[str]) -> Dict[str, RawMessage]:
+    async def _fetch(msg_id: str):
+        return await gmail_call_async(gmail, "messages.get", lambda: gmail.messages_get(msg_id, format="raw"))
+
+    results = await _gather_bounded(msg_ids, _fetch)
+    return {mid: raw_message(mid, res) for mid, res in results.items()}
+
+
+async def insert_raw_message(gmail, message: RawMessage) -> Dict:
+    if len(message.raw) <= SIMPLE_INSERT_MAX_CHARS:
+        return await gmail_call_async(gmail, "messages.insert", lambda: gmail.messages_insert({"raw": message.raw}))
+    rfc822 = decode_raw(message.raw)
+    return await gmail_call_async(gmail, "messages.insert", lambda: gmail.messages_insert_media(rfc822))
+
+
+async def find_message_by_rfc822(gmail, rfc822_msgid: str) -> Tuple[Optional[str], Optional[str]]:
+    res = await gmail_call_async(
+        gmail, "messages.list", lambda: gmail.messages_list(q=f"rfc822msgid:{rfc822_msgid}", maxResults=1)
+    )
+    return first_location(res)
+
+
+async def iter_search_pages(gmail, q: str, page_size: int = 100) -> AsyncIterator[List[str]]:
+    page_token = None
+    while True:
+        params = {"q": q, "maxResults": page_size}
+        if page_token:
+            params["pageToken"] = page_token
+        res = await gmail_call_async(gmail, "messages.list", lambda: gmail.messages_list(**params))
+        ids = message_ids(res)
+        if ids:
+            yield ids
+        page_token = res.get("nextPageToken")
+        if not page_token:
+            break
+
+
+async def find_label(gmail, label_name: str) -> Optional[str]:
+    return label_named(await gmail_call_async(gmail, "labels.list", gmail.labels_list), label_name)
+
+
+async def ensure_label(gmail, label_name: str) -> str:
+    label_id = await find_label(gmail, label_name)
+    if label_id:
+        return label_id
+    body = new_label_body(label_name)
+    try:
+        res = await gmail_call_async(gmail, "labels.create", lambda: gmail.labels_create(body))
+    except Exception as exc:  # noqa: BLE001
+        # 409: created concurrently by another worker
+        if http_status(exc) != 409:
+            raise
+        label_id = await find_label(gmail, label_name)
+        if not label_id:
+            raise
+        return label_id
+    return res["id"]
+
+
+async def label_threads(gmail, thread_ids: Iterable[str], label_id: str) -> None:
+    body = {"addLabelIds": [label_id]}
+    sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async def _one(tid: str):
+        async with sem:
+            await gmail_call_async(gmail, "threads.modify", lambda: gmail.threads_modify(tid, body))
+
+    await _gather_or_cancel([_one(tid) for tid in dict.fromkeys(thread_ids)])
+
+
+async def label_messages(gmail, msg_ids: Iterable[str], label_id: str) -> None:
+    ids = list(dict.fromkeys(msg_ids))
+    for i in range(0, len(ids), 1000):
+        body = {"ids": ids[i : i + 1000], "addLabelIds": [label_id]}
+        await gmail_call_async(gmail, "messages.batchModify", lambda: gmail.messages_batch_modify(body))
+
+
+class AsyncLabelRegistry:
+    """LabelRegistry for the asyncio worker; shares its KV keys with the sync registry."""
+
+    def __init__(self, kv, auth_factory):
+        self.kv = kv
+        self.auth_factory = auth_factory
+        self._ids: Dict[Tuple[str, str], str] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    async def get(self, user_email: str, label_name: str) -> str:
+        key = (user_email.lower(), label_name)
+        label_id = self._ids.get(key)
+        if label_id:
+            return label_id
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            label_id = self._ids.get(key)
+            if label_id:
+                return label_id
+            kv_key = label_key(*key)
+            label_id = await self.kv.get(kv_key)
+            if not label_id:
+                label_id = await ensure_label(self.auth_factory(user_email), label_name)
+                await self.kv.set(kv_key, label_id)
+            self._ids[key] = label_id
+            return label_id
+
+    async def invalidate(self, user_email: str, label_name: str) -> None:
+        key = (user_email.lower(), label_name)
+        self._ids.pop(key, None)
+        await self.kv.set(label_key(*key), "")
@@ -0,0 +1,162 @@
+import asyncio
+import datetime
+import json
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import google_auth_httplib2
+import httplib2
+from google.oauth2 import service_account
+from googleapiclient.errors import HttpError
+
+from src.gmail.auth import SCOPES, _service_account_info
+
+GMAIL_API = "https://gmail.googleapis.com/gmail/v1/users/me"
+GMAIL_UPLOAD_API = "https://gmail.googleapis.com/upload/gmail/v1/users/me"
+
+
+def _http_error(status: int, headers, content: bytes, url: str) -> HttpError:
+    """Build the googleapiclient HttpError the sync client would raise, so the shared
+    predicates (http_status, is_rate_limited, retry_after_seconds, ...) apply unchanged."""
+    info = {k.lower(): v for k, v in headers.items()}
+    info["status"] = str(status)
+    return HttpError(httplib2.Response(info), content, uri=url)
+
+
+def _query(params: Optional[Dict]) -> List[Tuple[str, str]]:
+    """Flatten params into query pairs; list values become repeated keys, as the discovery client sends them."""
+    pairs: List[Tuple[str, str]] = []
+    for key, value in (params or {}).items():
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            pairs.append((key, str(item).lower() if isinstance(item, bool) else str(item)))
+    return pairs
+
+
+class AsyncGmail:
+    """Minimal Gmail REST client for one delegated user over a shared aiohttp session.
+
+    Only the calls the worker makes are implemented; each returns the decoded
+    JSON response. Errors are raised as googleapiclient HttpError.
+    """
+
+    def __init__(self, user_email: str, creds, session: aiohttp.ClientSession, refresh_margin: datetime.timedelta):
+        self.user_email = user_email
+        self.creds = creds
+        self.session = session
+        self.refresh_margin = refresh_margin
+        self._refresh_lock = asyncio.Lock()
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict] = None,
+        json_body: Optional[Dict] = None,
+        data: Optional[bytes] = None,
+        content_type: Optional[str] = None,
+        upload: bool = False,
+    ) -> Dict:
+        await self._ensure_token()
+        headers: Dict[str, str] = {}
+        self.creds.apply(headers)
+        if content_type:
+            headers["Content-Type"] = content_type
+        url = (GMAIL_UPLOAD_API if upload else GMAIL_API) + path
+        try:
+            async with self.session.request(
+                method, url, params=_query(params), json=json_body, data=data, headers=headers
+            ) as resp:
+                content = await resp.read()
+                if resp.status >= 400:
+                    raise _http_error(resp.status, resp.headers, content, str(resp.url))
+        except aiohttp.ClientConnectionError as exc:
+            # Surface as the builtin so is_retryable_googleapi_error treats it like an httplib2 socket error.
+            raise ConnectionError(str(exc)) from exc
+        return json.loads(content) if content else {}
+
+    # --- Gmail methods -------------------------------------------------
+
+    async def get_profile(self) -> Dict:
+        return await self.request("GET", "/profile")
+
+    async def history_list(self, **params) -> Dict:
+        return await self.request("GET", "/history", params=params)
+
+    async def messages_get(self, msg_id: str, **params) -> Dict:
+        return await self.request("GET", f"/messages/{msg_id}", params=params)
+
+    async def messages_list(self, **params) -> Dict:
+        return await self.request("GET", "/messages", params=params)
+
+    async def messages_insert(self, body: Dict) -> Dict:
+        return await self.request("POST", "/messages", json_body=body)
+
+    async def messages_insert_media(self, rfc822: bytes) -> Dict:
+        return await self.request(
+            "POST",
+            "/messages",
+            params={"uploadType": "media"},
+            data=rfc822,
+            content_type="message/rfc822",
+            upload=True,
+        )
+
+    async def messages_batch_modify(self, body: Dict) -> Dict:
+        return await self.request("POST", "/messages/batchModify", json_body=body)
+
+    async def threads_modify(self, thread_id: str, body: Dict) -> Dict:
+        return await self.request("POST", f"/threads/{thread_id}/modify", json_body=body)
+
+    async def labels_list(self) -> Dict:
+        return await self.request("GET", "/labels")
+
+    async def labels_create(self, body: Dict) -> Dict:
+        return await self.request("POST", "/labels", json_body=body)
+
+    async def _ensure_token(self) -> None:
+        if not self._expiring():
+            return
+        async with self._refresh_lock:
+            if self._expiring():
+                # The token exchange is rare and google-auth is synchronous: keep it off the loop.
+                request = google_auth_httplib2.Request(httplib2.Http())
+                await asyncio.get_running_loop().run_in_executor(None, self.creds.refresh, request)
+
+    def _expiring(self) -> bool:
+        expiry: Optional[datetime.datetime] = self.creds.expiry
+        if not self.creds.token or expiry is None:
+            return True
+        return expiry - datetime.datetime.utcnow() <= self.refresh_margin
+
+
+class AsyncGmailPool:
+    """AsyncGmail clients keyed by user email, sharing one aiohttp session (LRU-bounded).
+
+    Must be created and used on the event loop that runs the worker.
+    """
+
+    def __init__(self, sa_path: str, max_users: int = 256, refresh_margin_seconds: int = 300, max_connections: int = 100):
+        self.sa_path = sa_path
+        self.max_users = max_users
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections),
+            timeout=aiohttp.ClientTimeout(total=300),
+        )
+        self._clients: "OrderedDict[str, AsyncGmail]" = OrderedDict()
+
+    def __call__(self, user_email: str) -> AsyncGmail:
+        key = user_email.lower()
+        client = self._clients.get(key)
+        if client is None:
+            info = _service_account_info(self.sa_path)
+            creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES).with_subject(user_email)
+            client = self._clients[key] = AsyncGmail(user_email, creds, self.session, self.refresh_margin)
+            while len(self._clients) > self.max_users:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(key)
+        return client
+
+    async def close(self) -> None:
+        await self.session.close()
@@ -1,5 +1,19 @@
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional
+
+import google_auth_httplib2
+import httplib2
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import V2_DISCOVERY_URI, build_from_document
+from googleapiclient.http import HttpRequest
 
 
 SCOPES = [
@@ -9,8 +23,130 @@ SCOPES = [
 ]
 
 
-def gmail_client_for(user_email: str, sa_path: str):
-    creds = service_account.Credentials.from_service_account_file(sa_path, scopes=SCOPES)
-    delegated = creds.with_subject(user_email)
-    return build("gmail", "v1", credentials=delegated, cache_discovery=False)
+@lru_cache(maxsize=None)
+def _service_account_info(sa_path: str) -> Dict:
+    with open(sa_path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+@lru_cache(maxsize=None)
+def _discovery_document(api: str = "gmail", version: str = "v1", cache_dir: str = "") -> str:
+    """The API's discovery document: bundled with googleapiclient, else cache_dir, else fetched once."""
+    doc = discovery_cache.get_static_doc(api, version)
+    if doc is not None:
+        return doc
+    path = os.path.join(cache_dir, f"{api}.{version}.json") if cache_dir else ""
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fh:
+            return fh.read()
+    # Not bundled with this googleapiclient release: fetch once per process (or once per cache_dir).
+    _, content = httplib2.Http().request(V2_DISCOVERY_URI.format(api=api, apiVersion=version))
+    doc = content.decode("utf-8")
+    if path:
+        try:
+            _write_atomic(path, doc)
+        except OSError:
+            logging.warning("Could not cache the %s %s discovery document in %s", api, version, cache_dir, exc_info=True)
+    return doc
+
+
+def _write_atomic(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    # Replicas starting together may race; either copy is complete.
+    os.replace(tmp, path)
+
+
+class _PoolEntry:
+    def __init__(self, creds, client):
+        self.creds = creds
+        self.client = client
+        self.lock = threading.Lock()
+
+
+class GmailClientPool:
+    """Delegated Gmail clients keyed by user email.
+
+    Each pooled client may be used from several threads at once: every request
+    gets an ``AuthorizedHttp`` wrapping a per-thread ``httplib2.Http``, so
+    connections are reused without sharing a transport between threads.
+    """
+
+    def __init__(
+        self, sa_path: str, max_users: int = 256, refresh_margin_seconds: int = 300, discovery_cache_dir: str = ""
+    ):
+        self.sa_path = sa_path
+        self.discovery_cache_dir = discovery_cache_dir
+        self.max_users = max_users
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self._entries: "OrderedDict[str, _PoolEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __call__(self, user_email: str):
+        return self.checkout(user_email)
+
+    def checkout(self, user_email: str):
+        key = user_email.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._build_entry(user_email)
+            with self._lock:
+                # Another thread may have raced us; keep whichever landed first.
+                entry = self._entries.setdefault(key, entry)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+        self._refresh_if_expiring(entry)
+        return entry.client
+
+    def evict(self, user_email: str) -> None:
+        with self._lock:
+            self._entries.pop(user_email.lower(), None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _thread_http(self) -> httplib2.Http:
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = httplib2.Http()
+            self._local.http = http
+        return http
+
+    def _build_entry(self, user_email: str) -> _PoolEntry:
+        info = _service_account_info(self.sa_path)
+        creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES).with_subject(user_email)
+
+        def request_builder(_http, *args, **kwargs):
+            authed = google_auth_httplib2.AuthorizedHttp(creds, http=self._thread_http())
+            return HttpRequest(authed, *args, **kwargs)
+
+        client = build_from_document(
+            _discovery_document(cache_dir=self.discovery_cache_dir),
+            http=google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http()),
+            requestBuilder=request_builder,
+        )
+        # Lets per-user quota accounting (src.gmail.quota) know whose mailbox a call hits.
+        client.user_email = user_email
+        return _PoolEntry(creds, client)
+
+    def _refresh_if_expiring(self, entry: _PoolEntry) -> None:
+        if not self._expiring(entry.creds):
+            return
+        with entry.lock:
+            # Re-check under the lock so only one caller pays for the token exchange.
+            if self._expiring(entry.creds):
+                entry.creds.refresh(google_auth_httplib2.Request(self._thread_http()))
 
+    def _expiring(self, creds) -> bool:
+        expiry: Optional[datetime.datetime] = creds.expiry
+        if not creds.token or expiry is None:
+            return True
+        return expiry - datetime.datetime.utcnow() <= self.refresh_margin
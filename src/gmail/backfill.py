@@ -0,0 +1,221 @@
+"""Normalize "Training Exercise" mail across every team mailbox.
+
+Each mailbox is scanned (search + metadata, no bodies) to find which rfc822
+Message-Ids it holds and whether they carry the label. From the union, every
+Message-Id missing somewhere is shared from one mailbox that has it through
+Processor (insert + label everywhere); copies present everywhere but not
+labelled are just labelled. Progress is checkpointed in KV under
+``backfill:{run_id}:...`` so a rerun with the same run id resumes.
+"""
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.gmail.labels import find_label, label_messages, label_threads
+from src.gmail.messages import get_metadata_many, search_page
+from src.utils.ratelimit import TokenBucket
+from src.worker.sharing import shareable
+
+SCAN_PAGE_SIZE = 500
+SHARE_CHUNK_SIZE = 50
+
+
+@dataclass
+class Copy:
+    """One mailbox's copy of a message."""
+
+    msg_id: str
+    thread_id: Optional[str]
+    labelled: bool
+    size_estimate: Optional[int] = None  # None when Gmail leaves sizeEstimate out
+
+
+@dataclass
+class BackfillReport:
+    dry_run: bool
+    found: Dict[str, int] = field(default_factory=dict)  # copies per mailbox
+    unique: int = 0
+    missing: Dict[str, int] = field(default_factory=dict)  # copies to insert per mailbox
+    unlabelled: Dict[str, int] = field(default_factory=dict)  # present copies to label per mailbox
+    inserted: int = 0
+    labelled: int = 0
+    failed: Dict[str, str] = field(default_factory=dict)  # mailbox -> error
+
+
+class Backfill:
+    def __init__(
+        self,
+        cfg,
+        kv,
+        auth_factory,
+        processor,
+        run_id: str = "default",
+        dry_run: bool = False,
+        max_messages_per_sec: float = 20.0,
+        concurrency: int = 4,
+        after: Optional[int] = None,
+    ):
+        self.cfg = cfg
+        self.kv = kv
+        self.auth_factory = auth_factory
+        self.processor = processor
+        self.run_id = run_id
+        self.dry_run = dry_run
+        self.concurrency = max(1, concurrency)
+        self.after = after
+        # Caps messages shared per second across all mailboxes (inserts and labels).
+        self.throughput = TokenBucket(max_messages_per_sec) if max_messages_per_sec > 0 else None
+        self.users = list(cfg.team_users)
+
+    def run(self) -> BackfillReport:
+        report = BackfillReport(dry_run=self.dry_run)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="backfill-scan") as pool:
+            scans = dict(zip(self.users, pool.map(self._scan, self.users)))
+
+        present: Dict[str, Set[str]] = {}  # rfc822 id -> mailboxes holding it
+        for user, copies in scans.items():
+            report.found[user] = len(copies)
+            for rid in copies:
+                present.setdefault(rid, set()).add(user)
+        report.unique = len(present)
+
+        # First mailbox in TEAM_USERS order that holds a message is its source.
+        work: Dict[str, List[str]] = {user: [] for user in self.users}  # source -> rfc822 ids to share
+        relabel: Dict[str, List[Copy]] = {user: [] for user in self.users}
+        for rid in sorted(present):
+            holders = present[rid]
+            if len(holders) < len(self.users):
+                source = next(u for u in self.users if u in holders)
+                work[source].append(rid)
+                for user in self.users:
+                    if user not in holders:
+                        report.missing[user] = report.missing.get(user, 0) + 1
+            else:
+                for user in self.users:
+                    if not scans[user][rid].labelled:
+                        relabel[user].append(scans[user][rid])
+        for user, copies in relabel.items():
+            if copies:
+                report.unlabelled[user] = len(copies)
+
+        if self.dry_run:
+            return report
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="backfill-share") as pool:
+            futures = {
+                user: pool.submit(self._share_from, user, work[user], scans[user], relabel[user])
+                for user in self.users
+            }
+            for user, fut in futures.items():
+                try:
+                    inserted, labelled = fut.result()
+                    report.inserted += inserted
+                    report.labelled += labelled
+                except Exception as exc:  # noqa: BLE001
+                    logging.exception("Backfill from %s stopped", user)
+                    report.failed[user] = repr(exc)
+        return report
+
+    # --- scan -----------------------------------------------------------
+
+    def _scan(self, user: str) -> Dict[str, Copy]:
+        """rfc822 id -> Copy for every matching message in this mailbox, resuming a saved scan."""
+        state_key = self._key("scan", user)
+        state = json.loads(self.kv.get(state_key) or '{"pages": 0, "next": null, "done": false}')
+        copies: Dict[str, Copy] = {}
+        page_keys = [self._key("scan", user, str(i)) for i in range(state["pages"])]
+        for value in self.kv.get_many(page_keys).values():
+            for rid, entry in json.loads(value).items():
+                copies[rid] = Copy(*entry)
+        if state["done"]:
+            return copies
+
+        gmail = self.auth_factory(user)
+        label_id = self._label_id(user, gmail)
+        q = self.processor.rules.search_query(after=self.after)
+        page_token = state["next"]
+        while True:
+            ids, page_token = search_page(gmail, q, SCAN_PAGE_SIZE, page_token)
+            page = self._describe(gmail, ids, label_id)
+            copies.update(page)
+            if not self.dry_run:
+                self.kv.set_many({
+                    self._key("scan", user, str(state["pages"])): json.dumps(
+                        {rid: [c.msg_id, c.thread_id, c.labelled, c.size_estimate] for rid, c in page.items()}
+                    ),
+                    state_key: json.dumps({"pages": state["pages"] + 1, "next": page_token, "done": not page_token}),
+                })
+                # Locations seen here let the processor skip its rfc822msgid: searches.
+                self.processor.ledger.record({rid: {user: (c.msg_id, c.thread_id)} for rid, c in page.items()})
+            state["pages"] += 1
+            if not page_token:
+                break
+        logging.info("Backfill scanned %s: %d matching messages", user, len(copies))
+        return copies
+
+    def _describe(self, gmail, ids: List[str], label_id: Optional[str]) -> Dict[str, Copy]:
+        page: Dict[str, Copy] = {}
+        metas = get_metadata_many(gmail, ids) if ids else {}
+        for msg_id in ids:
+            meta = metas.get(msg_id)
+            if meta is None:
+                continue
+            headers = {h["name"].lower(): h["value"] for h in meta.get("payload", {}).get("headers", [])}
+            size = int(meta["sizeEstimate"]) if meta.get("sizeEstimate") is not None else None
+            if not shareable(self.processor.rules, self.cfg, msg_id, headers, size or 0):
+                continue
+            labelled = bool(label_id) and label_id in (meta.get("labelIds") or [])
+            page.setdefault(headers["message-id"], Copy(msg_id, meta.get("threadId"), labelled, size))
+        return page
+
+    def _label_id(self, user: str, gmail) -> Optional[str]:
+        if self.dry_run:
+            # Never create labels in a dry run.
+            return find_label(gmail, self.cfg.label_name)
+        return self.processor.labels.get(user, self.cfg.label_name)
+
+    # --- share ----------------------------------------------------------
+
+    def _share_from(self, user: str, rids: List[str], copies: Dict[str, Copy], relabel: List[Copy]) -> Tuple[int, int]:
+        """Share rids from this mailbox in checkpointed chunks, then label its unlabelled copies."""
+        inserted = labelled = 0
+        progress_key = self._key("share", user)
+        done_chunks = int(self.kv.get(progress_key) or 0)
+        chunks = [rids[i : i + SHARE_CHUNK_SIZE] for i in range(0, len(rids), SHARE_CHUNK_SIZE)]
+        for n, chunk in enumerate(chunks[done_chunks:], start=done_chunks):
+            self._throttle(len(chunk))
+            # The scan already matched these and knows their sizes; no metadata round trip needed.
+            candidates = [(copies[rid].msg_id, copies[rid].size_estimate) for rid in chunk]
+            outcomes = self.processor.share_candidates(user, candidates)
+            inserted += sum(len(o.inserted) for o in outcomes.values())
+            labelled += sum(o.labelled for o in outcomes.values())
+            # FanoutError propagates above, so a failed chunk is never marked done.
+            self.kv.set(progress_key, str(n + 1))
+
+        relabel_key = self._key("relabel", user)
+        if relabel and not self.kv.get(relabel_key):
+            gmail = self.auth_factory(user)
+            label_id = self.processor.labels.get(user, self.cfg.label_name)
+            threads = sorted({c.thread_id for c in relabel if c.thread_id})
+            messages = sorted({c.msg_id for c in relabel if not c.thread_id})
+            for i in range(0, len(threads), SHARE_CHUNK_SIZE):
+                chunk = threads[i : i + SHARE_CHUNK_SIZE]
+                self._throttle(len(chunk))
+                label_threads(gmail, chunk, label_id)
+            if messages:
+                self._throttle(len(messages))
+                label_messages(gmail, messages, label_id)
+            labelled += len(threads) + len(messages)
+            self.kv.set(relabel_key, str(int(time.time())))
+        return inserted, labelled
+
+    def _throttle(self, count: int) -> None:
+        if self.throughput is not None:
+            self.throughput.acquire(count)
+
+    def _key(self, *parts: str) -> str:
+        return ":".join(("backfill", self.run_id) + parts)
+
@@ -0,0 +1,116 @@
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from src.gmail.quota import charge, gmail_guards, record_result
+from src.utils import metrics
+from src.utils.retry import (
+    backoff_seconds,
+    exponential_backoff_retry,
+    is_rate_limited,
+    is_retryable_googleapi_error,
+    retry_after_seconds,
+)
+
+# Gmail accepts up to 100 calls per batch but recommends staying at or below 50.
+MAX_BATCH_SIZE = 50
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def execute_batch(
+    gmail,
+    builders: Dict[str, Callable[[], Any]],
+    method: str,
+    batch_size: int = MAX_BATCH_SIZE,
+    is_retryable: Callable[[Exception], bool] = is_retryable_googleapi_error,
+    max_retries: int = 6,
+) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """Run many Gmail calls through the batch endpoint.
+
+    ``builders`` maps a caller-chosen key to a zero-arg function returning an
+    unexecuted request for ``method``. Returns (results, errors) keyed the same
+    way; only the sub-requests that failed with a retryable error are sent again.
+    Each sub-request is charged against the quota limiter as one ``method`` call.
+    """
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+    pending = list(builders)
+    attempt = 0
+    guards = gmail_guards(gmail)
+    budget = guards.get("budget")
+    while pending:
+        failed: Dict[str, Exception] = {}
+        for chunk in _chunks(pending, batch_size):
+            _run_chunk(gmail, builders, method, chunk, results, failed, guards)
+
+        pending = []
+        attempt += 1
+        # Resending the failed items is one retry against the budget, whatever their number.
+        retry_allowed = attempt <= max_retries and (budget is None or not failed or budget.try_spend())
+        for key, exc in failed.items():
+            if retry_allowed and is_retryable(exc):
+                pending.append(key)
+            else:
+                errors[key] = exc
+        if pending:
+            metrics.inc("retries_total", len(pending), dependency="gmail", method=method)
+            hint = max((retry_after_seconds(failed[key]) or 0.0) for key in pending)
+            time.sleep(max(backoff_seconds(attempt), hint))
+    return results, errors
+
+
+def _run_chunk(
+    gmail,
+    builders,
+    method: str,
+    chunk: List[str],
+    results: Dict[str, Any],
+    failed: Dict[str, Exception],
+    guards: Dict,
+) -> None:
+    breakers = guards.get("breakers", ())
+
+    def _callback(request_id, response, exception):
+        record_result(gmail, exception, method)
+        _report(breakers, exception)
+        if exception is not None:
+            failed[request_id] = exception
+        else:
+            results[request_id] = response
+
+    def _call():
+        for key in chunk:
+            failed.pop(key, None)
+        # Sub-requests report health through _callback; here we only fail fast when open.
+        for breaker in breakers:
+            breaker.before_call()
+        charge(gmail, method, len(chunk))
+        batch = gmail.new_batch_http_request(callback=_callback)
+        for key in chunk:
+            batch.add(builders[key](), request_id=key)
+        try:
+            with metrics.timed("gmail_batch_seconds", method=method):
+                batch.execute()
+        except Exception as exc:  # noqa: BLE001
+            _report(breakers, exc)
+            raise
+
+    # A transport-level failure loses the whole chunk, so retry it as a unit.
+    exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error, budget=guards.get("budget"))
+
+
+def _report(breakers, exc) -> None:
+    # Same rule as exponential_backoff_retry: throttling and other 4xx leave the breaker alone.
+    for breaker in breakers:
+        if exc is not None and is_retryable_googleapi_error(exc) and not is_rate_limited(exc):
+            breaker.on_failure()
+        else:
+            breaker.on_success()
+
+
+def raise_first(errors: Dict[str, Exception]) -> None:
+    for exc in errors.values():
+        raise exc
@@ -1,56 +1,90 @@
-from typing import List, Tuple, Optional
+from typing import Dict, Iterator, List, Set, Optional
 
+from src.domain.model import HistoryPage
+from src.gmail.quota import gmail_call
+from src.utils.retry import http_status
 
-def list_new_message_ids(gmail, start_history_id: str) -> List[str]:
-    """Return message IDs from MessagesAdded since start_history_id.
+# history.list accepts at most 500 records per page.
+MAX_PAGE_SIZE = 500
+
+
+def iter_history_pages(
+    gmail,
+    start_history_id: str,
+    page_size: int = MAX_PAGE_SIZE,
+    label_id: Optional[str] = None,
+) -> Iterator[HistoryPage]:
+    """Yield new message IDs page by page since start_history_id.
+
+    Only messageAdded records are requested, and IDs already yielded by an
+    earlier page are dropped. last_history_id is the highest record id seen
+    so far; on the final page it is the mailbox historyId Gmail reports, which
+    is the point the next scan can safely resume from.
 
     Caller should handle 404 (historyId too old) by triggering a full resync.
     """
-    message_ids: List[str] = []
+    scan = HistoryScan()
     page_token = None
     while True:
-        req = gmail.users().history().list(userId="me", startHistoryId=start_history_id)
-        if page_token:
-            req = req.pageToken(page_token)
-        resp = req.execute()
-        for hist in resp.get("history", []):
-            for added in hist.get("messagesAdded", []):
-                msg = added.get("message", {})
-                mid = msg.get("id")
-                if mid:
-                    message_ids.append(mid)
+        def _call():
+            params = history_params(start_history_id, page_size, label_id, page_token)
+            return gmail.users().history().list(userId="me", **params).execute()
+
+        resp = gmail_call(gmail, "history.list", _call)
         page_token = resp.get("nextPageToken")
+        yield scan.page(resp)
         if not page_token:
             break
-    return message_ids
 
 
-def list_new_message_ids_and_last(gmail, start_history_id: str) -> Tuple[List[str], Optional[str]]:
-    """Return (message IDs, last historyId seen) since start_history_id.
+def history_params(start_history_id: str, page_size: int, label_id: Optional[str], page_token: Optional[str]) -> Dict:
+    params = {"startHistoryId": start_history_id, "historyTypes": ["messageAdded"], "maxResults": page_size}
+    if label_id:
+        params["labelId"] = label_id
+    if page_token:
+        params["pageToken"] = page_token
+    return params
 
-    last historyId is the maximum history record id observed in the scan.
-    """
-    message_ids: List[str] = []
-    last_history_id: Optional[int] = None
-    page_token = None
-    while True:
-        req = gmail.users().history().list(userId="me", startHistoryId=start_history_id)
-        if page_token:
-            req = req.pageToken(page_token)
-        resp = req.execute()
+
+class HistoryScan:
+    """Dedupe and last_history_id bookkeeping across the history.list pages of one scan."""
+
+    def __init__(self):
+        self.seen: Set[str] = set()
+        self.last_history_id: Optional[int] = None
+
+    def page(self, resp: Dict) -> HistoryPage:
+        message_ids: List[str] = []
         for hist in resp.get("history", []):
-            try:
-                hid = int(hist.get("id"))
-                last_history_id = hid if last_history_id is None else max(last_history_id, hid)
-            except Exception:
-                pass
+            self._advance(hist.get("id"))
             for added in hist.get("messagesAdded", []):
-                msg = added.get("message", {})
-                mid = msg.get("id")
-                if mid:
+                mid = added.get("message", {}).get("id")
+                if mid and mid not in self.seen:
+                    self.seen.add(mid)
                     message_ids.append(mid)
-        page_token = resp.get("nextPageToken")
-        if not page_token:
-            break
-    return message_ids, (str(last_history_id) if last_history_id is not None else None)
+        if not resp.get("nextPageToken"):
+            self._advance(resp.get("historyId"))
+        last = self.last_history_id
+        return HistoryPage(message_ids, str(last) if last is not None else None)
+
+    def _advance(self, history_id) -> None:
+        try:
+            hid = int(history_id)
+        except (TypeError, ValueError):
+            return
+        self.last_history_id = hid if self.last_history_id is None else max(self.last_history_id, hid)
+
+
+def is_history_out_of_range(exc: Exception) -> bool:
+    """history.list answers 404 when startHistoryId is older than Gmail keeps."""
+    return http_status(exc) == 404
+
+
+def get_profile_history_id(gmail) -> Optional[str]:
+    """Return the mailbox's current historyId from users.getProfile."""
+    def _call():
+        return gmail.users().getProfile(userId="me").execute()
 
+    res = gmail_call(gmail, "users.getProfile", _call)
+    hid = res.get("historyId")
+    return str(hid) if hid is not None else None
@@ -1,40 +1,152 @@
-from typing import Dict
-from src.utils.retry import exponential_backoff_retry, is_retryable_googleapi_error
+import json
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from src.gmail.batch import execute_batch, raise_first
+from src.gmail.quota import gmail_call
+from src.utils.retry import http_status
 
 
-_CACHE: Dict[str, str] = {}
+def label_key(user_email: str, label_name: str) -> str:
+    return f"label_id:{user_email}:{label_name}"
 
 
-def ensure_label(gmail, label_name: str) -> str:
-    if label_name in _CACHE:
-        return _CACHE[label_name]
-    def _list():
-        return gmail.users().labels().list(userId="me").execute()
+def new_label_body(label_name: str) -> Dict:
+    return {"name": label_name, "labelListVisibility": "labelShow", "messageListVisibility": "show"}
+
 
-    labels = exponential_backoff_retry(_list, is_retryable=is_retryable_googleapi_error).get("labels", [])
-    for lb in labels:
+def label_named(res: Dict, label_name: str) -> Optional[str]:
+    """Id of label_name in a labels.list response, if present."""
+    for lb in res.get("labels", []):
         if lb.get("name") == label_name:
-            _CACHE[label_name] = lb["id"]
             return lb["id"]
-    body = {"name": label_name, "labelListVisibility": "labelShow", "messageListVisibility": "show"}
+    return None
+
+
+def find_label(gmail, label_name: str) -> Optional[str]:
+    """Id of label_name in this mailbox, or None; never creates it."""
+    def _list():
+        return gmail.users().labels().list(userId="me").execute()
+
+    return label_named(gmail_call(gmail, "labels.list", _list), label_name)
+
+
+def ensure_label(gmail, label_name: str) -> str:
+    """Return the id of label_name in this mailbox, creating the label if needed. Not cached."""
+    label_id = find_label(gmail, label_name)
+    if label_id:
+        return label_id
+    body = new_label_body(label_name)
+
     def _create():
         return gmail.users().labels().create(userId="me", body=body).execute()
 
-    res = exponential_backoff_retry(_create, is_retryable=is_retryable_googleapi_error)
-    _CACHE[label_name] = res["id"]
+    try:
+        res = gmail_call(gmail, "labels.create", _create)
+    except Exception as exc:  # noqa: BLE001
+        # 409: created concurrently by another worker
+        if http_status(exc) != 409:
+            raise
+        label_id = find_label(gmail, label_name)
+        if not label_id:
+            raise
+        return label_id
     return res["id"]
 
 
+def is_label_not_found(exc: Exception, label_id: str) -> bool:
+    """A messages/threads modify rejected because label_id no longer exists in the mailbox.
+
+    Gmail answers 400 with the message "Invalid label: <id>"; anything else,
+    including other invalidArgument errors, is not a stale label.
+    """
+    if http_status(exc) != 400:
+        return False
+    try:
+        message = json.loads(getattr(exc, "content", b"") or b"{}")["error"]["message"]
+    except (ValueError, KeyError, TypeError):
+        return False
+    return message == f"Invalid label: {label_id}"
+
+
+class LabelRegistry:
+    """Label ids per (user, label name), cached in memory and persisted in the KV store."""
+
+    def __init__(self, kv, auth_factory):
+        self.kv = kv
+        self.auth_factory = auth_factory
+        self._ids: Dict[Tuple[str, str], str] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_email: str, label_name: str) -> str:
+        key = (user_email.lower(), label_name)
+        label_id = self._ids.get(key)
+        if label_id:
+            return label_id
+        with self._key_lock(key):
+            # Only one caller per mailbox resolves (and possibly creates) the label.
+            label_id = self._ids.get(key)
+            if label_id:
+                return label_id
+            kv_key = label_key(*key)
+            label_id = self.kv.get(kv_key)
+            if not label_id:
+                label_id = ensure_label(self.auth_factory(user_email), label_name)
+                self.kv.set(kv_key, label_id)
+            self._ids[key] = label_id
+            return label_id
+
+    def invalidate(self, user_email: str, label_name: str) -> None:
+        key = (user_email.lower(), label_name)
+        with self._key_lock(key):
+            self._ids.pop(key, None)
+            self.kv.set(label_key(*key), "")
+
+    def warm(self, users: Iterable[str], label_name: str) -> None:
+        for user in users:
+            try:
+                self.get(user, label_name)
+            except Exception:  # noqa: BLE001
+                logging.warning("Could not pre-warm label %r for %s", label_name, user, exc_info=True)
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+
 def label_message(gmail, msg_id: str, label_id: str):
     def _call():
         return gmail.users().messages().modify(userId="me", id=msg_id, body={"addLabelIds": [label_id]}).execute()
 
-    exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
+    gmail_call(gmail, "messages.modify", _call)
 
 
 def label_thread(gmail, thread_id: str, label_id: str):
     def _call():
         return gmail.users().threads().modify(userId="me", id=thread_id, body={"addLabelIds": [label_id]}).execute()
 
-    exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
+    gmail_call(gmail, "threads.modify", _call)
+
+
+def label_messages(gmail, msg_ids: Iterable[str], label_id: str):
+    """Label many messages in one mailbox with a single batchModify call (up to 1000 ids each)."""
+    ids = list(dict.fromkeys(msg_ids))
+    for i in range(0, len(ids), 1000):
+        body = {"ids": ids[i : i + 1000], "addLabelIds": [label_id]}
+
+        def _call():
+            return gmail.users().messages().batchModify(userId="me", body=body).execute()
+
+        gmail_call(gmail, "messages.batchModify", _call)
+
 
+def label_threads(gmail, thread_ids: Iterable[str], label_id: str):
+    """Label many threads in one mailbox through the batch endpoint."""
+    body = {"addLabelIds": [label_id]}
+    builders = {
+        tid: (lambda tid=tid: gmail.users().threads().modify(userId="me", id=tid, body=body))
+        for tid in dict.fromkeys(thread_ids)
+    }
+    _, errors = execute_batch(gmail, builders, method="threads.modify")
+    raise_first(errors)
@@ -1,58 +1,149 @@
-from base64 import urlsafe_b64decode, urlsafe_b64encode
-from typing import Dict, Tuple, Optional, List
-from src.utils.retry import exponential_backoff_retry, is_retryable_googleapi_error
+from base64 import urlsafe_b64decode
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+import io
+import logging
+from typing import Dict, Iterator, Tuple, Optional, List
+
+from googleapiclient.http import MediaIoBaseUpload
+
+from src.domain.model import RawMessage
+from src.gmail.batch import execute_batch, raise_first
+from src.gmail.quota import gmail_call
+from src.utils.retry import http_status
+
+
+# Above this many base64 chars (~5 MB), inserts use a resumable media upload.
+SIMPLE_INSERT_MAX_CHARS = 5 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024
+
+METADATA_HEADERS = [
+    "Subject",
+    "Message-Id",
+    "References",
+    "In-Reply-To",
+    "From",
+    "To",
+    "Cc",
+]
+
+
+def _metadata_request(gmail, msg_id: str):
+    return gmail.users().messages().get(userId="me", id=msg_id, format="metadata", metadataHeaders=METADATA_HEADERS)
+
+
+def _drop_missing(errors: Dict[str, Exception]) -> Dict[str, Exception]:
+    """Messages deleted between the history scan and the fetch come back 404; skip them."""
+    remaining = {}
+    for msg_id, exc in errors.items():
+        if http_status(exc) == 404:
+            logging.info("Message %s no longer exists; skipping", msg_id)
+        else:
+            remaining[msg_id] = exc
+    return remaining
+
+
+def get_metadata_many(gmail, msg_ids: List[str]) -> Dict[str, Dict]:
+    """Batched format=metadata fetch. Messages that no longer exist are left out of the result."""
+    builders = {mid: (lambda mid=mid: _metadata_request(gmail, mid)) for mid in dict.fromkeys(msg_ids)}
+    results, errors = execute_batch(gmail, builders, method="messages.get")
+    raise_first(_drop_missing(errors))
+    return results
+
+
+def get_minimal_many(gmail, msg_ids: List[str]) -> Dict[str, Dict]:
+    """Batched format=minimal fetch (ids, labels, sizeEstimate). Messages that no longer exist are left out."""
+    builders = {
+        mid: (lambda mid=mid: gmail.users().messages().get(userId="me", id=mid, format="minimal"))
+        for mid in dict.fromkeys(msg_ids)
+    }
+    results, errors = execute_batch(gmail, builders, method="messages.get")
+    raise_first(_drop_missing(errors))
+    return results
+
+
+# Header blocks are small; never decode more than this much of a raw message to read them.
+_HEADER_SCAN_BYTES = 64 * 1024
+
+
+def decode_raw(raw_b64: str) -> bytes:
+    """Decode Gmail's base64url ``raw``, which usually comes without its '=' padding."""
+    return urlsafe_b64decode(raw_b64 + "=" * (-len(raw_b64) % 4))
+
+
+def parse_raw_headers(raw_b64: str) -> Dict[str, str]:
+    """Parse the RFC822 header block from a base64url raw message without decoding the body."""
+    # 4 base64 chars -> 3 bytes; keep the prefix on a quantum boundary.
+    prefix = raw_b64[: (_HEADER_SCAN_BYTES // 3) * 4]
+    head = decode_raw(prefix)
+    for sep in (b"\r\n\r\n", b"\n\n"):
+        end = head.find(sep)
+        if end != -1:
+            head = head[:end]
+            break
+    parsed = BytesHeaderParser().parsebytes(head + b"\r\n\r\n")
+    # Unfold continuation lines (RFC 5322 2.2.3).
+    return {name: _decode_words(str(value).replace("\r\n", "").replace("\n", "")) for name, value in parsed.items()}
 
 
-def get_metadata(gmail, msg_id: str) -> Dict:
-    def _call():
-        return (
-            gmail.users()
-            .messages()
-            .get(
-                userId="me",
-                id=msg_id,
-                format="metadata",
-                metadataHeaders=[
-                    "Subject",
-                    "Message-Id",
-                    "References",
-                    "In-Reply-To",
-                    "From",
-                    "To",
-                    "Cc",
-                ],
-            )
-            .execute()
-        )
+def _decode_words(value: str) -> str:
+    """Decode RFC 2047 encoded-words (=?UTF-8?B?...?=), as the metadata format already does."""
+    if "=?" not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except (HeaderParseError, LookupError, UnicodeError):
+        return value
 
-    return exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
 
+def _raw_request(gmail, msg_id: str):
+    return gmail.users().messages().get(userId="me", id=msg_id, format="raw")
 
-def get_raw(gmail, msg_id: str) -> bytes:
-    def _call():
-        return gmail.users().messages().get(userId="me", id=msg_id, format="raw").execute()
 
-    res = exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
-    return urlsafe_b64decode(res["raw"])  # bytes of RFC822
+def get_raw_messages_many(gmail, msg_ids: List[str], batch_size: int = 10) -> Dict[str, RawMessage]:
+    """Batched format=raw fetch. Headers come from the raw header block; the body stays encoded."""
+    builders = {mid: (lambda mid=mid: _raw_request(gmail, mid)) for mid in dict.fromkeys(msg_ids)}
+    results, errors = execute_batch(gmail, builders, method="messages.get", batch_size=batch_size)
+    raise_first(_drop_missing(errors))
+    return {mid: raw_message(mid, res) for mid, res in results.items()}
 
 
-def search_by_message_id(gmail, rfc822_msgid: str) -> bool:
-    q = f"rfc822msgid:{rfc822_msgid}"
+def raw_message(msg_id: str, res: Dict) -> RawMessage:
+    """RawMessage from a format=raw messages.get response."""
+    return RawMessage(
+        id=msg_id,
+        raw=res["raw"],
+        thread_id=res.get("threadId"),
+        size_estimate=int(res.get("sizeEstimate") or 0),
+        headers=parse_raw_headers(res["raw"]),
+    )
 
-    def _call():
-        return gmail.users().messages().list(userId="me", q=q, maxResults=1).execute()
 
-    res = exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
-    return res.get("resultSizeEstimate", 0) > 0
+def insert_raw_message(gmail, message: RawMessage) -> Dict:
+    """Insert a fetched message into this mailbox, passing the base64url payload straight through.
 
+    Messages above SIMPLE_INSERT_MAX_CHARS go through a resumable media upload
+    instead of one large JSON body.
+    """
+    if len(message.raw) <= SIMPLE_INSERT_MAX_CHARS:
+        body = {"raw": message.raw}
 
-def insert_raw(gmail, raw_bytes: bytes) -> Dict:
-    body = {"raw": urlsafe_b64encode(raw_bytes).decode("ascii")}
+        def _call():
+            return gmail.users().messages().insert(userId="me", body=body).execute()
 
-    def _call():
-        return gmail.users().messages().insert(userId="me", body=body).execute()
+        return gmail_call(gmail, "messages.insert", _call)
+
+    def _upload():
+        media = MediaIoBaseUpload(
+            io.BytesIO(decode_raw(message.raw)),
+            mimetype="message/rfc822",
+            chunksize=UPLOAD_CHUNK_BYTES,
+            resumable=True,
+        )
+        return gmail.users().messages().insert(userId="me", body={}, media_body=media).execute()
 
-    return exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
+    return gmail_call(gmail, "messages.insert", _upload)
 
 
 def find_message_by_rfc822(gmail, rfc822_msgid: str) -> Tuple[Optional[str], Optional[str]]:
@@ -62,53 +153,39 @@ def find_message_by_rfc822(gmail, rfc822_msgid: str) -> Tuple[Optional[str], Opt
     def _call():
         return gmail.users().messages().list(userId="me", q=q, maxResults=1).execute()
 
-    res = exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
+    return first_location(gmail_call(gmail, "messages.list", _call))
+
+
+def first_location(res: Dict) -> Tuple[Optional[str], Optional[str]]:
+    """(message id, thread id) of the first hit of a messages.list response, or (None, None)."""
     msgs = res.get("messages", []) or []
     if not msgs:
         return None, None
-    m = msgs[0]
-    return m.get("id"), m.get("threadId")
+    return msgs[0].get("id"), msgs[0].get("threadId")
 
 
-def search_subject_training_exercise(gmail) -> List[str]:
-    """Return message ids for messages with subject matching Training Exercise flavor."""
-    q = 'subject:"Training Exercise"'
-    message_ids: List[str] = []
-    page_token = None
-    while True:
-        def _call():
-            req = gmail.users().messages().list(userId="me", q=q, maxResults=100)
-            if page_token:
-                req = req.pageToken(page_token)
-            return req.execute()
-
-        res = exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
-        for m in res.get("messages", []) or []:
-            if m.get("id"):
-                message_ids.append(m["id"])
-        page_token = res.get("nextPageToken")
-        if not page_token:
-            break
-    return message_ids
+def search_page(gmail, q: str, page_size: int = 100, page_token: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+    """One page of a Gmail search: (message ids, next page token or None)."""
+    def _call():
+        kwargs = {"userId": "me", "q": q, "maxResults": page_size}
+        if page_token:
+            kwargs["pageToken"] = page_token
+        return gmail.users().messages().list(**kwargs).execute()
 
+    res = gmail_call(gmail, "messages.list", _call)
+    return message_ids(res), res.get("nextPageToken")
 
-def get_latest_history_id(gmail) -> Optional[str]:
-    """Best-effort: fetch the most recent message and return its historyId."""
-    def _list():
-        return gmail.users().messages().list(userId="me", maxResults=1).execute()
 
-    res = exponential_backoff_retry(_list, is_retryable=is_retryable_googleapi_error)
-    msgs = res.get("messages", []) or []
-    if not msgs:
-        return None
-    mid = msgs[0].get("id")
-    if not mid:
-        return None
-
-    def _get():
-        return gmail.users().messages().get(userId="me", id=mid, format="metadata").execute()
+def message_ids(res: Dict) -> List[str]:
+    return [m["id"] for m in res.get("messages", []) or [] if m.get("id")]
 
-    msg = exponential_backoff_retry(_get, is_retryable=is_retryable_googleapi_error)
-    hid = msg.get("historyId")
-    return str(hid) if hid is not None else None
 
+def iter_search_pages(gmail, q: str, page_size: int = 100) -> Iterator[List[str]]:
+    """Yield message ids matching a Gmail search query, one page at a time."""
+    page_token = None
+    while True:
+        ids, page_token = search_page(gmail, q, page_size, page_token)
+        if ids:
+            yield ids
+        if not page_token:
+            break
@@ -0,0 +1,117 @@
+from typing import Awaitable, Callable, Dict, Optional
+
+from src.utils import metrics
+from src.utils.circuit import guards_for
+from src.utils.ratelimit import get_limiter
+from src.utils.retry import (
+    async_exponential_backoff_retry,
+    exponential_backoff_retry,
+    http_status,
+    is_rate_limited,
+    is_retryable_googleapi_error,
+    retry_after_seconds,
+)
+
+# Gmail API quota units per method (https://developers.google.com/gmail/api/reference/quota).
+METHOD_UNITS = {
+    "users.getProfile": 1,
+    "users.watch": 100,
+    "users.stop": 50,
+    "history.list": 2,
+    "labels.list": 1,
+    "labels.create": 5,
+    "messages.get": 5,
+    "messages.list": 5,
+    "messages.insert": 25,
+    "messages.modify": 5,
+    "messages.batchModify": 50,
+    "threads.modify": 10,
+}
+
+
+def quota_user(gmail) -> str:
+    """The delegated user a client acts for; pooled and stub clients carry user_email."""
+    return getattr(gmail, "user_email", None) or "me"
+
+
+def charge(gmail, method: str, count: int = 1) -> None:
+    limiter = get_limiter()
+    if limiter is not None:
+        limiter.acquire(quota_user(gmail), METHOD_UNITS.get(method, 5) * count)
+
+
+def record_result(gmail, exc: Optional[Exception] = None, method: str = "") -> None:
+    if exc is not None:
+        metrics.inc("gmail_errors_total", method=method, status=http_status(exc) or type(exc).__name__)
+    limiter = get_limiter()
+    if limiter is None:
+        return
+    if exc is None:
+        limiter.on_success(quota_user(gmail))
+    elif is_rate_limited(exc):
+        limiter.on_throttled(quota_user(gmail), retry_after_seconds(exc))
+
+
+def gmail_call(gmail, method: str, func: Callable):
+    """Run one Gmail call behind the quota limiter, with the usual retry policy."""
+    attempts = []
+
+    def _attempt():
+        if attempts:
+            metrics.inc("retries_total", dependency="gmail", method=method)
+        attempts.append(1)
+        charge(gmail, method)
+        try:
+            with metrics.timed("gmail_request_seconds", method=method):
+                res = func()
+        except Exception as exc:  # noqa: BLE001
+            record_result(gmail, exc, method)
+            raise
+        record_result(gmail)
+        return res
+
+    return exponential_backoff_retry(
+        _attempt,
+        is_retryable=is_retryable_googleapi_error,
+        retry_after=retry_after_seconds,
+        **gmail_guards(gmail),
+    )
+
+
+async def charge_async(gmail, method: str, count: int = 1) -> None:
+    limiter = get_limiter()
+    if limiter is not None:
+        await limiter.acquire_async(quota_user(gmail), METHOD_UNITS.get(method, 5) * count)
+
+
+async def gmail_call_async(gmail, method: str, func: Callable[[], Awaitable]):
+    """gmail_call for the async client: same quota, breakers and retry policy, without blocking."""
+
+    attempts = []
+
+    async def _attempt():
+        if attempts:
+            metrics.inc("retries_total", dependency="gmail", method=method)
+        attempts.append(1)
+        await charge_async(gmail, method)
+        try:
+            with metrics.timed("gmail_request_seconds", method=method):
+                res = await func()
+        except Exception as exc:  # noqa: BLE001
+            record_result(gmail, exc, method)
+            raise
+        record_result(gmail)
+        return res
+
+    return await async_exponential_backoff_retry(
+        _attempt,
+        is_retryable=is_retryable_googleapi_error,
+        retry_after=retry_after_seconds,
+        **gmail_guards(gmail),
+    )
+
+
+def gmail_guards(gmail) -> Dict:
+    """Circuit breakers (Gmail-wide and this mailbox) and the Gmail retry budget."""
+    user = quota_user(gmail)
+    return guards_for("gmail", None if user == "me" else user)
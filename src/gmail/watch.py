@@ -1,24 +1,206 @@
-from typing import Dict, Optional, List
-from src.utils.retry import exponential_backoff_retry, is_retryable_googleapi_error
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, List
 
+from src.gmail.quota import gmail_call
+from src.storage.cursors import init_history_cursor
+from src.utils import metrics
+from src.worker.leases import default_owner_id
 
-def register_watch(gmail, topic_name: str, label_ids: Optional[List[str]] = None) -> Dict:
+# Used by the --loop scheduler when WATCH_RENEW_CHECK_SECONDS=0 turns renewal off in the worker.
+DEFAULT_CHECK_SECONDS = 3600
+# How long one replica may hold a mailbox's renewal before another can take over.
+RENEW_LEASE_SECONDS = 120
+
+
+def register_watch(
+    gmail, topic_name: str, label_ids: Optional[List[str]] = None, label_filter_behavior: Optional[str] = None
+) -> Dict:
     body = {
         "topicName": topic_name,
         # labelIds optional; omit to watch all labels
     }
     if label_ids:
         body["labelIds"] = label_ids
+        # "include": notify only for changes to messages with these labels; "exclude": all but these
+        if label_filter_behavior:
+            body["labelFilterBehavior"] = label_filter_behavior
 
     def _call():
         return gmail.users().watch(userId="me", body=body).execute()
 
-    return exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
+    return gmail_call(gmail, "users.watch", _call)
 
 
 def stop_watch(gmail) -> None:
     def _call():
         return gmail.users().stop(userId="me").execute()
 
-    exponential_backoff_retry(_call, is_retryable=is_retryable_googleapi_error)
+    gmail_call(gmail, "users.stop", _call)
+
+
+def topic_path(cfg) -> str:
+    if cfg.topic.startswith("projects/"):
+        return cfg.topic
+    return f"projects/{cfg.project_id}/topics/{cfg.topic}"
+
+
+def watch_key(user_email: str) -> str:
+    return f"watch:{user_email}"
+
+
+def renew_lease_key(user_email: str) -> str:
+    return f"watchlease:{user_email.lower()}"
+
+
+def _claim_fn(owner: str, got: List[bool]) -> Callable[[Optional[str]], Optional[str]]:
+    def _claim(current: Optional[str]) -> Optional[str]:
+        got.clear()  # transactions may run this more than once
+        lease = json.loads(current) if current else {}
+        now = time.time()
+        if lease.get("owner") not in (None, "", owner) and lease.get("expires", 0) > now:
+            return None
+        got.append(True)
+        return json.dumps({"owner": owner, "expires": now + RENEW_LEASE_SECONDS})
+
+    return _claim
+
+
+def _unclaim_fn(owner: str) -> Callable[[Optional[str]], Optional[str]]:
+    def _unclaim(current: Optional[str]) -> Optional[str]:
+        lease = json.loads(current) if current else {}
+        if lease.get("owner") != owner:
+            return None
+        return json.dumps({"owner": "", "expires": 0})
+
+    return _unclaim
+
+
+class WatchManager:
+    """Keeps a label-filtered Gmail watch alive on every team mailbox.
+
+    Each registration is recorded in KV under watch:{user} with its
+    expiration and filter. A watch is renewed renew_before_seconds ahead of
+    expiry, minus a fixed per-mailbox offset within spread_seconds, so
+    mailboxes registered together do not all renew together. A changed
+    filter re-registers on the next check. Every replica may run one; a
+    short KV lease per mailbox (watchlease:{user}) lets only one of them
+    register a given watch at a time.
+    """
+
+    def __init__(self, cfg, kv, auth_factory):
+        self.cfg = cfg
+        self.kv = kv
+        self.auth_factory = auth_factory
+        self.owner = cfg.worker_id or default_owner_id()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def status(self, user_email: str) -> Optional[Dict]:
+        value = self.kv.get(watch_key(user_email))
+        return json.loads(value) if value else None
+
+    def renew_at(self, user_email: str, record: Optional[Dict]) -> float:
+        """Epoch seconds at which this mailbox's watch should be renewed; 0 means now."""
+        if not record or not self._same_filter(record):
+            return 0.0
+        digest = hashlib.sha1(user_email.lower().encode("utf-8")).hexdigest()
+        offset = int(digest[:8], 16) / 0xFFFFFFFF * self.cfg.watch_renew_spread_seconds
+        return record["expiration"] / 1000.0 - self.cfg.watch_renew_before_seconds - offset
+
+    def ensure(self, user_email: str, force: bool = False) -> Optional[Dict]:
+        """Register or renew the watch if it is missing, due or filtered differently; returns the record.
+
+        While another replica holds the renewal lease its record is returned
+        as it stands (None if it has none yet).
+        """
+        record = self.status(user_email)
+        if not force and record and time.time() < self.renew_at(user_email, record):
+            return record
+        got: List[bool] = []
+        self.kv.update(renew_lease_key(user_email), _claim_fn(self.owner, got))
+        if not got:
+            metrics.inc("watch_renewals_total", result="leased_elsewhere")
+            return record
+        try:
+            # Another replica may have renewed between our read and the claim.
+            record = self.status(user_email)
+            if not force and record and time.time() < self.renew_at(user_email, record):
+                return record
+            return self._register(user_email)
+        finally:
+            self.kv.update(renew_lease_key(user_email), _unclaim_fn(self.owner))
+
+    def _register(self, user_email: str) -> Dict:
+        gmail = self.auth_factory(user_email)
+        try:
+            res = register_watch(
+                gmail, topic_path(self.cfg), self.cfg.watch_label_ids, self.cfg.watch_label_filter_behavior
+            )
+        except Exception:
+            metrics.inc("watch_renewals_total", result="error")
+            raise
+        record = {
+            "expiration": int(res["expiration"]),
+            "history_id": str(res["historyId"]),
+            "label_ids": list(self.cfg.watch_label_ids),
+            "label_filter_behavior": self.cfg.watch_label_filter_behavior,
+            "renewed_at": int(time.time()),
+        }
+        self.kv.set(watch_key(user_email), json.dumps(record))
+        # First watch on this mailbox: start the history scan where notifications start.
+        if init_history_cursor(self.kv, user_email, record["history_id"]):
+            logging.info("History cursor for %s initialised at %s", user_email, record["history_id"])
+        metrics.inc("watch_renewals_total", result="ok")
+        expires = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(record["expiration"] / 1000))
+        logging.info("Watch for %s renewed; expires %s", user_email, expires)
+        return record
+
+    def ensure_all(self, force: bool = False) -> Dict[str, Dict]:
+        """ensure() every team mailbox; a failure is logged and left for the next check.
+
+        Mailboxes that failed, or that another replica is registering for the
+        first time, are missing from the result.
+        """
+        records: Dict[str, Dict] = {}
+        for user in self.cfg.team_users:
+            try:
+                record = self.ensure(user, force=force)
+            except Exception:  # noqa: BLE001
+                logging.exception("Could not renew the watch for %s", user)
+                continue
+            if record is not None:
+                records[user] = record
+        return records
+
+    def next_check(self, records: Dict[str, Dict]) -> float:
+        """Seconds until the earliest renewal is due, capped at the check interval."""
+        interval = self.cfg.watch_renew_check_seconds or DEFAULT_CHECK_SECONDS
+        if len(records) < len(self.cfg.team_users):
+            return interval  # something failed: retry on the next regular check
+        due = min((self.renew_at(user, rec) for user, rec in records.items()), default=time.time() + interval)
+        return max(1.0, min(interval, due - time.time()))
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            records = self.ensure_all()
+            self._stop.wait(self.next_check(records))
+
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self.run, name="watch-renewal", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
 
+    def _same_filter(self, record: Dict) -> bool:
+        return (
+            record.get("label_ids") == list(self.cfg.watch_label_ids)
+            and record.get("label_filter_behavior") == self.cfg.watch_label_filter_behavior
+        )
@@ -1,15 +1,22 @@
 import json
 import logging
-from typing import Any, Dict
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
 
 from src.config import Config
-from src.gmail.auth import gmail_client_for
-from src.gmail.history import list_new_message_ids, list_new_message_ids_and_last
-from src.gmail.messages import get_latest_history_id, search_subject_training_exercise
-from src.storage.memory_kv import InMemoryKV
-from src.storage.firestore_kv import FirestoreKV
+from src.gmail.history import is_history_out_of_range, iter_history_pages
+from src.gmail.watch import WatchManager
+from src.storage.cached_kv import CachedKV
+from src.storage.cursors import advance_history_cursor, get_history_cursor, record_error, record_sync
+from src.storage.memory_kv import AsyncKVAdapter, InMemoryKV
+from src.utils import metrics
+from src.utils.circuit import CircuitOpenError, Resilience, configure_resilience
 from src.utils.logging import setup_logging
-from src.worker.processor import Processor
+from src.utils.ratelimit import QuotaLimiter, configure_limiter
+from src.worker.context import WorkerContext
+from src.worker.resync import resync_mailbox
 
 
 def parse_pubsub_payload(data_bytes: bytes, attributes: Dict[str, str]) -> Dict[str, Any]:
@@ -26,12 +33,14 @@ def parse_pubsub_payload(data_bytes: bytes, attributes: Dict[str, str]) -> Dict[
     source = payload.get("source")
     if source != "gmail":
         logging.warning("Non-gmail source payload received; skipping")
+        metrics.inc("pubsub_messages_skipped_total", reason="non_gmail")
         return {"action": "skip"}
 
     email = payload.get("emailAddress")
     hist = payload.get("historyId")
     if not email or not hist:
         logging.error("Invalid payload missing required fields; skipping")
+        metrics.inc("pubsub_messages_skipped_total", reason="missing_fields")
         return {"action": "skip"}
 
     return {
@@ -43,43 +52,191 @@ def parse_pubsub_payload(data_bytes: bytes, attributes: Dict[str, str]) -> Dict[
 
 
 def build_auth_factory(cfg: Config):
-    def factory(user_email: str):
-        return gmail_client_for(user_email, cfg.google_application_credentials)
+    # Backends are imported when built, so a process only pays for the clients it uses.
+    from src.gmail.auth import GmailClientPool
 
-    return factory
+    return GmailClientPool(
+        cfg.google_application_credentials,
+        max_users=cfg.gmail_pool_max_users,
+        refresh_margin_seconds=cfg.gmail_creds_refresh_margin_seconds,
+        discovery_cache_dir=cfg.gmail_discovery_cache_dir,
+    )
 
 
-def handle_pubsub_message(message):
-    cfg = Config()
-    setup_logging(cfg.log_level)
+def build_kv(cfg: Config):
+    if cfg.store_backend == "memory":
+        return InMemoryKV()
+    from src.storage.firestore_kv import FirestoreKV
+
+    kv = FirestoreKV(cfg.project_id, cfg.firestore_collection_prefix)
+    if cfg.kv_cache_size > 0:
+        kv = CachedKV(kv, max_entries=cfg.kv_cache_size, ttl_seconds=cfg.kv_cache_ttl_seconds)
+    return kv
+
+
+def build_quota_limiter(cfg: Config) -> Optional[QuotaLimiter]:
+    if cfg.gmail_user_quota_units_per_sec <= 0 or cfg.gmail_project_quota_units_per_sec <= 0:
+        return None
+    return QuotaLimiter(cfg.gmail_user_quota_units_per_sec, cfg.gmail_project_quota_units_per_sec)
+
+
+def build_resilience(cfg: Config) -> Resilience:
+    return Resilience(
+        failure_threshold=cfg.breaker_failure_threshold,
+        dependency_failure_threshold=cfg.breaker_dependency_failure_threshold,
+        reset_seconds=cfg.breaker_reset_seconds,
+        retry_ratio=cfg.retry_budget_ratio,
+    )
+
+
+def build_worker_context(cfg: Config) -> WorkerContext:
+    configure_limiter(build_quota_limiter(cfg))
+    configure_resilience(build_resilience(cfg))
+    return WorkerContext(cfg, build_kv(cfg), build_auth_factory(cfg))
+
+
+_CONTEXT: Optional[WorkerContext] = None
+_CONTEXT_LOCK = threading.Lock()
+
+
+def get_worker_context() -> WorkerContext:
+    """Return the process-wide context, building it on first use."""
+    global _CONTEXT
+    if _CONTEXT is None:
+        with _CONTEXT_LOCK:
+            if _CONTEXT is None:
+                cfg = Config()
+                setup_logging(cfg.log_level)
+                _CONTEXT = build_worker_context(cfg)
+    return _CONTEXT
+
+
+def build_async_kv(cfg: Config):
+    if cfg.store_backend == "memory":
+        return AsyncKVAdapter(InMemoryKV())
+    from src.storage.async_kv import AsyncFirestoreKV
+
+    return AsyncFirestoreKV(cfg.project_id, cfg.firestore_collection_prefix)
+
+
+def build_async_worker(cfg: Config):
+    # Imported here so the threaded worker does not need aiohttp installed.
+    from src.gmail.async_client import AsyncGmailPool
+    from src.worker.async_worker import AsyncWorker
+
+    configure_limiter(build_quota_limiter(cfg))
+    configure_resilience(build_resilience(cfg))
+    return AsyncWorker(
+        cfg,
+        lambda: build_async_kv(cfg),
+        lambda: AsyncGmailPool(
+            cfg.google_application_credentials,
+            max_users=cfg.gmail_pool_max_users,
+            refresh_margin_seconds=cfg.gmail_creds_refresh_margin_seconds,
+            max_connections=cfg.async_max_connections,
+        ),
+    )
+
+
+def dispatch_pubsub_message(message, worker) -> Optional[Future]:
+    """Async-mode callback: parse on the callback thread and hand the sync to the worker's loop."""
+    parsed = parse_pubsub_payload(message.data, dict(message.attributes or {}))
+    if parsed.get("action") != "process":
+        return None
+    return worker.submit(parsed["emailAddress"], _as_int(parsed["historyId"]))
+
+
+def _as_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
 
-    kv = InMemoryKV() if cfg.store_backend == "memory" else FirestoreKV(cfg.project_id, cfg.firestore_collection_prefix)
 
-    auth_factory = build_auth_factory(cfg)
-    processor = Processor(cfg, kv, auth_factory)
+def handle_pubsub_message(message, ctx: Optional[WorkerContext] = None):
+    ctx = ctx or get_worker_context()
 
     parsed = parse_pubsub_payload(message.data, dict(message.attributes or {}))
     if parsed.get("action") != "process":
         return
 
     user_email = parsed["emailAddress"]
-    history_id = parsed["historyId"]
+    history_id = _as_int(parsed["historyId"])
+    try:
+        ran = ctx.coalescer.run(user_email, history_id, lambda hid: sync_owned_mailbox(ctx, user_email, hid))
+    except Exception as exc:  # noqa: BLE001
+        if isinstance(exc, CircuitOpenError):
+            # Fail fast; the nack lets Pub/Sub redeliver once the breaker has had time to reset.
+            logging.warning("Skipping %s for now: %s", user_email, exc)
+        _record_error(ctx, user_email, exc)
+        raise
+    if not ran:
+        logging.debug("Coalesced notification for %s at historyId %s", user_email, history_id)
+
+
+def _record_error(ctx: WorkerContext, user_email: str, exc: Exception) -> None:
+    # Lets scripts/replay_deadletters.py filter dead letters by what last went wrong.
+    try:
+        record_error(ctx.kv, user_email, exc)
+    except Exception:  # noqa: BLE001
+        logging.warning("Could not record sync error for %s", user_email, exc_info=True)
+
+
+def sync_owned_mailbox(ctx: WorkerContext, user_email: str, history_id: int) -> None:
+    """sync_mailbox, under the mailbox lease when several replicas share the subscription."""
+    leases = ctx.leases
+    if leases is None:
+        sync_mailbox(ctx, user_email, history_id)
+        return
+    if not leases.acquire(user_email, history_id):
+        # Another replica is syncing this mailbox and will pick this historyId up before letting go.
+        logging.debug("Handed %s at historyId %s to the lease owner", user_email, history_id)
+        return
+    try:
+        next_history_id: Optional[int] = history_id
+        while next_history_id is not None:
+            sync_mailbox(ctx, user_email, next_history_id)
+            next_history_id = leases.release(user_email)
+    except BaseException:
+        try:
+            leases.release(user_email, handoff=False, unsynced=next_history_id)
+        except Exception:  # noqa: BLE001
+            logging.warning("Could not release the lease on %s; it will expire", user_email, exc_info=True)
+        raise
+
+
+def sync_mailbox(ctx: WorkerContext, user_email: str, notified_history_id: int):
+    kv = ctx.kv
+    started = time.time()
+    history_id = str(notified_history_id)
     # Prefer stored cursor if available (can be newer); otherwise use incoming
-    stored_cursor = kv.get(f"history_cursor:{user_email}")
+    stored_cursor = get_history_cursor(kv, user_email)
     if stored_cursor:
+        if notified_history_id <= _as_int(stored_cursor):
+            # Everything up to this notification has already been scanned.
+            return
         history_id = stored_cursor
-    gmail = auth_factory(user_email)
-    try:
-        message_ids, last_hid = list_new_message_ids_and_last(gmail, history_id)
-    except Exception as exc:  # noqa: BLE001
-        # Fallback resync path: subject query and reset cursor to latest
-        message_ids = search_subject_training_exercise(gmail)
-        last_hid = get_latest_history_id(gmail)
-    processor.process_history_event(user_email, message_ids)
-    # Persist last history cursor when available
-    if last_hid:
-        key = f"history_cursor:{user_email}"
-        kv.set(key, str(last_hid))
+    gmail = ctx.auth_factory(user_email)
+    pages = iter_history_pages(gmail, history_id)
+    while True:
+        try:
+            page = next(pages, None)
+        except Exception as exc:  # noqa: BLE001
+            if not is_history_out_of_range(exc):
+                raise
+            resync_mailbox(ctx, user_email, gmail)
+            break
+        if page is None:
+            break
+        if ctx.leases is not None:
+            # Stop before writing anything if another replica has taken the mailbox over.
+            ctx.leases.check(user_email)
+        # Start processing as soon as the first page arrives.
+        ctx.processor.process_history_event(user_email, page.message_ids)
+        # Checkpoint after every page so a crash resumes from here, not from the start.
+        if page.last_history_id:
+            advance_history_cursor(kv, user_email, page.last_history_id)
+    record_sync(kv, user_email, started)
 
 
 if __name__ == "__main__":
@@ -87,7 +244,35 @@ if __name__ == "__main__":
 
     cfg = Config()
     setup_logging(cfg.log_level)
+    if cfg.metrics_port > 0:
+        exporter = metrics.PrometheusExporter()
+        metrics.configure_metrics(exporter)
+        exporter.serve(cfg.metrics_port)
 
-    sub = Subscriber(cfg.project_id, cfg.subscription, handle_pubsub_message)
+    if cfg.topic and cfg.watch_renew_check_seconds > 0:
+        # Renews watches beside the subscriber, with its own sync KV and Gmail clients in either mode.
+        WatchManager(cfg, build_kv(cfg), build_auth_factory(cfg)).start()
+
+    if cfg.worker_mode == "async":
+        worker = build_async_worker(cfg)
+        worker.warm(cfg.team_users, cfg.label_name)
+        callback = lambda message: dispatch_pubsub_message(message, worker)  # noqa: E731
+        on_shutdown = worker.close
+    else:
+        ctx = build_worker_context(cfg)
+        ctx.labels.warm(cfg.team_users, cfg.label_name)
+        callback = lambda message: handle_pubsub_message(message, ctx)  # noqa: E731
+        on_shutdown = ctx.close
+    sub = Subscriber(
+        cfg.project_id,
+        cfg.subscription,
+        callback,
+        on_shutdown=on_shutdown,
+        max_messages=cfg.pull_max_messages,
+        max_workers=cfg.pull_concurrency,
+        ack_deadline_seconds=cfg.ack_deadline_seconds,
+        max_lease_seconds=cfg.max_lease_seconds,
+        drain_timeout_seconds=cfg.drain_timeout_seconds,
+    )
     sub.start()
 
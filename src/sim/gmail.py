@@ -0,0 +1,509 @@
+"""In-process fake of the Gmail API surface this worker uses, for offline load tests.
+
+FakeGmailBackend holds every mailbox (messages, threads, labels, history) and
+is shaped like googleapiclient's generated client: resource methods return
+request objects, ``execute()`` runs them and failures are ``HttpError``s.
+Latency and 429/5xx responses can be injected, and every call is counted per
+method. The backend is callable with a user email, so it can stand in for the
+Gmail client pool as a WorkerContext auth factory.
+"""
+import base64
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from email import policy
+from email.parser import BytesHeaderParser
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Gmail rejects batches with more parts than this.
+MAX_BATCH_PARTS = 100
+WATCH_TTL_MS = 7 * 24 * 3600 * 1000
+SYSTEM_LABELS = ("INBOX", "UNREAD", "SENT", "TRASH", "SPAM")
+
+_ERROR_REASONS = {429: "rateLimitExceeded", 403: "userRateLimitExceeded"}
+_OR_GROUP = re.compile(r"\{([^}]*)\}")
+_QUERY_TERM = re.compile(r'(\w+):"([^"]*)"|(\w+):(\S+)|"([^"]*)"|(\S+)')
+
+
+def http_error(status: int, message: str, reason: str = "backendError", retry_after: Optional[float] = None) -> HttpError:
+    info = {"status": str(status)}
+    if retry_after is not None:
+        info["retry-after"] = str(retry_after)
+    body = {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+    return HttpError(httplib2.Response(info), json.dumps(body).encode("utf-8"))
+
+
+def _not_found() -> HttpError:
+    return http_error(404, "Requested entity was not found.", reason="notFound")
+
+
+def _strip_brackets(message_id: str) -> str:
+    return message_id.strip().strip("<>")
+
+
+@dataclass
+class FakeMessage:
+    id: str
+    thread_id: str
+    raw: bytes
+    headers: List[Tuple[str, str]]
+    label_ids: Set[str]
+    internal_date: int  # ms since epoch
+    history_id: int
+
+    def header(self, name: str) -> str:
+        name = name.lower()
+        return next((v for k, v in self.headers if k.lower() == name), "")
+
+
+@dataclass
+class Mailbox:
+    email: str
+    history_id: int
+    messages: Dict[str, FakeMessage] = field(default_factory=dict)
+    labels: Dict[str, Dict] = field(default_factory=dict)  # id -> label resource
+    history: List[Tuple[int, str]] = field(default_factory=list)  # messageAdded records: (history id, message id)
+    history_floor: int = 0  # history.list answers 404 for a startHistoryId older than this
+    watch_expiration: int = 0
+    watch_label_ids: Set[str] = field(default_factory=set)
+    watch_label_filter_behavior: str = "include"
+
+    def watching(self, label_ids: Set[str]) -> bool:
+        if self.watch_expiration <= time.time() * 1000:
+            return False
+        if not self.watch_label_ids:
+            return True
+        hit = bool(self.watch_label_ids & label_ids)
+        return hit if self.watch_label_filter_behavior == "include" else not hit
+
+    def start_watch(self, label_ids, label_filter_behavior: Optional[str]) -> None:
+        self.watch_expiration = int(time.time() * 1000) + WATCH_TTL_MS
+        self.watch_label_ids = set(label_ids or ())
+        self.watch_label_filter_behavior = label_filter_behavior or "include"
+
+    def label_id(self, name_or_id: str) -> Optional[str]:
+        if name_or_id in self.labels:
+            return name_or_id
+        return next((lid for lid, lb in self.labels.items() if lb["name"].lower() == name_or_id.lower()), None)
+
+
+class FakeGmailBackend:
+    """Every simulated mailbox, plus fault injection and call accounting.
+
+    latency_seconds (+ up to jitter_seconds) is slept per HTTP round trip; a
+    batch is one round trip. error_rates maps an HTTP status (429, 403, 500,
+    503) to the probability that any single call fails with it. notify is
+    called with (email, historyId) whenever a watched mailbox gains a message
+    that passes the watch's label filter, like Gmail publishing to the topic.
+    """
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        jitter_seconds: float = 0.0,
+        error_rates: Optional[Dict[int, float]] = None,
+        retry_after_seconds: Optional[float] = None,
+        seed: int = 0,
+        notify: Optional[Callable[[str, int], None]] = None,
+    ):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.error_rates = dict(error_rates or {})
+        self.retry_after_seconds = retry_after_seconds
+        self.notify = notify
+        self.mailboxes: Dict[str, Mailbox] = {}
+        self.calls: Counter = Counter()  # per API method, including batch parts
+        self.errors: Counter = Counter()  # injected failures per (method, status)
+        self.http_requests = 0
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(0x18C0000000000000)
+
+    def __call__(self, user_email: str) -> "FakeGmail":
+        return self.client(user_email)
+
+    def client(self, user_email: str) -> "FakeGmail":
+        return FakeGmail(self, self.mailbox(user_email))
+
+    def mailbox(self, user_email: str) -> Mailbox:
+        key = user_email.lower()
+        with self._lock:
+            box = self.mailboxes.get(key)
+            if box is None:
+                box = Mailbox(email=user_email, history_id=1000 + self._random.randrange(1000))
+                box.history_floor = box.history_id
+                for name in SYSTEM_LABELS:
+                    box.labels[name] = {"id": name, "name": name, "type": "system"}
+                self.mailboxes[key] = box
+            return box
+
+    # --- seeding ----------------------------------------------------------
+
+    def deliver(
+        self,
+        user_email: str,
+        subject: str,
+        rfc822_id: Optional[str] = None,
+        sender: str = "sender@example.net",
+        body_bytes: int = 2048,
+        thread_id: Optional[str] = None,
+        received: Optional[float] = None,
+    ) -> str:
+        """Put a new message in a mailbox as if it arrived by SMTP; returns its Gmail id."""
+        box = self.mailbox(user_email)
+        rfc822_id = rfc822_id or f"<{next(self._ids):x}@sim.example.net>"
+        when = received if received is not None else time.time()
+        raw = (
+            f"From: {sender}\r\nTo: {box.email}\r\nSubject: {subject}\r\nMessage-Id: {rfc822_id}\r\n"
+            f"Date: {time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(when))}\r\n\r\n"
+        ).encode("utf-8") + b"x" * body_bytes
+        return self._add_message(box, raw, {"INBOX", "UNREAD"}, thread_id, int(when * 1000))
+
+    def expire_history(self, user_email: str) -> None:
+        """Drop the mailbox's history so the next history.list from an old cursor answers 404."""
+        box = self.mailbox(user_email)
+        with self._lock:
+            box.history.clear()
+            box.history_floor = box.history_id
+
+    def watch(self, user_email: str, label_ids=None, label_filter_behavior: Optional[str] = None) -> int:
+        """Start notifications for this mailbox without an API call; returns its historyId."""
+        box = self.mailbox(user_email)
+        with self._lock:
+            box.start_watch(label_ids, label_filter_behavior)
+            return box.history_id
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.http_requests = 0
+
+    def _add_message(self, box: Mailbox, raw: bytes, label_ids: Set[str], thread_id: Optional[str], internal_date: int) -> str:
+        # Gmail serves header values (metadata format, search) with RFC 2047 encoded-words decoded.
+        headers = [(k, str(v)) for k, v in BytesHeaderParser(policy=policy.default).parsebytes(raw).items()]
+        with self._lock:
+            msg_id = f"{next(self._ids):x}"
+            if not thread_id or not any(m.thread_id == thread_id for m in box.messages.values()):
+                thread_id = msg_id
+            box.history_id += 1
+            box.messages[msg_id] = FakeMessage(msg_id, thread_id, raw, headers, set(label_ids), internal_date, box.history_id)
+            box.history.append((box.history_id, msg_id))
+            watched = box.watching(set(label_ids))
+            history_id = box.history_id
+        if watched and self.notify is not None:
+            self.notify(box.email, history_id)
+        return msg_id
+
+    # --- transport --------------------------------------------------------
+
+    def _round_trip(self) -> None:
+        with self._lock:
+            self.http_requests += 1
+            delay = self.latency_seconds + (self._random.random() * self.jitter_seconds if self.jitter_seconds else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _run(self, method: str, func: Callable):
+        with self._lock:
+            self.calls[method] += 1
+            for status, rate in self.error_rates.items():
+                if rate > 0 and self._random.random() < rate:
+                    self.errors[(method, status)] += 1
+                    raise http_error(
+                        status,
+                        "Injected failure",
+                        reason=_ERROR_REASONS.get(status, "backendError"),
+                        retry_after=self.retry_after_seconds if status in _ERROR_REASONS else None,
+                    )
+            return func()
+
+
+class _Request:
+    def __init__(self, backend: FakeGmailBackend, method: str, func: Callable):
+        self.backend = backend
+        self.method = method
+        self.func = func
+
+    def execute(self, num_retries: int = 0):
+        self.backend._round_trip()
+        return self.backend._run(self.method, self.func)
+
+
+class _Batch:
+    def __init__(self, backend: FakeGmailBackend, callback: Optional[Callable]):
+        self.backend = backend
+        self.callback = callback
+        self.parts: List[Tuple[str, _Request, Optional[Callable]]] = []
+
+    def add(self, request: _Request, callback: Optional[Callable] = None, request_id: Optional[str] = None):
+        self.parts.append((request_id or str(len(self.parts) + 1), request, callback))
+
+    def execute(self):
+        if len(self.parts) > MAX_BATCH_PARTS:
+            raise http_error(400, f"Too many requests in batch; max is {MAX_BATCH_PARTS}", reason="invalidArgument")
+        self.backend._round_trip()
+        for request_id, request, callback in self.parts:
+            callback = callback or self.callback
+            try:
+                response = self.backend._run(request.method, request.func)
+            except HttpError as exc:
+                if callback is not None:
+                    callback(request_id, None, exc)
+            else:
+                if callback is not None:
+                    callback(request_id, response, None)
+
+
+class FakeGmail:
+    """One mailbox's client, as returned by the backend (``backend(user_email)``)."""
+
+    def __init__(self, backend: FakeGmailBackend, box: Mailbox):
+        self.backend = backend
+        self.box = box
+        self.user_email = box.email
+
+    def users(self) -> "_Users":
+        return _Users(self.backend, self.box)
+
+    def new_batch_http_request(self, callback: Optional[Callable] = None) -> _Batch:
+        return _Batch(self.backend, callback)
+
+
+class _Resource:
+    def __init__(self, backend: FakeGmailBackend, box: Mailbox):
+        self.backend = backend
+        self.box = box
+
+    def _request(self, method: str, func: Callable) -> _Request:
+        return _Request(self.backend, method, func)
+
+    def _check_labels(self, label_ids: List[str]) -> None:
+        for lid in label_ids:
+            if lid not in self.box.labels:
+                raise http_error(400, f"Invalid label: {lid}", reason="invalidArgument")
+
+
+class _Users(_Resource):
+    def messages(self) -> "_Messages":
+        return _Messages(self.backend, self.box)
+
+    def threads(self) -> "_Threads":
+        return _Threads(self.backend, self.box)
+
+    def labels(self) -> "_Labels":
+        return _Labels(self.backend, self.box)
+
+    def history(self) -> "_History":
+        return _History(self.backend, self.box)
+
+    def getProfile(self, userId: str):
+        def run():
+            return {
+                "emailAddress": self.box.email,
+                "messagesTotal": len(self.box.messages),
+                "threadsTotal": len({m.thread_id for m in self.box.messages.values()}),
+                "historyId": str(self.box.history_id),
+            }
+
+        return self._request("users.getProfile", run)
+
+    def watch(self, userId: str, body: Dict):
+        def run():
+            self.box.start_watch(body.get("labelIds"), body.get("labelFilterBehavior"))
+            return {"historyId": str(self.box.history_id), "expiration": str(self.box.watch_expiration)}
+
+        return self._request("users.watch", run)
+
+    def stop(self, userId: str):
+        def run():
+            self.box.watch_expiration = 0
+            return {}
+
+        return self._request("users.stop", run)
+
+
+class _History(_Resource):
+    def list(self, userId: str, startHistoryId, historyTypes=None, maxResults: int = 100, pageToken=None, labelId=None):
+        def run():
+            start = int(startHistoryId)
+            if start < self.box.history_floor:
+                raise _not_found()
+            records = [(hid, mid) for hid, mid in self.box.history if hid > start]
+            if labelId:
+                records = [(hid, mid) for hid, mid in records if labelId in self._labels_of(mid)]
+            offset = int(pageToken or 0)
+            page = records[offset : offset + maxResults]
+            res: Dict = {"historyId": str(self.box.history_id)}
+            if page:
+                res["history"] = [self._record(hid, mid) for hid, mid in page]
+            if offset + maxResults < len(records):
+                res["nextPageToken"] = str(offset + maxResults)
+            return res
+
+        return self._request("history.list", run)
+
+    def _labels_of(self, msg_id: str) -> Set[str]:
+        msg = self.box.messages.get(msg_id)
+        return msg.label_ids if msg is not None else set()
+
+    def _record(self, hid: int, msg_id: str) -> Dict:
+        msg = self.box.messages.get(msg_id)
+        ref = {"id": msg_id, "threadId": msg.thread_id if msg else msg_id}
+        added = dict(ref, labelIds=sorted(msg.label_ids)) if msg else ref
+        return {"id": str(hid), "messages": [ref], "messagesAdded": [{"message": added}]}
+
+
+class _Messages(_Resource):
+    def get(self, userId: str, id: str, format: str = "full", metadataHeaders=None):
+        def run():
+            msg = self.box.messages.get(id)
+            if msg is None:
+                raise _not_found()
+            res = {
+                "id": msg.id,
+                "threadId": msg.thread_id,
+                "labelIds": sorted(msg.label_ids),
+                "sizeEstimate": len(msg.raw),
+                "historyId": str(msg.history_id),
+                "internalDate": str(msg.internal_date),
+            }
+            if format == "raw":
+                res["raw"] = base64.urlsafe_b64encode(msg.raw).decode("ascii")
+            elif format in ("metadata", "full"):
+                wanted = {h.lower() for h in metadataHeaders or ()}
+                headers = [{"name": k, "value": v} for k, v in msg.headers if not wanted or k.lower() in wanted]
+                res["payload"] = {"mimeType": "text/plain", "headers": headers}
+            return res
+
+        return self._request("messages.get", run)
+
+    def list(self, userId: str, q: str = "", maxResults: int = 100, pageToken=None, labelIds=None):
+        def run():
+            hits = [m for m in self.box.messages.values() if self._matches(m, q, labelIds or ())]
+            hits.sort(key=lambda m: (m.internal_date, m.id), reverse=True)
+            offset = int(pageToken or 0)
+            page = hits[offset : offset + maxResults]
+            res: Dict = {"resultSizeEstimate": len(hits)}
+            if page:
+                res["messages"] = [{"id": m.id, "threadId": m.thread_id} for m in page]
+            if offset + maxResults < len(hits):
+                res["nextPageToken"] = str(offset + maxResults)
+            return res
+
+        return self._request("messages.list", run)
+
+    def insert(self, userId: str, body: Dict, media_body=None, internalDateSource=None):
+        def run():
+            if media_body is not None:
+                raw = media_body.getbytes(0, media_body.size())
+            elif body.get("raw"):
+                # Gmail takes base64url with or without '=' padding.
+                raw = base64.urlsafe_b64decode(body["raw"] + "=" * (-len(body["raw"]) % 4))
+            else:
+                raise http_error(400, "'raw' RFC822 payload message string or uploading message via /upload/* URL required", reason="invalidArgument")
+            label_ids = list(body.get("labelIds") or [])
+            self._check_labels(label_ids)
+            msg_id = self.backend._add_message(self.box, raw, set(label_ids), body.get("threadId"), int(time.time() * 1000))
+            msg = self.box.messages[msg_id]
+            return {"id": msg.id, "threadId": msg.thread_id, "labelIds": sorted(msg.label_ids)}
+
+        return self._request("messages.insert", run)
+
+    def modify(self, userId: str, id: str, body: Dict):
+        def run():
+            msg = self.box.messages.get(id)
+            if msg is None:
+                raise _not_found()
+            self._apply(msg, body)
+            return {"id": msg.id, "threadId": msg.thread_id, "labelIds": sorted(msg.label_ids)}
+
+        return self._request("messages.modify", run)
+
+    def batchModify(self, userId: str, body: Dict):
+        def run():
+            ids = body.get("ids") or []
+            if len(ids) > 1000:
+                raise http_error(400, "Too many ids; max is 1000", reason="invalidArgument")
+            for msg_id in ids:
+                msg = self.box.messages.get(msg_id)
+                if msg is not None:
+                    self._apply(msg, body)
+            return None
+
+        return self._request("messages.batchModify", run)
+
+    def _apply(self, msg: FakeMessage, body: Dict) -> None:
+        add = list(body.get("addLabelIds") or [])
+        remove = list(body.get("removeLabelIds") or [])
+        self._check_labels(add + remove)
+        msg.label_ids.update(add)
+        msg.label_ids.difference_update(remove)
+
+    def _matches(self, msg: FakeMessage, q: str, label_ids) -> bool:
+        if any(lid not in msg.label_ids for lid in label_ids):
+            return False
+        # {a b} is an OR group; everything else is ANDed.
+        for group in _OR_GROUP.findall(q or ""):
+            if not any(self._term(msg, *term) for term in _QUERY_TERM.findall(group)):
+                return False
+        return all(self._term(msg, *term) for term in _QUERY_TERM.findall(_OR_GROUP.sub(" ", q or "")))
+
+    def _term(self, msg: FakeMessage, key: str, quoted: str, key2: str, value: str, phrase: str, word: str) -> bool:
+        key = (key or key2).lower()
+        value = quoted or value or phrase or word
+        if key == "rfc822msgid":
+            return _strip_brackets(msg.header("Message-Id")) == _strip_brackets(value)
+        if key == "subject":
+            return value.lower() in msg.header("Subject").lower()
+        if key == "from":
+            return value.lower() in msg.header("From").lower()
+        if key in ("after", "before"):
+            seconds = msg.internal_date // 1000
+            return seconds > int(value) if key == "after" else seconds < int(value)
+        if key == "label":
+            lid = self.box.label_id(value)
+            return lid is not None and lid in msg.label_ids
+        return value.lower() in msg.header("Subject").lower()
+
+
+class _Threads(_Resource):
+    def modify(self, userId: str, id: str, body: Dict):
+        def run():
+            msgs = [m for m in self.box.messages.values() if m.thread_id == id]
+            if not msgs:
+                raise _not_found()
+            add = list(body.get("addLabelIds") or [])
+            remove = list(body.get("removeLabelIds") or [])
+            self._check_labels(add + remove)
+            for msg in msgs:
+                msg.label_ids.update(add)
+                msg.label_ids.difference_update(remove)
+            return {"id": id}
+
+        return self._request("threads.modify", run)
+
+
+class _Labels(_Resource):
+    def list(self, userId: str):
+        return self._request("labels.list", lambda: {"labels": [dict(lb) for lb in self.box.labels.values()]})
+
+    def create(self, userId: str, body: Dict):
+        def run():
+            name = body["name"]
+            if self.box.label_id(name) is not None:
+                raise http_error(409, "Label name exists or conflicts", reason="failedPrecondition")
+            lid = f"Label_{len(self.box.labels) - len(SYSTEM_LABELS) + 1}"
+            label = dict(body, id=lid, type="user")
+            self.box.labels[lid] = label
+            return label
+
+        return self._request("labels.create", run)
@@ -0,0 +1,142 @@
+"""Offline stand-in for the Gmail watch subscription, for load tests.
+
+SimSubscription queues Gmail push notifications and delivers them to a
+callback from a pool of threads with the same flow control and ack/nack rules
+as src.gcp.pubsub.Subscriber: an exception nacks, a returned Future settles
+the message when it completes. Nacked messages are redelivered after a delay
+and dead-lettered after max_delivery_attempts.
+"""
+import collections
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+
+class SimMessage:
+    def __init__(self, subscription: "SimSubscription", message_id: str, data: bytes, attributes: Dict[str, str]):
+        self.subscription = subscription
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.published = time.monotonic()
+        self.delivery_attempt = 0
+        self._settled = False
+
+    def ack(self) -> None:
+        self.subscription._settle(self, True)
+
+    def nack(self) -> None:
+        self.subscription._settle(self, False)
+
+
+@dataclass
+class SubscriptionStats:
+    published: int = 0
+    acked: int = 0
+    nacks: int = 0
+    dead_lettered: int = 0
+    ack_latencies: List[float] = field(default_factory=list)  # publish -> ack, seconds
+
+
+class SimSubscription:
+    def __init__(
+        self,
+        max_outstanding: int = 50,
+        concurrency: int = 10,
+        max_delivery_attempts: int = 10,
+        redelivery_delay_seconds: float = 0.1,
+    ):
+        self.max_outstanding = max(1, max_outstanding)
+        self.concurrency = max(1, concurrency)
+        self.max_delivery_attempts = max_delivery_attempts
+        self.redelivery_delay = redelivery_delay_seconds
+        self.stats = SubscriptionStats()
+        self.dead_letters: List[SimMessage] = []
+        self._ready: Deque[SimMessage] = collections.deque()
+        self._delayed: List = []  # (due monotonic time, message)
+        self._outstanding = 0
+        self._ids = 0
+        self._cond = threading.Condition()
+
+    def publish(self, data: bytes, attributes: Optional[Dict[str, str]] = None) -> str:
+        with self._cond:
+            self._ids += 1
+            message = SimMessage(self, str(self._ids), data, dict(attributes or {}))
+            self._ready.append(message)
+            self.stats.published += 1
+            self._cond.notify_all()
+        return message.message_id
+
+    def publish_notification(self, email: str, history_id: int) -> str:
+        """Publish what Gmail sends to the watch topic when a mailbox changes."""
+        payload = {"source": "gmail", "emailAddress": email, "historyId": str(history_id)}
+        return self.publish(json.dumps(payload).encode("utf-8"), {"version": "1"})
+
+    def run(self, callback: Callable, idle_timeout: float = 0.0) -> SubscriptionStats:
+        """Deliver until nothing is queued, delayed or in flight (and nothing is published for idle_timeout)."""
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sim-callback") as pool:
+            while True:
+                message = self._next(idle_timeout)
+                if message is None:
+                    break
+                pool.submit(self._deliver, callback, message)
+        return self.stats
+
+    def _next(self, idle_timeout: float) -> Optional[SimMessage]:
+        with self._cond:
+            idle_since = None
+            while True:
+                now = time.monotonic()
+                due = [entry for entry in self._delayed if entry[0] <= now]
+                for entry in due:
+                    self._delayed.remove(entry)
+                    self._ready.append(entry[1])
+                if self._ready and self._outstanding < self.max_outstanding:
+                    message = self._ready.popleft()
+                    message.delivery_attempt += 1
+                    message._settled = False
+                    self._outstanding += 1
+                    return message
+                if not self._ready and not self._delayed and not self._outstanding:
+                    idle_since = idle_since or now
+                    if now - idle_since >= idle_timeout:
+                        return None
+                else:
+                    idle_since = None
+                waits = [entry[0] - now for entry in self._delayed]
+                if idle_since is not None:
+                    waits.append(idle_timeout - (now - idle_since))
+                self._cond.wait(timeout=max(0.001, min(waits)) if waits else None)
+
+    def _deliver(self, callback: Callable, message: SimMessage) -> None:
+        try:
+            result = callback(message)
+        except Exception:  # noqa: BLE001
+            message.nack()
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(
+                lambda fut: message.nack() if fut.cancelled() or fut.exception() is not None else message.ack()
+            )
+            return
+        message.ack()
+
+    def _settle(self, message: SimMessage, acked: bool) -> None:
+        with self._cond:
+            if message._settled:
+                return
+            message._settled = True
+            self._outstanding -= 1
+            if acked:
+                self.stats.acked += 1
+                self.stats.ack_latencies.append(time.monotonic() - message.published)
+            elif message.delivery_attempt >= self.max_delivery_attempts:
+                self.stats.dead_lettered += 1
+                self.dead_letters.append(message)
+            else:
+                self.stats.nacks += 1
+                self._delayed.append((time.monotonic() + self.redelivery_delay, message))
+            self._cond.notify_all()
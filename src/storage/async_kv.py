@@ -0,0 +1,112 @@
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from google.cloud import firestore
+
+from src.storage.firestore_kv import _MAX_BATCH_WRITES, _TRANSIENT, _document
+from src.storage.kv import AsyncKeyValueStore
+from src.utils import metrics
+from src.utils.circuit import guards_for
+from src.utils.retry import async_exponential_backoff_retry
+
+
+async def _guarded(op: str, func: Callable[[], Awaitable]):
+    """Async _guarded from firestore_kv: the firestore breaker only, no extra retries."""
+    guards = guards_for("firestore")
+    with metrics.timed("kv_op_seconds", backend="firestore_async", op=op):
+        return await async_exponential_backoff_retry(
+            func,
+            is_retryable=lambda exc: isinstance(exc, _TRANSIENT),
+            max_retries=0,
+            breakers=guards.get("breakers", ()),
+        )
+
+
+class AsyncFirestoreKV(AsyncKeyValueStore):
+    """FirestoreKV on firestore.AsyncClient; same collection and document layout."""
+
+    def __init__(self, project_id: str, collection_prefix: str = "gts"):
+        self._client = firestore.AsyncClient(project=project_id)
+        self._collection = f"{collection_prefix}_kv"
+
+    async def get(self, key: str) -> Optional[str]:
+        doc_ref = self._client.collection(self._collection).document(key)
+        doc = await _guarded("get", doc_ref.get)
+        if doc.exists:
+            return (doc.to_dict() or {}).get("value")
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        doc_ref = self._client.collection(self._collection).document(key)
+        await _guarded("set", lambda: doc_ref.set(_document(value), merge=True))
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        collection = self._client.collection(self._collection)
+        refs = [collection.document(k) for k in dict.fromkeys(keys)]
+        if not refs:
+            return {}
+
+        async def _get_all():
+            return [doc async for doc in self._client.get_all(refs, field_paths=["value"])]
+
+        found: Dict[str, str] = {}
+        for doc in await _guarded("get_many", _get_all):
+            if doc.exists:
+                value = (doc.to_dict() or {}).get("value")
+                if value is not None:
+                    found[doc.id] = value
+        return found
+
+    async def set_many(self, items: Dict[str, str]) -> None:
+        collection = self._client.collection(self._collection)
+        pairs = list(items.items())
+        for i in range(0, len(pairs), _MAX_BATCH_WRITES):
+            batch = self._client.batch()
+            for key, value in pairs[i : i + _MAX_BATCH_WRITES]:
+                batch.set(collection.document(key), _document(value), merge=True)
+            await _guarded("set_many", batch.commit)
+
+    async def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]]) -> Optional[str]:
+        doc_ref = self._client.collection(self._collection).document(key)
+
+        @firestore.async_transactional
+        async def _txn(transaction):
+            doc = await doc_ref.get(transaction=transaction)
+            current = (doc.to_dict() or {}).get("value") if doc.exists else None
+            new = fn(current)
+            if new is None:
+                return current
+            transaction.set(doc_ref, _document(new), merge=True)
+            return new
+
+        return await _guarded("update", lambda: _txn(self._client.transaction()))
+
+    async def update_many(
+        self, fns: Dict[str, Callable[[Optional[str]], Optional[str]]], ttl_seconds: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        collection = self._client.collection(self._collection)
+        keys = list(fns)
+        results: Dict[str, Optional[str]] = {}
+        for i in range(0, len(keys), _MAX_BATCH_WRITES):
+            refs = [collection.document(k) for k in keys[i : i + _MAX_BATCH_WRITES]]
+
+            @firestore.async_transactional
+            async def _txn(transaction):
+                docs = {doc.id: doc async for doc in self._client.get_all(refs, transaction=transaction)}
+                done: Dict[str, Optional[str]] = {}
+                for ref in refs:
+                    doc = docs.get(ref.id)
+                    current = (doc.to_dict() or {}).get("value") if doc is not None and doc.exists else None
+                    new = fns[ref.id](current)
+                    if new is None:
+                        done[ref.id] = current
+                        continue
+                    transaction.set(ref, _document(new, ttl_seconds), merge=True)
+                    done[ref.id] = new
+                return done
+
+            results.update(await _guarded("update_many", lambda: _txn(self._client.transaction())))
+        return results
+
+    async def close(self) -> None:
+        self._client.close()
+
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from src.storage.kv import KeyValueStore
+from src.utils import metrics
+
+
+class CachedKV(KeyValueStore):
+    """In-process LRU read-through cache with TTL in front of another store.
+
+    Only values that exist are cached; a miss always goes to the backing store,
+    so keys written by another replica become visible on the next read.
+    """
+
+    def __init__(self, inner: KeyValueStore, max_entries: int = 10000, ttl_seconds: float = 300.0):
+        self.inner = inner
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        hit = self._lookup(key)
+        if hit is not None:
+            return hit
+        value = self.inner.get(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.inner.set(key, value)
+        self._remember(key, value)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        misses = []
+        for key in dict.fromkeys(keys):
+            hit = self._lookup(key)
+            if hit is not None:
+                found[key] = hit
+            else:
+                misses.append(key)
+        if misses:
+            fetched = self.inner.get_many(misses)
+            for key, value in fetched.items():
+                self._remember(key, value)
+            found.update(fetched)
+        return found
+
+    def set_many(self, items: Dict[str, str]) -> None:
+        self.inner.set_many(items)
+        for key, value in items.items():
+            self._remember(key, value)
+
+    def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]]) -> Optional[str]:
+        # Read-modify-write must see the authoritative value, not the cache.
+        value = self.inner.update(key, fn)
+        if value is None:
+            self.invalidate(key)
+        else:
+            self._remember(key, value)
+        return value
+
+    def update_many(
+        self, fns: Dict[str, Callable[[Optional[str]], Optional[str]]], ttl_seconds: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        values = self.inner.update_many(fns, ttl_seconds)
+        for key, value in values.items():
+            if value is None:
+                self.invalidate(key)
+            else:
+                self._remember(key, value)
+        return values
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def close(self) -> None:
+        close_inner = getattr(self.inner, "close", None)
+        if close_inner is not None:
+            close_inner()
+
+    def _lookup(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.inc("kv_cache_requests_total", result="miss" if entry is None else "hit")
+        return entry[0] if entry is not None else None
+
+    def _remember(self, key: str, value: str) -> None:
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,112 @@
+import json
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.domain.model import FanoutError
+from src.utils.retry import http_status
+
+
+def cursor_key(user_email: str) -> str:
+    return f"history_cursor:{user_email}"
+
+
+def get_history_cursor(kv, user_email: str) -> Optional[str]:
+    return kv.get(cursor_key(user_email))
+
+
+def _forward_only(history_id) -> Tuple[Callable[[Optional[str]], Optional[str]], List[bool]]:
+    """An update fn that only ever raises the cursor, and a list that records whether it did."""
+    target = int(history_id)
+    moved: List[bool] = []
+
+    def _advance(current: Optional[str]) -> Optional[str]:
+        moved.clear()
+        if current is not None and int(current) >= target:
+            return None
+        moved.append(True)
+        return str(target)
+
+    return _advance, moved
+
+
+def advance_history_cursor(kv, user_email: str, history_id) -> bool:
+    """Move the cursor forward to history_id; never moves it backwards.
+
+    Returns True if the stored cursor changed.
+    """
+    advance, moved = _forward_only(history_id)
+    kv.update(cursor_key(user_email), advance)
+    return bool(moved)
+
+
+def init_history_cursor(kv, user_email: str, history_id) -> bool:
+    """Set the cursor to history_id only if the mailbox has none yet; returns True if it did."""
+    created: List[bool] = []
+
+    def _init(current: Optional[str]) -> Optional[str]:
+        if current:
+            return None
+        created.append(True)
+        return str(history_id)
+
+    kv.update(cursor_key(user_email), _init)
+    return bool(created)
+
+
+async def get_history_cursor_async(kv, user_email: str) -> Optional[str]:
+    return await kv.get(cursor_key(user_email))
+
+
+async def advance_history_cursor_async(kv, user_email: str, history_id) -> bool:
+    advance, moved = _forward_only(history_id)
+    await kv.update(cursor_key(user_email), advance)
+    return bool(moved)
+
+
+def last_sync_key(user_email: str) -> str:
+    return f"last_sync:{user_email}"
+
+
+def get_last_sync(kv, user_email: str) -> Optional[int]:
+    """Epoch seconds of the last sync that completed for this mailbox, if any."""
+    value = kv.get(last_sync_key(user_email))
+    return int(value) if value else None
+
+
+def record_sync(kv, user_email: str, when: float) -> None:
+    kv.set(last_sync_key(user_email), str(int(when)))
+
+
+async def get_last_sync_async(kv, user_email: str) -> Optional[int]:
+    value = await kv.get(last_sync_key(user_email))
+    return int(value) if value else None
+
+
+async def record_sync_async(kv, user_email: str, when: float) -> None:
+    await kv.set(last_sync_key(user_email), str(int(when)))
+
+
+def last_error_key(user_email: str) -> str:
+    return f"sync_error:{user_email}"
+
+
+def error_class(exc: BaseException) -> str:
+    """Short, filterable name for a sync failure, e.g. HttpError403, FanoutError, CircuitOpenError."""
+    if isinstance(exc, FanoutError):
+        return "FanoutError"
+    status = http_status(exc)
+    return f"{type(exc).__name__}{status}" if status else type(exc).__name__
+
+
+def record_error(kv, user_email: str, exc: BaseException) -> None:
+    kv.set(last_error_key(user_email), json.dumps({"class": error_class(exc), "at": int(time.time())}))
+
+
+def get_last_error(kv, user_email: str) -> Optional[Dict]:
+    """{"class", "at"} of the last failed sync for this mailbox, if one was recorded."""
+    value = kv.get(last_error_key(user_email))
+    return json.loads(value) if value else None
+
+
+async def record_error_async(kv, user_email: str, exc: BaseException) -> None:
+    await kv.set(last_error_key(user_email), json.dumps({"class": error_class(exc), "at": int(time.time())}))
@@ -1,16 +1,60 @@
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Optional
 
+from google.api_core import exceptions as gexc
 from google.cloud import firestore
 
+from src.storage.kv import KeyValueStore
+from src.utils import metrics
+from src.utils.circuit import guards_for
+from src.utils.retry import exponential_backoff_retry
 
-class FirestoreKV:
+# Firestore caps a write batch at 500 operations.
+_MAX_BATCH_WRITES = 500
+# Timestamp field for a Firestore TTL policy on the {prefix}_kv collection group.
+EXPIRE_FIELD = "expire_at"
+
+_TRANSIENT = (
+    gexc.ServiceUnavailable,
+    gexc.DeadlineExceeded,
+    gexc.InternalServerError,
+    gexc.TooManyRequests,
+    gexc.ResourceExhausted,
+    gexc.RetryError,
+)
+
+
+def _guarded(op: str, func: Callable):
+    """Run a Firestore call behind the firestore circuit breaker, timing it as KV operation ``op``.
+
+    The client library already retries transient errors itself, so no extra
+    attempts are made here; failures only feed the breaker.
+    """
+    guards = guards_for("firestore")
+    with metrics.timed("kv_op_seconds", backend="firestore", op=op):
+        return exponential_backoff_retry(
+            func,
+            is_retryable=lambda exc: isinstance(exc, _TRANSIENT),
+            max_retries=0,
+            breakers=guards.get("breakers", ()),
+        )
+
+
+def _document(value: str, ttl_seconds: Optional[float] = None) -> Dict:
+    # Written with merge=True, so a write without a TTL has to drop an earlier expiry explicitly.
+    if ttl_seconds is None:
+        return {"value": value, EXPIRE_FIELD: firestore.DELETE_FIELD}
+    return {"value": value, EXPIRE_FIELD: datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)}
+
+
+class FirestoreKV(KeyValueStore):
     def __init__(self, project_id: str, collection_prefix: str = "gts"):
         self._client = firestore.Client(project=project_id)
         self._collection = f"{collection_prefix}_kv"
 
     def get(self, key: str) -> Optional[str]:
         doc_ref = self._client.collection(self._collection).document(key)
-        doc = doc_ref.get()
+        doc = _guarded("get", doc_ref.get)
         if doc.exists:
             data = doc.to_dict() or {}
             return data.get("value")
@@ -18,5 +62,73 @@ class FirestoreKV:
 
     def set(self, key: str, value: str) -> None:
         doc_ref = self._client.collection(self._collection).document(key)
-        doc_ref.set({"value": value}, merge=True)
+        _guarded("set", lambda: doc_ref.set(_document(value), merge=True))
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        collection = self._client.collection(self._collection)
+        refs = [collection.document(k) for k in dict.fromkeys(keys)]
+        if not refs:
+            return {}
+        found: Dict[str, str] = {}
+        docs = _guarded("get_many", lambda: list(self._client.get_all(refs, field_paths=["value"])))
+        for doc in docs:
+            if doc.exists:
+                value = (doc.to_dict() or {}).get("value")
+                if value is not None:
+                    found[doc.id] = value
+        return found
+
+    def set_many(self, items: Dict[str, str]) -> None:
+        collection = self._client.collection(self._collection)
+        pairs = list(items.items())
+        for i in range(0, len(pairs), _MAX_BATCH_WRITES):
+            batch = self._client.batch()
+            for key, value in pairs[i : i + _MAX_BATCH_WRITES]:
+                batch.set(collection.document(key), _document(value), merge=True)
+            _guarded("set_many", batch.commit)
+
+    def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]]) -> Optional[str]:
+        doc_ref = self._client.collection(self._collection).document(key)
+
+        @firestore.transactional
+        def _txn(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            current = (doc.to_dict() or {}).get("value") if doc.exists else None
+            new = fn(current)
+            if new is None:
+                return current
+            transaction.set(doc_ref, _document(new), merge=True)
+            return new
+
+        return _guarded("update", lambda: _txn(self._client.transaction()))
+
+    def update_many(
+        self, fns: Dict[str, Callable[[Optional[str]], Optional[str]]], ttl_seconds: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        collection = self._client.collection(self._collection)
+        keys = list(fns)
+        results: Dict[str, Optional[str]] = {}
+        # One transaction per _MAX_BATCH_WRITES keys; callers pass far fewer.
+        for i in range(0, len(keys), _MAX_BATCH_WRITES):
+            refs = [collection.document(k) for k in keys[i : i + _MAX_BATCH_WRITES]]
+
+            @firestore.transactional
+            def _txn(transaction):
+                docs = {doc.id: doc for doc in self._client.get_all(refs, transaction=transaction)}
+                done: Dict[str, Optional[str]] = {}
+                for ref in refs:
+                    doc = docs.get(ref.id)
+                    current = (doc.to_dict() or {}).get("value") if doc is not None and doc.exists else None
+                    new = fns[ref.id](current)
+                    if new is None:
+                        done[ref.id] = current
+                        continue
+                    transaction.set(ref, _document(new, ttl_seconds), merge=True)
+                    done[ref.id] = new
+                return done
+
+            results.update(_guarded("update_many", lambda: _txn(self._client.transaction())))
+        return results
 
+    def close(self) -> None:
+        self._client.close()
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Callable, Dict, Iterable, Optional
 
 
 class KeyValueStore(ABC):
@@ -11,3 +11,61 @@ class KeyValueStore(ABC):
     def set(self, key: str, value: str) -> None:
         raise NotImplementedError
 
+    @abstractmethod
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Return the values of the keys that exist; missing keys are left out."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_many(self, items: Dict[str, str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]]) -> Optional[str]:
+        """Atomically replace the value with fn(current).
+
+        fn returning None leaves the stored value untouched. Returns the value
+        stored after the update.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_many(
+        self, fns: Dict[str, Callable[[Optional[str]], Optional[str]]], ttl_seconds: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        """update() every key with its own fn, all in one transaction.
+
+        Keys written get an expiry ttl_seconds from now (None: never expire),
+        after which the store may drop them.
+        """
+        raise NotImplementedError
+
+
+class AsyncKeyValueStore(ABC):
+    """KeyValueStore with coroutine methods, for the asyncio worker."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_many(self, items: Dict[str, str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]]) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_many(
+        self, fns: Dict[str, Callable[[Optional[str]], Optional[str]]], ttl_seconds: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        raise NotImplementedError
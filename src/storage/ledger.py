@@ -0,0 +1,217 @@
+"""Processed-message ledger: one KV record per rfc822 Message-Id.
+
+``ledger:{rfc822id}`` holds a bitmap of the team mailboxes the message has
+been handled for and, aligned with it, where the copy lives in each one:
+
+    {"done": 5, "loc": [["18f..", "18f.."], null, ["190..", null]]}
+
+Bit i is the i-th address in ``ledger:members``, an append-only list every
+replica extends with the TEAM_USERS it has not seen yet. A mailbox keeps its
+bit for good, so adding a user only adds a bit and removing one leaves its
+bit unread. A sync claims a target's bit before inserting a copy there, so
+two syncs of the same message cannot both insert it. Records are written
+with a TTL, so the store drops them once no resync, replay or backfill can
+bring the message back.
+"""
+import json
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# (gmail message id, thread id) of a message inside one mailbox
+Location = Tuple[Optional[str], Optional[str]]
+
+DAY_SECONDS = 86400
+MEMBERS_KEY = "ledger:members"
+
+
+def ledger_key(rfc822id: str) -> str:
+    return f"ledger:{rfc822id}"
+
+
+def _add_members_fn(team: List[str]) -> Callable[[Optional[str]], Optional[str]]:
+    def _add(current: Optional[str]) -> Optional[str]:
+        members = json.loads(current) if current else []
+        missing = [u for u in team if u not in members]
+        if not missing:
+            return None
+        return json.dumps(members + missing)
+
+    return _add
+
+
+class ProcessedLedger:
+    """Which team mailboxes each Message-Id has been shared to, and where it landed.
+
+    Filled from fan-out results and backfill scans. A target with its bit set
+    was handled before: with a location it needs no Gmail lookup at all, and
+    without one (the copy was never found) it must not be inserted again.
+    """
+
+    def __init__(self, kv, team: List[str], ttl_seconds: Optional[float] = None):
+        self.kv = kv
+        self.team = [u.lower() for u in team]
+        self.ttl_seconds = ttl_seconds
+        # team member -> bit, from ledger:members; loaded on first use
+        self._index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def for_config(cls, cfg, kv) -> "ProcessedLedger":
+        return cls(kv, cfg.team_users, cfg.ledger_ttl_days * DAY_SECONDS or None)
+
+    def get_many(self, rfc822ids: Iterable[str]) -> Dict[str, Dict[str, Location]]:
+        """rfc822id -> {target: location} for the targets already handled; (None, None) if never located."""
+        self._load_members()
+        keys = {ledger_key(rid): rid for rid in rfc822ids}
+        return self._decode(keys, self.kv.get_many(keys))
+
+    def record(self, handled: Dict[str, Dict[str, Location]]) -> None:
+        """Set the bits (and known locations) of rfc822id -> {target: location} in one transaction."""
+        self._load_members()
+        fns = self._update_fns(handled)
+        if fns:
+            self.kv.update_many(fns, self.ttl_seconds)
+
+    def claim(self, rfc822id: str, target: str) -> Optional[Location]:
+        """Set target's bit for rfc822id before inserting a copy there.
+
+        None means the bit was clear and the caller should insert. Otherwise
+        someone else claimed it first and their location is returned, (None, None)
+        while their insert is still running.
+        """
+        self._load_members()
+        found: List[Location] = []
+        fns = self._claim_fns(rfc822id, target, found)
+        if fns:
+            self.kv.update_many(fns, self.ttl_seconds)
+        return found[0] if found else None
+
+    def release(self, rfc822id: str, target: str) -> None:
+        """Undo claim() after a failed insert, unless a location was recorded since."""
+        self._load_members()
+        fns = self._release_fns(rfc822id, target)
+        if fns:
+            self.kv.update_many(fns, self.ttl_seconds)
+
+    def _load_members(self) -> None:
+        if self._index is None:
+            self._members(self.kv.update(MEMBERS_KEY, _add_members_fn(self.team)))
+
+    def _members(self, stored: Optional[str]) -> None:
+        members = json.loads(stored) if stored else []
+        self._index = {u: i for i, u in enumerate(members) if u in self.team}
+
+    def _decode(self, keys: Dict[str, str], values: Dict[str, str]) -> Dict[str, Dict[str, Location]]:
+        found: Dict[str, Dict[str, Location]] = {}
+        for key, value in values.items():
+            record = self._load(value)
+            if record is None:
+                continue
+            done, loc = record["done"], record["loc"]
+            found[keys[key]] = {
+                target: tuple(loc[i]) if i < len(loc) and loc[i] else (None, None)
+                for target, i in self._index.items()
+                if done >> i & 1
+            }
+        return found
+
+    @staticmethod
+    def _load(value: Optional[str]) -> Optional[Dict]:
+        try:
+            record = json.loads(value) if value else None
+        except ValueError:
+            return None
+        # Records from before ledger:members carry a "team" fingerprint and another bit order.
+        if not record or "team" in record:
+            return None
+        record["loc"] = list(record.get("loc") or [])
+        return record
+
+    def _update_fns(self, handled: Dict[str, Dict[str, Location]]) -> Dict[str, Callable[[Optional[str]], Optional[str]]]:
+        fns = {}
+        for rid, targets in handled.items():
+            bits = {self._index[t.lower()]: loc for t, loc in targets.items() if t.lower() in self._index}
+            if bits:
+                fns[ledger_key(rid)] = self._merge_fn(bits)
+        return fns
+
+    def _claim_fns(
+        self, rfc822id: str, target: str, found: List[Location]
+    ) -> Dict[str, Callable[[Optional[str]], Optional[str]]]:
+        i = self._index.get(target.lower())
+        if i is None:
+            return {}
+
+        def _claim(current: Optional[str]) -> Optional[str]:
+            found.clear()  # transactions may run this more than once
+            record = self._load(current) or {"done": 0, "loc": []}
+            if record["done"] >> i & 1:
+                loc = record["loc"]
+                found.append(tuple(loc[i]) if i < len(loc) and loc[i] else (None, None))
+                return None
+            record["done"] |= 1 << i
+            return json.dumps(record, separators=(",", ":"))
+
+        return {ledger_key(rfc822id): _claim}
+
+    def _release_fns(self, rfc822id: str, target: str) -> Dict[str, Callable[[Optional[str]], Optional[str]]]:
+        i = self._index.get(target.lower())
+        if i is None:
+            return {}
+
+        def _release(current: Optional[str]) -> Optional[str]:
+            record = self._load(current)
+            if record is None or not record["done"] >> i & 1 or (i < len(record["loc"]) and record["loc"][i]):
+                return None
+            record["done"] &= ~(1 << i)
+            return json.dumps(record, separators=(",", ":"))
+
+        return {ledger_key(rfc822id): _release}
+
+    def _merge_fn(self, bits: Dict[int, Location]) -> Callable[[Optional[str]], Optional[str]]:
+        def _merge(current: Optional[str]) -> Optional[str]:
+            record = self._load(current) or {"done": 0, "loc": []}
+            loc = record["loc"]
+            for i, (msg_id, thread_id) in bits.items():
+                record["done"] |= 1 << i
+                if msg_id or thread_id:
+                    loc.extend([None] * (i + 1 - len(loc)))
+                    loc[i] = [msg_id, thread_id]
+            # Trailing nulls carry no information.
+            while loc and loc[-1] is None:
+                loc.pop()
+            # Written even when unchanged, so the TTL counts from the last time the message was seen.
+            return json.dumps(record, separators=(",", ":"))
+
+        return _merge
+
+
+class AsyncProcessedLedger(ProcessedLedger):
+    """ProcessedLedger over an AsyncKeyValueStore."""
+
+    async def get_many(self, rfc822ids: Iterable[str]) -> Dict[str, Dict[str, Location]]:
+        await self._load_members_async()
+        keys = {ledger_key(rid): rid for rid in rfc822ids}
+        return self._decode(keys, await self.kv.get_many(keys))
+
+    async def record(self, handled: Dict[str, Dict[str, Location]]) -> None:
+        await self._load_members_async()
+        fns = self._update_fns(handled)
+        if fns:
+            await self.kv.update_many(fns, self.ttl_seconds)
+
+    async def claim(self, rfc822id: str, target: str) -> Optional[Location]:
+        await self._load_members_async()
+        found: List[Location] = []
+        fns = self._claim_fns(rfc822id, target, found)
+        if fns:
+            await self.kv.update_many(fns, self.ttl_seconds)
+        return found[0] if found else None
+
+    async def release(self, rfc822id: str, target: str) -> None:
+        await self._load_members_async()
+        fns = self._release_fns(rfc822id, target)
+        if fns:
+            await self.kv.update_many(fns, self.ttl_seconds)
+
+    async def _load_members_async(self) -> None:
+        if self._index is None:
+            self._members(await self.kv.update(MEMBERS_KEY, _add_members_fn(self.team)))
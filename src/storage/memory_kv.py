@@ -1,17 +1,118 @@
-from typing import Optional
+import time
+from typing import Callable, Dict, Iterable, Optional
 from threading import RLock
 
+from src.storage.kv import AsyncKeyValueStore, KeyValueStore
 
-class InMemoryKV:
+# Expired keys are invisible at once and purged from the dict at most this often.
+SWEEP_INTERVAL_SECONDS = 60.0
+
+
+class InMemoryKV(KeyValueStore):
     def __init__(self):
         self._store = {}
+        self._expires: Dict[str, float] = {}  # key -> time.monotonic() deadline, for keys written with a TTL
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL_SECONDS
         self._lock = RLock()
 
     def get(self, key: str) -> Optional[str]:
         with self._lock:
-            return self._store.get(key)
+            return self._live(key, time.monotonic())
 
     def set(self, key: str, value: str) -> None:
         with self._lock:
             self._store[key] = value
+            self._expires.pop(key, None)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        now = time.monotonic()
+        with self._lock:
+            found = {k: self._live(k, now) for k in keys}
+        return {k: v for k, v in found.items() if v is not None}
+
+    def set_many(self, items: Dict[str, str]) -> None:
+        with self._lock:
+            self._store.update(items)
+            for key in items:
+                self._expires.pop(key, None)
+
+    def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]]) -> Optional[str]:
+        with self._lock:
+            current = self._live(key, time.monotonic())
+            new = fn(current)
+            if new is None:
+                return current
+            self._store[key] = new
+            self._expires.pop(key, None)
+            return new
+
+    def update_many(
+        self, fns: Dict[str, Callable[[Optional[str]], Optional[str]]], ttl_seconds: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        now = time.monotonic()
+        with self._lock:
+            results = {}
+            for key, fn in fns.items():
+                current = self._live(key, now)
+                new = fn(current)
+                if new is None:
+                    results[key] = current
+                    continue
+                self._store[key] = new
+                if ttl_seconds is not None:
+                    self._expires[key] = now + ttl_seconds
+                else:
+                    self._expires.pop(key, None)
+                results[key] = new
+            if now >= self._next_sweep:
+                self._sweep(now)
+            return results
+
+    def _live(self, key: str, now: float) -> Optional[str]:
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= now:
+            self._store.pop(key, None)
+            del self._expires[key]
+            return None
+        return self._store.get(key)
+
+    def _sweep(self, now: float) -> None:
+        for key in [k for k, deadline in self._expires.items() if deadline <= now]:
+            self._store.pop(key, None)
+            del self._expires[key]
+        self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+
+
+class AsyncKVAdapter(AsyncKeyValueStore):
+    """Expose a synchronous in-process store (InMemoryKV) through the async interface.
+
+    Only suitable for stores that never block on I/O.
+    """
+
+    def __init__(self, kv: KeyValueStore):
+        self.kv = kv
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.kv.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        self.kv.set(key, value)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        return self.kv.get_many(keys)
+
+    async def set_many(self, items: Dict[str, str]) -> None:
+        self.kv.set_many(items)
+
+    async def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]]) -> Optional[str]:
+        return self.kv.update(key, fn)
+
+    async def update_many(
+        self, fns: Dict[str, Callable[[Optional[str]], Optional[str]]], ttl_seconds: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        return self.kv.update_many(fns, ttl_seconds)
 
+    async def close(self) -> None:
+        close = getattr(self.kv, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from src.utils import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# circuit_state gauge values
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"circuit {name} is open; retry in {retry_in:.1f}s")
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and fails fast for
+    ``reset_seconds``; then lets one trial call through (half-open)."""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._trial_started = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._publish()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            elapsed = now - self._opened_at
+            if self.state == OPEN and elapsed >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+                self._publish()
+            # A trial that never reported back (e.g. another breaker refused the call) is abandoned.
+            trial_stale = now - self._trial_started >= self.reset_seconds
+            if self.state == HALF_OPEN and (not self._trial_in_flight or trial_stale):
+                self._trial_in_flight = True
+                self._trial_started = now
+                return
+            metrics.inc("circuit_rejected_total", dependency=self.name.split(":")[0])
+            raise CircuitOpenError(self.name, max(0.0, self.reset_seconds - elapsed))
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info("Circuit %s closed", self.name)
+                self.state = CLOSED
+                self._publish()
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.trips += 1
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+                metrics.inc("circuit_opened_total", dependency=self.name.split(":")[0])
+                self._publish()
+                logging.warning("Circuit %s opened after %d failures (trip #%d)", self.name, self.failures, self.trips)
+
+    def _publish(self) -> None:
+        dependency, _, mailbox = self.name.partition(":")
+        labels = {"dependency": dependency, "mailbox": mailbox} if mailbox else {"dependency": dependency}
+        metrics.set_gauge("circuit_state", STATE_VALUES[self.state], **labels)
+
+
+class RetryBudget:
+    """Allow retries only while they stay under ``ratio`` of recent calls.
+
+    Counts are kept over a sliding ``window_seconds``; ``min_retries`` per window
+    are always allowed so a quiet process can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, window_seconds: float = 10.0, min_retries: int = 10, name: str = ""):
+        self.name = name
+        self.ratio = ratio
+        self.window_seconds = window_seconds
+        self.min_retries = min_retries
+        self.exhausted = 0
+        self._calls: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._calls.append(time.monotonic())
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = max(self.min_retries, self.ratio * len(self._calls))
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                metrics.inc("retry_budget_exhausted_total", dependency=self.name)
+                return False
+            self._retries.append(now)
+            return True
+
+    def _trim(self, now: float) -> None:
+        horizon = now - self.window_seconds
+        for q in (self._calls, self._retries):
+            while q and q[0] < horizon:
+                q.popleft()
+
+
+class Resilience:
+    """Breakers per dependency and per mailbox, plus one retry budget per dependency.
+
+    Breaker names are ``dependency`` or ``dependency:mailbox``. A dependency-wide
+    breaker needs more failures to trip, so one broken mailbox cannot open it alone.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        dependency_failure_threshold: int = 20,
+        reset_seconds: float = 30.0,
+        retry_ratio: float = 0.2,
+    ):
+        self.failure_threshold = failure_threshold
+        self.dependency_failure_threshold = dependency_failure_threshold
+        self.reset_seconds = reset_seconds
+        self.retry_ratio = retry_ratio
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(name)
+            if b is None:
+                threshold = self.failure_threshold if ":" in name else self.dependency_failure_threshold
+                b = self._breakers[name] = CircuitBreaker(name, threshold, self.reset_seconds)
+            return b
+
+    def guards(self, dependency: str, mailbox: Optional[str] = None) -> Dict:
+        """Keyword arguments for exponential_backoff_retry guarding one call."""
+        breakers = [self.breaker(dependency)]
+        if mailbox:
+            breakers.append(self.breaker(f"{dependency}:{mailbox.lower()}"))
+        return {"breakers": breakers, "budget": self.budget(dependency)}
+
+    def budget(self, dependency: str) -> RetryBudget:
+        with self._lock:
+            b = self._budgets.get(dependency)
+            if b is None:
+                b = self._budgets[dependency] = RetryBudget(self.retry_ratio, name=dependency)
+            return b
+
+
+_RESILIENCE: Optional[Resilience] = None
+
+
+def guards_for(dependency: str, mailbox: Optional[str] = None) -> Dict:
+    """Breakers and retry budget for a call, or nothing when resilience is not configured."""
+    if _RESILIENCE is None:
+        return {}
+    return _RESILIENCE.guards(dependency, mailbox)
+
+
+def configure_resilience(resilience: Optional[Resilience]) -> None:
+    """Install the process-wide breakers and retry budgets (None disables them)."""
+    global _RESILIENCE
+    _RESILIENCE = resilience
+
+
+def get_resilience() -> Optional[Resilience]:
+    return _RESILIENCE
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a cache hit to a large insert.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def _labelset(labels: Dict[str, object]) -> LabelSet:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+
+class InMemoryExporter:
+    """Aggregates counters, gauges and histograms in process; inspect with counter() / gauge() / histogram()."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters: Dict[Tuple[str, LabelSet], float] = {}
+        self._gauges: Dict[Tuple[str, LabelSet], float] = {}
+        self._histograms: Dict[Tuple[str, LabelSet], _Histogram] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: LabelSet, value: float) -> None:
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, labels: LabelSet, value: float) -> None:
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    def observe(self, name: str, labels: LabelSet, value: float) -> None:
+        with self._lock:
+            hist = self._histograms.get((name, labels))
+            if hist is None:
+                hist = self._histograms[(name, labels)] = _Histogram(self.buckets)
+            hist.count += 1
+            hist.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist.counts[i] += 1
+                    break
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, _labelset(labels)), 0.0)
+
+    def gauge(self, name: str, **labels) -> Optional[float]:
+        with self._lock:
+            return self._gauges.get((name, _labelset(labels)))
+
+    def histogram(self, name: str, **labels) -> Tuple[int, float]:
+        """(observation count, sum of observed seconds)."""
+        with self._lock:
+            hist = self._histograms.get((name, _labelset(labels)))
+            return (hist.count, hist.sum) if hist else (0, 0.0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+def _format_labels(labels: LabelSet, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class PrometheusExporter(InMemoryExporter):
+    """InMemoryExporter that renders the Prometheus text format, optionally over HTTP."""
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda kv: kv[0])
+            hist_rows = [(key, list(h.counts), h.count, h.sum) for key, h in histograms]
+        lines: List[str] = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), value in gauges:
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), counts, count, total in hist_rows:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Serve /metrics from a daemon thread; returns the server so callers can shut it down."""
+        exporter = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # noqa: N802
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info("Serving Prometheus metrics on :%d/metrics", port)
+        return server
+
+
+_EXPORTERS: List[InMemoryExporter] = []
+
+
+def configure_metrics(*exporters: InMemoryExporter) -> None:
+    """Install the process-wide exporters (none disables recording)."""
+    global _EXPORTERS
+    _EXPORTERS = list(exporters)
+
+
+def get_exporters() -> List[InMemoryExporter]:
+    return list(_EXPORTERS)
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    if not _EXPORTERS:
+        return
+    key = _labelset(labels)
+    for exporter in _EXPORTERS:
+        exporter.inc(name, key, value)
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    if not _EXPORTERS:
+        return
+    key = _labelset(labels)
+    for exporter in _EXPORTERS:
+        exporter.set(name, key, value)
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    if not _EXPORTERS:
+        return
+    key = _labelset(labels)
+    for exporter in _EXPORTERS:
+        exporter.observe(name, key, seconds)
+
+
+@contextmanager
+def timed(name: str, **labels) -> Iterator[None]:
+    """Observe how long the block takes (also when it raises) in histogram ``name``."""
+    if not _EXPORTERS:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
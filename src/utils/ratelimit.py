@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose rate adapts to throttling.
+
+    A request larger than the bucket is still admitted once the bucket is full;
+    the balance goes negative and later callers wait it off.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate_fraction: float = 0.1):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = self.max_rate * min_rate_fraction
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until ``tokens`` can be spent; return the seconds waited."""
+        waited = 0.0
+        while True:
+            wait = self._try_take(tokens)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, tokens: float = 1.0) -> float:
+        """acquire() that waits with asyncio.sleep instead of blocking the thread."""
+        waited = 0.0
+        while True:
+            wait = self._try_take(tokens)
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def _try_take(self, tokens: float) -> float:
+        """Spend ``tokens`` and return 0, or return how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._blocked_until - now
+            if wait > 0:
+                return wait
+            need = min(tokens, self.capacity)
+            if self._tokens >= need:
+                self._tokens -= tokens
+                return 0.0
+            return (need - self._tokens) / self.rate
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        """Halve the rate and, if the server said so, stop admitting until Retry-After passes."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def on_success(self) -> None:
+        """Creep back towards the configured rate (additive increase)."""
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class QuotaLimiter:
+    """Gmail quota units per delegated user, plus one bucket for the whole project."""
+
+    def __init__(self, per_user_units_per_sec: float, project_units_per_sec: float):
+        self.per_user_units_per_sec = per_user_units_per_sec
+        self.project = TokenBucket(project_units_per_sec)
+        self._users: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, user: str, units: float) -> float:
+        waited = self._user_bucket(user).acquire(units)
+        return waited + self.project.acquire(units)
+
+    async def acquire_async(self, user: str, units: float) -> float:
+        waited = await self._user_bucket(user).acquire_async(units)
+        return waited + await self.project.acquire_async(units)
+
+    def on_throttled(self, user: str, retry_after: Optional[float] = None) -> None:
+        self._user_bucket(user).on_throttled(retry_after)
+
+    def on_success(self, user: str) -> None:
+        self._user_bucket(user).on_success()
+
+    def _user_bucket(self, user: str) -> TokenBucket:
+        key = user.lower()
+        bucket = self._users.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._users.setdefault(key, TokenBucket(self.per_user_units_per_sec))
+        return bucket
+
+
+_LIMITER: Optional[QuotaLimiter] = None
+
+
+def configure_limiter(limiter: Optional[QuotaLimiter]) -> None:
+    """Install the process-wide limiter used in front of Gmail calls (None disables it)."""
+    global _LIMITER
+    _LIMITER = limiter
+
+
+def get_limiter() -> Optional[QuotaLimiter]:
+    return _LIMITER
@@ -1,8 +1,12 @@
+import asyncio
 import random
 import time
-from typing import Callable, Iterable, Tuple
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Iterable, Optional, Sequence, Tuple
 import socket
 
+from src.utils.circuit import CircuitBreaker, RetryBudget
+
 try:
     from googleapiclient.errors import HttpError  # type: ignore
 except Exception:  # pragma: no cover
@@ -18,31 +22,135 @@ def exponential_backoff_retry(
     factor: float = 2.0,
     max_seconds: float = 60.0,
     max_retries: int = 6,
+    retry_after: Callable[[Exception], Optional[float]] = lambda e: None,
+    breakers: Sequence[CircuitBreaker] = (),
+    budget: Optional[RetryBudget] = None,
 ):
+    """Call func, retrying retryable failures with jittered exponential backoff.
+
+    Every attempt first checks ``breakers`` (CircuitOpenError when one is open)
+    and retryable failures other than throttling count against them. A retry also needs room in
+    ``budget``; when it is exhausted the original error is raised at once.
+    """
     kwargs = kwargs or {}
     attempt = 0
+    if budget is not None:
+        budget.record_call()
+    while True:
+        for breaker in breakers:
+            breaker.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exc:  # noqa: BLE001
+            retryable = is_retryable(exc)
+            for breaker in breakers:
+                if retryable and not is_rate_limited(exc):
+                    breaker.on_failure()
+                else:
+                    # A 4xx, throttling included, says nothing about the dependency's health.
+                    breaker.on_success()
+            attempt += 1
+            if attempt > max_retries or not retryable:
+                raise
+            if budget is not None and not budget.try_spend():
+                raise
+            sleep = backoff_seconds(attempt, base_seconds, factor, max_seconds)
+            time.sleep(max(sleep, min(max_seconds, retry_after(exc) or 0.0)))
+        else:
+            for breaker in breakers:
+                breaker.on_success()
+            return result
+
+
+async def async_exponential_backoff_retry(
+    func: Callable[[], Awaitable],
+    is_retryable: Callable[[Exception], bool] = lambda e: True,
+    base_seconds: float = 1.0,
+    factor: float = 2.0,
+    max_seconds: float = 60.0,
+    max_retries: int = 6,
+    retry_after: Callable[[Exception], Optional[float]] = lambda e: None,
+    breakers: Sequence[CircuitBreaker] = (),
+    budget: Optional[RetryBudget] = None,
+):
+    """exponential_backoff_retry for coroutines: await func() and back off with asyncio.sleep."""
+    attempt = 0
+    if budget is not None:
+        budget.record_call()
     while True:
+        for breaker in breakers:
+            breaker.before_call()
         try:
-            return func(*args, **kwargs)
+            result = await func()
         except Exception as exc:  # noqa: BLE001
+            retryable = is_retryable(exc)
+            for breaker in breakers:
+                if retryable and not is_rate_limited(exc):
+                    breaker.on_failure()
+                else:
+                    breaker.on_success()
             attempt += 1
-            if attempt > max_retries or not is_retryable(exc):
+            if attempt > max_retries or not retryable:
+                raise
+            if budget is not None and not budget.try_spend():
                 raise
-            sleep = min(max_seconds, base_seconds * (factor ** (attempt - 1)))
-            sleep = sleep * (0.5 + random.random())  # jitter 0.5x-1.5x
-            time.sleep(sleep)
+            sleep = backoff_seconds(attempt, base_seconds, factor, max_seconds)
+            await asyncio.sleep(max(sleep, min(max_seconds, retry_after(exc) or 0.0)))
+        else:
+            for breaker in breakers:
+                breaker.on_success()
+            return result
+
+
+def backoff_seconds(attempt: int, base_seconds: float = 1.0, factor: float = 2.0, max_seconds: float = 60.0) -> float:
+    sleep = min(max_seconds, base_seconds * (factor ** (attempt - 1)))
+    return sleep * (0.5 + random.random())  # jitter 0.5x-1.5x
+
+
+def http_status(exc: Exception) -> int:
+    """Return the HTTP status carried by a googleapiclient HttpError, else 0."""
+    if HttpError is None or not isinstance(exc, HttpError):
+        return 0
+    try:
+        return int(getattr(exc, "status_code", 0) or exc.resp.status)
+    except Exception:
+        return 0
+
+
+_RATE_LIMIT_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    """429, or Gmail's 403 rateLimitExceeded / userRateLimitExceeded."""
+    status = http_status(exc)
+    if status == 429:
+        return True
+    if status == 403:
+        content = getattr(exc, "content", b"") or b""
+        return any(reason in content for reason in _RATE_LIMIT_REASONS)
+    return False
+
+
+def retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Seconds to wait from a Retry-After header on an HttpError, if any."""
+    resp = getattr(exc, "resp", None)
+    value = resp.get("retry-after") if hasattr(resp, "get") else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 def is_retryable_googleapi_error(exc: Exception) -> bool:
     # Network/timeouts
-    if isinstance(exc, (socket.timeout, TimeoutError, ConnectionError)):
+    if isinstance(exc, (socket.timeout, TimeoutError, ConnectionError, asyncio.TimeoutError)):
         return True
-    # HTTP 429/5xx from googleapiclient
-    if HttpError is not None and isinstance(exc, HttpError):
-        try:
-            status = int(getattr(exc, "status_code", 0) or exc.resp.status)
-        except Exception:
-            status = 0
-        return status in (429, 500, 502, 503, 504)
-    return False
+    # HTTP 429/5xx from googleapiclient, and Gmail's 403 rate-limit responses
+    return http_status(exc) in (429, 500, 502, 503, 504) or is_rate_limited(exc)
 
@@ -0,0 +1,63 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Tuple
+
+
+class KeyedExecutor:
+    """Thread pool with a global worker cap and a per-key in-flight cap.
+
+    Tasks for a key already at ``per_key_limit`` wait in that key's queue
+    without occupying a worker, so a slow key cannot starve the others.
+    """
+
+    def __init__(self, max_workers: int, per_key_limit: int = 1, thread_name_prefix: str = "keyed"):
+        self.per_key_limit = max(1, per_key_limit)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, int] = {}
+        self._queued: Dict[str, Deque[Tuple[Future, Callable, tuple]]] = {}
+
+    def submit(self, key: str, fn: Callable, *args) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._inflight.get(key, 0) >= self.per_key_limit:
+                self._queued.setdefault(key, deque()).append((future, fn, args))
+                return future
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+        self._dispatch(key, future, fn, args)
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+    def _dispatch(self, key: str, future: Future, fn: Callable, args: tuple) -> None:
+        def _run():
+            if not future.set_running_or_notify_cancel():
+                self._release(key)
+                return
+            try:
+                result = fn(*args)
+            except BaseException as exc:  # noqa: BLE001
+                self._release(key)
+                future.set_exception(exc)
+            else:
+                self._release(key)
+                future.set_result(result)
+
+        self._pool.submit(_run)
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            queue = self._queued.get(key)
+            if queue:
+                nxt = queue.popleft()
+                if not queue:
+                    del self._queued[key]
+            else:
+                nxt = None
+                self._inflight[key] -= 1
+                if not self._inflight[key]:
+                    del self._inflight[key]
+        if nxt is not None:
+            self._dispatch(key, *nxt)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.domain.model import FanoutError, RawMessage, TargetOutcome
+from src.domain.rules import rules_for
+from src.gmail.async_api import (
+    AsyncLabelRegistry,
+    find_message_by_rfc822,
+    get_metadata_many,
+    get_minimal_many,
+    get_raw_messages_many,
+    insert_raw_message,
+    label_messages,
+    label_threads,
+)
+from src.gmail.labels import is_label_not_found
+from src.storage.ledger import AsyncProcessedLedger, Location
+from src.utils import metrics
+from src.worker import sharing
+
+
+class AsyncProcessor:
+    """Processor for the asyncio worker.
+
+    Same filtering, chunking, dedupe and labelling as Processor (both use
+    src.worker.sharing), but every Gmail and KV call is awaited, and target
+    mailboxes run as concurrent tasks (at most fanout_per_target_concurrency
+    at a time per target).
+    """
+
+    def __init__(self, cfg, kv, auth_factory, labels: Optional[AsyncLabelRegistry] = None):
+        self.cfg = cfg
+        self.kv = kv
+        self.auth_factory = auth_factory
+        self.rules = rules_for(cfg)
+        self.labels = labels or AsyncLabelRegistry(kv, auth_factory)
+        self.ledger = AsyncProcessedLedger.for_config(cfg, kv)
+        self._target_slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def process_history_event(
+        self, user_email: str, message_ids: List[str], prefiltered: bool = False
+    ) -> Dict[str, TargetOutcome]:
+        src_gmail = self.auth_factory(user_email)
+
+        if prefiltered:
+            with metrics.timed("processor_stage_seconds", stage="sizes"):
+                minimals = await get_minimal_many(src_gmail, message_ids)
+            candidates = sharing.sized_candidates(self.cfg, message_ids, minimals)
+        else:
+            with metrics.timed("processor_stage_seconds", stage="metadata"):
+                metas = await get_metadata_many(src_gmail, message_ids)
+            candidates = sharing.metadata_candidates(self.rules, self.cfg, message_ids, metas)
+        return await self.share_candidates(user_email, candidates)
+
+    async def share_candidates(self, user_email: str, candidates: List[sharing.Candidate]) -> Dict[str, TargetOutcome]:
+        """Share (msg id, size estimate) candidates, checking each against its raw headers.
+
+        Known sizes let several raws share a fetch up to RAW_BATCH_MAX_BYTES.
+        """
+        src_gmail = self.auth_factory(user_email)
+        outcomes: Dict[str, TargetOutcome] = {}
+        for chunk in sharing.raw_chunks(candidates, self.cfg.raw_batch_max_bytes):
+            with metrics.timed("processor_stage_seconds", stage="raw_fetch"):
+                raws = await get_raw_messages_many(src_gmail, chunk)
+            items = sharing.raw_items(self.rules, self.cfg, chunk, raws)
+            if items:
+                with metrics.timed("processor_stage_seconds", stage="fan_out"):
+                    sharing.merge_outcomes(outcomes, await self._fan_out(user_email, items))
+
+        if any(o.error is not None for o in outcomes.values()):
+            raise FanoutError(outcomes)
+        return outcomes
+
+    async def _fan_out(self, user_email: str, items: List[Tuple[str, RawMessage]]) -> Dict[str, TargetOutcome]:
+        with metrics.timed("processor_stage_seconds", stage="dedupe_lookup"):
+            known = await self.ledger.get_many(rfc822id for rfc822id, _ in items)
+        targets = list(self.cfg.team_users)
+        results = await asyncio.gather(*(self._run_target(t, user_email, items, known) for t in targets))
+        outcomes = dict(zip(targets, results))
+        await self.ledger.record(sharing.handled_locations(outcomes))
+        return outcomes
+
+    async def _run_target(
+        self, target: str, user_email: str, items: List[Tuple[str, RawMessage]], known: Dict[str, Dict[str, Location]]
+    ) -> TargetOutcome:
+        outcome = TargetOutcome(target=target)
+        slots = self._target_slots.setdefault(
+            target.lower(), asyncio.Semaphore(self.cfg.fanout_per_target_concurrency)
+        )
+        try:
+            async with slots:
+                await self._share_to_target(target, user_email, items, known, outcome)
+        except Exception as exc:  # noqa: BLE001
+            logging.exception("Fan-out to %s failed", target)
+            outcome.error = exc
+        return outcome
+
+    async def _share_to_target(
+        self,
+        target: str,
+        user_email: str,
+        items: List[Tuple[str, RawMessage]],
+        known: Dict[str, Dict[str, Location]],
+        outcome: TargetOutcome,
+    ):
+        tgt_gmail = self.auth_factory(target)
+        is_source = target.lower() == user_email.lower()
+        threads: Set[str] = set()
+        messages: Set[str] = set()
+
+        for rfc822id, raw in items:
+            if is_source:
+                location = (raw.id, raw.thread_id)
+            else:
+                location = sharing.ledger_location(known, rfc822id, target, outcome)
+                if location is None:
+                    location = await find_message_by_rfc822(tgt_gmail, rfc822id)
+                    if location == (None, None) and not sharing.previously_handled(known, rfc822id, target):
+                        location = await self._insert(tgt_gmail, target, rfc822id, raw, outcome)
+                    else:
+                        sharing.search_hit(outcome, rfc822id, location)
+            outcome.located[rfc822id] = location
+            sharing.add_location(location, threads, messages)
+
+        if not threads and not messages:
+            return
+        label_id = await self.labels.get(target, self.cfg.label_name)
+        try:
+            with metrics.timed("processor_stage_seconds", stage="label"):
+                await self._apply_label(tgt_gmail, label_id, threads, messages)
+        except Exception as exc:  # noqa: BLE001
+            if not is_label_not_found(exc, label_id):
+                raise
+            await self.labels.invalidate(target, self.cfg.label_name)
+            label_id = await self.labels.get(target, self.cfg.label_name)
+            await self._apply_label(tgt_gmail, label_id, threads, messages)
+        outcome.labelled = len(threads) + len(messages)
+
+    async def _insert(
+        self, tgt_gmail, target: str, rfc822id: str, raw: RawMessage, outcome: TargetOutcome
+    ) -> Location:
+        claimed = await self.ledger.claim(rfc822id, target)
+        if claimed is not None:
+            sharing.search_hit(outcome, rfc822id, claimed)
+            return claimed
+        try:
+            with metrics.timed("processor_stage_seconds", stage="insert"):
+                return sharing.inserted(outcome, rfc822id, await insert_raw_message(tgt_gmail, raw))
+        except BaseException:
+            try:
+                await self.ledger.release(rfc822id, target)
+            except Exception:  # noqa: BLE001
+                logging.warning("Could not release the ledger claim on %s for %s", rfc822id, target, exc_info=True)
+            raise
+
+    async def _apply_label(self, tgt_gmail, label_id: str, threads: Set[str], messages: Set[str]):
+        if threads:
+            await label_threads(tgt_gmail, threads, label_id)
+        if messages:
+            await label_messages(tgt_gmail, messages, label_id)
@@ -0,0 +1,165 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Callable, Iterable, Optional, Set
+
+from src.gmail import async_api
+from src.gmail.async_api import AsyncLabelRegistry
+from src.gmail.history import is_history_out_of_range
+from src.storage.cursors import (
+    advance_history_cursor_async,
+    get_history_cursor_async,
+    record_error_async,
+    record_sync_async,
+)
+from src.utils.circuit import CircuitOpenError
+from src.worker.async_processor import AsyncProcessor
+from src.worker.coalescer import AsyncMailboxCoalescer
+from src.worker.leases import AsyncMailboxLeases
+from src.worker.resync import resync_mailbox_async
+
+
+class AsyncWorker:
+    """Runs mailbox syncs as coroutines on one event loop in a background thread.
+
+    Pub/Sub callbacks only hand work over via submit() and return; the message
+    is acked or nacked when the returned future completes, so the number of
+    mailbox operations in flight is bounded by flow control, not by threads.
+    The KV store and Gmail pool are built on the loop by the given factories.
+    """
+
+    def __init__(self, cfg, kv_factory: Callable, auth_factory_factory: Callable):
+        self.cfg = cfg
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async-worker", daemon=True)
+        self._thread.start()
+        self._pending: Set[concurrent.futures.Future] = set()
+        self._pending_lock = threading.Lock()
+        self._closed = False
+        asyncio.run_coroutine_threadsafe(self._setup(kv_factory, auth_factory_factory), self.loop).result()
+
+    async def _setup(self, kv_factory: Callable, auth_factory_factory: Callable) -> None:
+        self.kv = kv_factory()
+        self.auth_factory = auth_factory_factory()
+        self.labels = AsyncLabelRegistry(self.kv, self.auth_factory)
+        self.processor = AsyncProcessor(self.cfg, self.kv, self.auth_factory, labels=self.labels)
+        self.coalescer = AsyncMailboxCoalescer()
+        self.leases = None
+        if self.cfg.mailbox_lease_seconds > 0:
+            self.leases = AsyncMailboxLeases(self.kv, self.cfg.mailbox_lease_seconds, owner=self.cfg.worker_id or None)
+
+    def submit(self, user_email: str, history_id: int) -> concurrent.futures.Future:
+        """Schedule a sync of user_email up to history_id; safe to call from any thread."""
+        fut = asyncio.run_coroutine_threadsafe(self.handle(user_email, history_id), self.loop)
+        with self._pending_lock:
+            self._pending.add(fut)
+        fut.add_done_callback(self._forget)
+        return fut
+
+    def warm(self, users: Iterable[str], label_name: str) -> None:
+        async def _warm():
+            for user in users:
+                try:
+                    await self.labels.get(user, label_name)
+                except Exception:  # noqa: BLE001
+                    logging.warning("Could not pre-warm label %r for %s", label_name, user, exc_info=True)
+
+        asyncio.run_coroutine_threadsafe(_warm(), self.loop).result()
+
+    async def handle(self, user_email: str, history_id: int) -> None:
+        try:
+            ran = await self.coalescer.run(user_email, history_id, lambda hid: self.sync_owned_mailbox(user_email, hid))
+        except Exception as exc:  # noqa: BLE001
+            if isinstance(exc, CircuitOpenError):
+                logging.warning("Skipping %s for now: %s", user_email, exc)
+            await self._record_error(user_email, exc)
+            raise
+        if not ran:
+            logging.debug("Coalesced notification for %s at historyId %s", user_email, history_id)
+
+    async def _record_error(self, user_email: str, exc: Exception) -> None:
+        try:
+            await record_error_async(self.kv, user_email, exc)
+        except Exception:  # noqa: BLE001
+            logging.warning("Could not record sync error for %s", user_email, exc_info=True)
+
+    async def sync_owned_mailbox(self, user_email: str, history_id: int) -> None:
+        """Same lease handling as src.main.sync_owned_mailbox."""
+        if self.leases is None:
+            await self.sync_mailbox(user_email, history_id)
+            return
+        if not await self.leases.acquire(user_email, history_id):
+            logging.debug("Handed %s at historyId %s to the lease owner", user_email, history_id)
+            return
+        try:
+            next_history_id: Optional[int] = history_id
+            while next_history_id is not None:
+                await self.sync_mailbox(user_email, next_history_id)
+                next_history_id = await self.leases.release(user_email)
+        except BaseException:
+            try:
+                await self.leases.release(user_email, handoff=False, unsynced=next_history_id)
+            except Exception:  # noqa: BLE001
+                logging.warning("Could not release the lease on %s; it will expire", user_email, exc_info=True)
+            raise
+
+    async def sync_mailbox(self, user_email: str, notified_history_id: int) -> None:
+        """Async sync_mailbox: same cursor handling, per-page checkpoints and resync on 404."""
+        kv = self.kv
+        started = time.time()
+        history_id = str(notified_history_id)
+        stored_cursor = await get_history_cursor_async(kv, user_email)
+        if stored_cursor:
+            if notified_history_id <= int(stored_cursor):
+                return
+            history_id = stored_cursor
+        gmail = self.auth_factory(user_email)
+        pages = async_api.iter_history_pages(gmail, history_id).__aiter__()
+        while True:
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception as exc:  # noqa: BLE001
+                if not is_history_out_of_range(exc):
+                    raise
+                await resync_mailbox_async(self, user_email, gmail)
+                break
+            if self.leases is not None:
+                self.leases.check(user_email)
+            await self.processor.process_history_event(user_email, page.message_ids)
+            if page.last_history_id:
+                await advance_history_cursor_async(kv, user_email, page.last_history_id)
+        await record_sync_async(kv, user_email, started)
+
+    def close(self) -> None:
+        """Wait up to drain_timeout_seconds for in-flight syncs, then release clients and stop the loop."""
+        if self._closed:
+            return
+        self._closed = True
+        with self._pending_lock:
+            pending = list(self._pending)
+        _, not_done = concurrent.futures.wait(pending, timeout=self.cfg.drain_timeout_seconds)
+        if not_done:
+            logging.warning("%d mailbox syncs still running at shutdown; they will be redelivered", len(not_done))
+            for fut in not_done:
+                fut.cancel()
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    async def _shutdown(self) -> None:
+        if self.leases is not None:
+            await self.leases.close()
+        for resource in (self.auth_factory, self.kv):
+            close = getattr(resource, "close", None)
+            if close is not None:
+                res = close()
+                if asyncio.iscoroutine(res):
+                    await res
+
+    def _forget(self, fut: concurrent.futures.Future) -> None:
+        with self._pending_lock:
+            self._pending.discard(fut)
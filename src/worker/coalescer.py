@@ -0,0 +1,85 @@
+import threading
+from typing import Awaitable, Callable, Dict
+
+
+class _MailboxState:
+    def __init__(self):
+        self.pending = 0  # highest historyId that arrived while a sync was running
+
+
+class MailboxCoalescer:
+    """Collapse concurrent notifications for one mailbox into a single sync.
+
+    Only one caller syncs a given mailbox at a time. Notifications arriving in
+    the meantime just raise the pending historyId and return immediately; the
+    running caller syncs once more afterwards, covering all of them. If that
+    sync fails, the highest pending historyId is carried into the next run for
+    the mailbox, since the folded notifications were acked and won't come back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, _MailboxState] = {}
+        # mailbox -> highest historyId left unsynced by a failed run
+        self._missed: Dict[str, int] = {}
+
+    def run(self, mailbox: str, history_id: int, sync: Callable[[int], None]) -> bool:
+        """Sync ``mailbox`` up to ``history_id``; return False if folded into an in-progress sync."""
+        key = mailbox.lower()
+        with self._lock:
+            state = self._state.get(key)
+            if state is not None:
+                state.pending = max(state.pending, history_id)
+                return False
+            state = self._state[key] = _MailboxState()
+            history_id = max(history_id, self._missed.pop(key, 0))
+
+        try:
+            while True:
+                sync(history_id)
+                with self._lock:
+                    if not state.pending:
+                        del self._state[key]
+                        return True
+                    history_id, state.pending = state.pending, 0
+        except BaseException:
+            with self._lock:
+                del self._state[key]
+                # The redelivery may be at or below the saved cursor; it must still sync this far.
+                self._missed[key] = max(history_id, state.pending, self._missed.get(key, 0))
+            raise
+
+    def active(self) -> int:
+        with self._lock:
+            return len(self._state)
+
+
+class AsyncMailboxCoalescer:
+    """MailboxCoalescer for coroutines running on one event loop (no locking needed)."""
+
+    def __init__(self):
+        self._state: Dict[str, _MailboxState] = {}
+        self._missed: Dict[str, int] = {}
+
+    async def run(self, mailbox: str, history_id: int, sync: Callable[[int], Awaitable[None]]) -> bool:
+        key = mailbox.lower()
+        state = self._state.get(key)
+        if state is not None:
+            state.pending = max(state.pending, history_id)
+            return False
+        state = self._state[key] = _MailboxState()
+        history_id = max(history_id, self._missed.pop(key, 0))
+        try:
+            while True:
+                await sync(history_id)
+                if not state.pending:
+                    return True
+                history_id, state.pending = state.pending, 0
+        except BaseException:
+            self._missed[key] = max(history_id, state.pending, self._missed.get(key, 0))
+            raise
+        finally:
+            del self._state[key]
+
+    def active(self) -> int:
+        return len(self._state)
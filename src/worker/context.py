@@ -0,0 +1,43 @@
+from src.gmail.labels import LabelRegistry
+from src.utils.threading_utils import KeyedExecutor
+from src.worker.coalescer import MailboxCoalescer
+from src.worker.leases import MailboxLeases
+from src.worker.processor import Processor
+
+
+class WorkerContext:
+    """Process-wide state shared by every Pub/Sub callback.
+
+    Built once at startup so the per-message path only does the work itself.
+    """
+
+    def __init__(self, cfg, kv, auth_factory):
+        self.cfg = cfg
+        self.kv = kv
+        self.auth_factory = auth_factory
+        self.fanout_executor = None
+        if cfg.fanout_mode == "parallel":
+            self.fanout_executor = KeyedExecutor(
+                max_workers=cfg.pull_concurrency,
+                per_key_limit=cfg.fanout_per_target_concurrency,
+                thread_name_prefix="fanout",
+            )
+        self.labels = LabelRegistry(kv, auth_factory)
+        self.processor = Processor(cfg, kv, auth_factory, executor=self.fanout_executor, labels=self.labels)
+        self.coalescer = MailboxCoalescer()
+        self.leases = None
+        if cfg.mailbox_lease_seconds > 0:
+            self.leases = MailboxLeases(kv, cfg.mailbox_lease_seconds, owner=cfg.worker_id or None)
+        self._closed = False
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self.fanout_executor is not None:
+            self.fanout_executor.shutdown(wait=True)
+        if self.leases is not None:
+            self.leases.close()
+        close_kv = getattr(self.kv, "close", None)
+        if close_kv is not None:
+            close_kv()
@@ -0,0 +1,219 @@
+"""Mailbox leases, so several worker replicas can share one subscription.
+
+A replica syncs a mailbox only while it holds ``lease:{user}`` in the KV
+store. A notification that finds the lease held by a live replica records
+its historyId as ``pending`` on the lease and returns; the owner re-syncs
+before giving the lease up, exactly like MailboxCoalescer does in-process.
+Leases expire after ttl_seconds unless heartbeated, so a crashed owner's
+mailboxes are picked up by whoever gets the next (or redelivered) message.
+A lease given up after a failure keeps its pending historyId, and the next
+owner syncs up to it before letting go.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from src.utils import metrics
+
+
+class LeaseLostError(Exception):
+    """Another replica took over the mailbox (our heartbeats stopped for longer than the TTL)."""
+
+
+def lease_key(user_email: str) -> str:
+    return f"lease:{user_email.lower()}"
+
+
+def default_owner_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def _load(current: Optional[str]) -> Dict:
+    return json.loads(current) if current else {}
+
+
+def _acquire_fn(owner: str, ttl: float, history_id: int, got: List[bool]) -> Callable[[Optional[str]], Optional[str]]:
+    def _acquire(current: Optional[str]) -> Optional[str]:
+        got.clear()  # transactions may run this more than once
+        lease = _load(current)
+        now = time.time()
+        if lease.get("owner") in (None, "", owner) or lease.get("expires", 0) <= now:
+            got.append(True)
+            # What a failed or crashed owner left pending was acked elsewhere; release() hands it to us.
+            left = lease.get("pending", 0)
+            return json.dumps({"owner": owner, "expires": now + ttl, "pending": left if left > history_id else 0})
+        if history_id <= lease.get("pending", 0):
+            return None
+        lease["pending"] = history_id
+        return json.dumps(lease)
+
+    return _acquire
+
+
+def _release_fn(
+    owner: str, ttl: float, handoff: bool, unsynced: int, pending: List[int]
+) -> Callable[[Optional[str]], Optional[str]]:
+    def _release(current: Optional[str]) -> Optional[str]:
+        pending.clear()
+        lease = _load(current)
+        if lease.get("owner") != owner:
+            return None
+        if handoff and lease.get("pending"):
+            # Someone was turned away while we synced: keep the lease and go round again.
+            pending.append(lease["pending"])
+            return json.dumps({"owner": owner, "expires": time.time() + ttl, "pending": 0})
+        left = 0 if handoff else max(lease.get("pending", 0), unsynced)
+        return json.dumps({"owner": "", "expires": 0, "pending": left})
+
+    return _release
+
+
+def _renew_fn(owner: str, ttl: float, kept: List[bool]) -> Callable[[Optional[str]], Optional[str]]:
+    def _renew(current: Optional[str]) -> Optional[str]:
+        kept.clear()
+        lease = _load(current)
+        if lease.get("owner") != owner:
+            return None
+        kept.append(True)
+        lease["expires"] = time.time() + ttl
+        return json.dumps(lease)
+
+    return _renew
+
+
+class MailboxLeases:
+    """Leases held by this process, heartbeated every ttl/3 from a background thread."""
+
+    def __init__(self, kv, ttl_seconds: float, owner: Optional[str] = None):
+        self.kv = kv
+        self.ttl = ttl_seconds
+        self.owner = owner or default_owner_id()
+        self._held: Dict[str, bool] = {}  # mailbox -> still ours
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def acquire(self, user_email: str, history_id: int) -> bool:
+        got: List[bool] = []
+        self.kv.update(lease_key(user_email), _acquire_fn(self.owner, self.ttl, history_id, got))
+        if got:
+            with self._lock:
+                self._held[user_email.lower()] = True
+            metrics.inc("mailbox_leases_total", result="acquired")
+        else:
+            metrics.inc("mailbox_leases_total", result="handed_off")
+        return bool(got)
+
+    def release(self, user_email: str, handoff: bool = True, unsynced: int = 0) -> Optional[int]:
+        """Give the lease up, or keep it and return the historyId another replica left pending.
+
+        With handoff=False (after a failure) nothing is returned and the pending
+        historyId, raised to ``unsynced``, stays on the lease for the next owner.
+        """
+        pending: List[int] = []
+        try:
+            self.kv.update(lease_key(user_email), _release_fn(self.owner, self.ttl, handoff, unsynced, pending))
+        finally:
+            if not pending:
+                with self._lock:
+                    self._held.pop(user_email.lower(), None)
+        return pending[0] if pending else None
+
+    def check(self, user_email: str) -> None:
+        with self._lock:
+            ours = self._held.get(user_email.lower(), False)
+        if not ours:
+            raise LeaseLostError(f"lease on {user_email} was taken over")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+        with self._lock:
+            held = list(self._held)
+        for user in held:
+            try:
+                self.release(user, handoff=False)
+            except Exception:  # noqa: BLE001
+                logging.warning("Could not release lease on %s", user, exc_info=True)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            with self._lock:
+                held = [user for user, ours in self._held.items() if ours]
+            for user in held:
+                kept: List[bool] = []
+                try:
+                    self.kv.update(lease_key(user), _renew_fn(self.owner, self.ttl, kept))
+                except Exception:  # noqa: BLE001
+                    # Try again next beat; the TTL leaves room for a couple of misses.
+                    logging.warning("Lease heartbeat for %s failed", user, exc_info=True)
+                    continue
+                if not kept:
+                    logging.warning("Lease on %s was taken over by another replica", user)
+                    metrics.inc("mailbox_leases_total", result="lost")
+                    with self._lock:
+                        if user in self._held:
+                            self._held[user] = False
+
+
+class AsyncMailboxLeases:
+    """MailboxLeases for the asyncio worker: async KV, heartbeat as a task on the worker's loop."""
+
+    def __init__(self, kv, ttl_seconds: float, owner: Optional[str] = None):
+        self.kv = kv
+        self.ttl = ttl_seconds
+        self.owner = owner or default_owner_id()
+        self._held: Dict[str, bool] = {}
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+
+    async def acquire(self, user_email: str, history_id: int) -> bool:
+        got: List[bool] = []
+        await self.kv.update(lease_key(user_email), _acquire_fn(self.owner, self.ttl, history_id, got))
+        if got:
+            self._held[user_email.lower()] = True
+        metrics.inc("mailbox_leases_total", result="acquired" if got else "handed_off")
+        return bool(got)
+
+    async def release(self, user_email: str, handoff: bool = True, unsynced: int = 0) -> Optional[int]:
+        pending: List[int] = []
+        try:
+            await self.kv.update(lease_key(user_email), _release_fn(self.owner, self.ttl, handoff, unsynced, pending))
+        finally:
+            if not pending:
+                self._held.pop(user_email.lower(), None)
+        return pending[0] if pending else None
+
+    def check(self, user_email: str) -> None:
+        if not self._held.get(user_email.lower(), False):
+            raise LeaseLostError(f"lease on {user_email} was taken over")
+
+    async def close(self) -> None:
+        self._task.cancel()
+        for user in list(self._held):
+            try:
+                await self.release(user, handoff=False)
+            except Exception:  # noqa: BLE001
+                logging.warning("Could not release lease on %s", user, exc_info=True)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            for user in [u for u, ours in self._held.items() if ours]:
+                kept: List[bool] = []
+                try:
+                    await self.kv.update(lease_key(user), _renew_fn(self.owner, self.ttl, kept))
+                except Exception:  # noqa: BLE001
+                    logging.warning("Lease heartbeat for %s failed", user, exc_info=True)
+                    continue
+                if not kept:
+                    logging.warning("Lease on %s was taken over by another replica", user)
+                    metrics.inc("mailbox_leases_total", result="lost")
+                    if user in self._held:
+                        self._held[user] = False
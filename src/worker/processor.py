@@ -1,81 +1,174 @@
-from typing import List
+import logging
+from typing import Dict, List, Optional, Set, Tuple
 
-from src.domain.rules import subject_matches
+from src.domain.model import FanoutError, RawMessage, TargetOutcome
+from src.domain.rules import rules_for
 from src.gmail.messages import (
-    get_metadata,
-    get_raw,
-    search_by_message_id,
-    insert_raw,
+    get_metadata_many,
+    get_minimal_many,
+    get_raw_messages_many,
+    insert_raw_message,
     find_message_by_rfc822,
 )
-from src.gmail.labels import ensure_label, label_thread, label_message
+from src.gmail.labels import LabelRegistry, is_label_not_found, label_threads, label_messages
+from src.storage.ledger import Location, ProcessedLedger
+from src.utils import metrics
+from src.utils.threading_utils import KeyedExecutor
+from src.worker import sharing
 
 
 class Processor:
-    def __init__(self, cfg, kv, auth_factory):
+    def __init__(
+        self,
+        cfg,
+        kv,
+        auth_factory,
+        executor: Optional[KeyedExecutor] = None,
+        labels: Optional[LabelRegistry] = None,
+    ):
         self.cfg = cfg
         self.kv = kv
         self.auth_factory = auth_factory
+        self.rules = rules_for(cfg)
+        self.labels = labels or LabelRegistry(kv, auth_factory)
+        self.ledger = ProcessedLedger.for_config(cfg, kv)
+        # When set, each target mailbox is handled as its own task; otherwise targets run in series.
+        self.executor = executor
 
-    def process_history_event(self, user_email: str, message_ids: List[str]):
+    def process_history_event(
+        self, user_email: str, message_ids: List[str], prefiltered: bool = False
+    ) -> Dict[str, TargetOutcome]:
+        """Share the matching messages among message_ids with the rest of the team.
+
+        prefiltered=True means the ids came from a server-side subject search, so
+        nearly all of them match: only their sizes are fetched up front
+        (format=minimal) and the subject check runs on headers parsed from the
+        raw fetch instead.
+        """
         src_gmail = self.auth_factory(user_email)
-        label_id_cache = {}
 
-        for msg_id in message_ids:
-            meta = get_metadata(src_gmail, msg_id)
-            headers = {h["name"]: h["value"] for h in meta.get("payload", {}).get("headers", [])}
-            subject = headers.get("Subject")
-            if not subject_matches(subject):
-                continue
+        if prefiltered:
+            with metrics.timed("processor_stage_seconds", stage="sizes"):
+                minimals = get_minimal_many(src_gmail, message_ids)
+            candidates = sharing.sized_candidates(self.cfg, message_ids, minimals)
+        else:
+            with metrics.timed("processor_stage_seconds", stage="metadata"):
+                metas = get_metadata_many(src_gmail, message_ids)
+            candidates = sharing.metadata_candidates(self.rules, self.cfg, message_ids, metas)
+        return self.share_candidates(user_email, candidates)
 
-            rfc822id = headers.get("Message-Id")
-            if not rfc822id:
-                continue
+    def share_candidates(self, user_email: str, candidates: List[sharing.Candidate]) -> Dict[str, TargetOutcome]:
+        """Share (msg id, size estimate) candidates, checking each against its raw headers.
 
-            raw_bytes = get_raw(src_gmail, msg_id)
+        Known sizes let several raws share a fetch up to RAW_BATCH_MAX_BYTES.
+        """
+        src_gmail = self.auth_factory(user_email)
+        outcomes: Dict[str, TargetOutcome] = {}
+        # Raw bodies are fetched and shared a bounded chunk at a time to keep memory flat.
+        for chunk in sharing.raw_chunks(candidates, self.cfg.raw_batch_max_bytes):
+            with metrics.timed("processor_stage_seconds", stage="raw_fetch"):
+                raws = get_raw_messages_many(src_gmail, chunk, batch_size=len(chunk))
+            items = sharing.raw_items(self.rules, self.cfg, chunk, raws)
+            if items:
+                with metrics.timed("processor_stage_seconds", stage="fan_out"):
+                    sharing.merge_outcomes(outcomes, self._fan_out(user_email, items))
 
-            insert_results = {}
+        if any(o.error is not None for o in outcomes.values()):
+            raise FanoutError(outcomes)
+        return outcomes
 
-            # route to teammates
+    def _fan_out(self, user_email: str, items: List[Tuple[str, RawMessage]]) -> Dict[str, TargetOutcome]:
+        with metrics.timed("processor_stage_seconds", stage="dedupe_lookup"):
+            known = self.ledger.get_many(rfc822id for rfc822id, _ in items)
+        outcomes: Dict[str, TargetOutcome] = {}
+        if self.executor is None:
             for target in self.cfg.team_users:
-                if target.lower() == user_email.lower():
-                    continue
-                tgt_gmail = self.auth_factory(target)
-                processed_key = f"processed:{target}:{rfc822id}"
-                if self.kv.get(processed_key):
-                    continue
-                if search_by_message_id(tgt_gmail, rfc822id):
-                    # mark as processed to avoid repeated work next time
-                    self.kv.set(processed_key, "1")
-                    continue
-                res = insert_raw(tgt_gmail, raw_bytes)
-                insert_results[target] = res
-                # mark processed for this target
-                self.kv.set(processed_key, "1")
-
-            # label all team threads
-            for target in self.cfg.team_users:
-                tgt_gmail = self.auth_factory(target)
-                label_id = label_id_cache.get(target)
-                if not label_id:
-                    label_id = ensure_label(tgt_gmail, self.cfg.label_name)
-                    label_id_cache[target] = label_id
-
-                # Prefer thread-level if we have threadId
-                res = insert_results.get(target)
-                thread_id = res.get("threadId") if isinstance(res, dict) else None
-                if thread_id:
-                    label_thread(tgt_gmail, thread_id, label_id)
-                else:
-                    # If we inserted and got an id back, label that message.
-                    msg_id = res.get("id") if isinstance(res, dict) else None
-                    if msg_id:
-                        label_message(tgt_gmail, msg_id, label_id)
+                outcomes[target] = self._run_target(target, user_email, items, known)
+        else:
+            futures = {
+                target: self.executor.submit(target.lower(), self._run_target, target, user_email, items, known)
+                for target in self.cfg.team_users
+            }
+            for target, fut in futures.items():
+                outcomes[target] = fut.result()
+        # One ledger transaction per chunk, including whatever succeeded before a failure.
+        self.ledger.record(sharing.handled_locations(outcomes))
+        return outcomes
+
+    def _run_target(
+        self, target: str, user_email: str, items: List[Tuple[str, RawMessage]], known: Dict[str, Dict[str, Location]]
+    ) -> TargetOutcome:
+        outcome = TargetOutcome(target=target)
+        try:
+            self._share_to_target(target, user_email, items, known, outcome)
+        except Exception as exc:  # noqa: BLE001
+            logging.exception("Fan-out to %s failed", target)
+            outcome.error = exc
+        return outcome
+
+    def _share_to_target(
+        self,
+        target: str,
+        user_email: str,
+        items: List[Tuple[str, RawMessage]],
+        known: Dict[str, Dict[str, Location]],
+        outcome: TargetOutcome,
+    ):
+        tgt_gmail = self.auth_factory(target)
+        is_source = target.lower() == user_email.lower()
+        threads: Set[str] = set()
+        messages: Set[str] = set()
+
+        for rfc822id, raw in items:
+            if is_source:
+                # The source copy is the one we fetched; no lookup needed.
+                location = (raw.id, raw.thread_id)
+            else:
+                location = sharing.ledger_location(known, rfc822id, target, outcome)
+                if location is None:
+                    # Ledger miss: one rfc822msgid: search both dedupes and finds what to label.
+                    location = find_message_by_rfc822(tgt_gmail, rfc822id)
+                    if location == (None, None) and not sharing.previously_handled(known, rfc822id, target):
+                        location = self._insert(tgt_gmail, target, rfc822id, raw, outcome)
                     else:
-                        # We didn't insert (already present). Find it by rfc822 Message-Id and use thread-level.
-                        found_msg_id, found_thread_id = find_message_by_rfc822(tgt_gmail, rfc822id)
-                        if found_thread_id:
-                            label_thread(tgt_gmail, found_thread_id, label_id)
-                        elif found_msg_id:
-                            label_message(tgt_gmail, found_msg_id, label_id)
+                        sharing.search_hit(outcome, rfc822id, location)
+            outcome.located[rfc822id] = location
+            sharing.add_location(location, threads, messages)
+
+        if not threads and not messages:
+            return
+        label_id = self.labels.get(target, self.cfg.label_name)
+        try:
+            with metrics.timed("processor_stage_seconds", stage="label"):
+                self._apply_label(tgt_gmail, label_id, threads, messages)
+        except Exception as exc:  # noqa: BLE001
+            if not is_label_not_found(exc, label_id):
+                raise
+            # The label was deleted in this mailbox since we cached its id: resolve again once.
+            self.labels.invalidate(target, self.cfg.label_name)
+            label_id = self.labels.get(target, self.cfg.label_name)
+            self._apply_label(tgt_gmail, label_id, threads, messages)
+        outcome.labelled = len(threads) + len(messages)
+
+    def _insert(self, tgt_gmail, target: str, rfc822id: str, raw: RawMessage, outcome: TargetOutcome) -> Location:
+        # Claim the target in the ledger first, so a concurrent sync of the same message can't insert it too.
+        claimed = self.ledger.claim(rfc822id, target)
+        if claimed is not None:
+            sharing.search_hit(outcome, rfc822id, claimed)
+            return claimed
+        try:
+            with metrics.timed("processor_stage_seconds", stage="insert"):
+                return sharing.inserted(outcome, rfc822id, insert_raw_message(tgt_gmail, raw))
+        except BaseException:
+            try:
+                self.ledger.release(rfc822id, target)
+            except Exception:  # noqa: BLE001
+                logging.warning("Could not release the ledger claim on %s for %s", rfc822id, target, exc_info=True)
+            raise
 
+    def _apply_label(self, tgt_gmail, label_id: str, threads: Set[str], messages: Set[str]):
+        # Label modifies for this mailbox go out as one batch.
+        if threads:
+            label_threads(tgt_gmail, threads, label_id)
+        if messages:
+            label_messages(tgt_gmail, messages, label_id)
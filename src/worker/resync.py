@@ -0,0 +1,65 @@
+import logging
+import time
+
+from src.gmail import async_api
+from src.gmail.history import get_profile_history_id
+from src.gmail.messages import iter_search_pages
+from src.storage.cursors import (
+    advance_history_cursor,
+    advance_history_cursor_async,
+    get_last_sync,
+    get_last_sync_async,
+)
+from src.utils import metrics
+
+# Gmail's after: filter works on receive time; leave room for clock skew.
+_AFTER_SLACK_SECONDS = 3600
+
+
+def resync_mailbox(ctx, user_email: str, gmail) -> None:
+    """Recover a mailbox whose history cursor has expired.
+
+    Searches only for matching messages received since the last successful
+    sync (or RESYNC_LOOKBACK_DAYS when there is none) and feeds them through
+    the processor in bounded batches.
+    """
+    cfg = ctx.cfg
+    metrics.inc("history_resyncs_total")
+    # Take the new cursor before searching so changes during the resync are picked up by the next scan.
+    new_cursor = get_profile_history_id(gmail)
+
+    rules = ctx.processor.rules
+    q = _resync_query(cfg, rules, get_last_sync(ctx.kv, user_email))
+    logging.warning("History out of range for %s; resyncing with %s", user_email, q)
+
+    # Without a server-side subject filter the search returns everything, so check metadata first.
+    prefiltered = rules.query is not None
+    for message_ids in iter_search_pages(gmail, q, page_size=cfg.resync_batch_size):
+        ctx.processor.process_history_event(user_email, message_ids, prefiltered=prefiltered)
+
+    if new_cursor:
+        advance_history_cursor(ctx.kv, user_email, new_cursor)
+
+
+async def resync_mailbox_async(ctx, user_email: str, gmail) -> None:
+    """resync_mailbox for the asyncio worker (AsyncGmail client, async KV and processor)."""
+    cfg = ctx.cfg
+    metrics.inc("history_resyncs_total")
+    new_cursor = await async_api.get_profile_history_id(gmail)
+
+    rules = ctx.processor.rules
+    q = _resync_query(cfg, rules, await get_last_sync_async(ctx.kv, user_email))
+    logging.warning("History out of range for %s; resyncing with %s", user_email, q)
+
+    prefiltered = rules.query is not None
+    async for message_ids in async_api.iter_search_pages(gmail, q, page_size=cfg.resync_batch_size):
+        await ctx.processor.process_history_event(user_email, message_ids, prefiltered=prefiltered)
+
+    if new_cursor:
+        await advance_history_cursor_async(ctx.kv, user_email, new_cursor)
+
+
+def _resync_query(cfg, rules, since) -> str:
+    if since is None:
+        since = int(time.time()) - cfg.resync_lookback_days * 86400
+    return rules.search_query(after=max(0, since - _AFTER_SLACK_SECONDS))
@@ -0,0 +1,163 @@
+"""Filtering, chunking and bookkeeping shared by Processor and AsyncProcessor.
+
+Nothing here does I/O; the processors fetch, insert and label, and call
+these to decide what to share and to fold the results together.
+"""
+import logging
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from src.domain.model import RawMessage, TargetOutcome
+from src.storage.ledger import Location
+from src.utils import metrics
+
+# Upper bound on raw fetches per batch; RAW_BATCH_MAX_BYTES usually cuts chunks sooner.
+RAW_BATCH_SIZE = 10
+
+# (source message id, size estimate or None when Gmail left sizeEstimate out)
+Candidate = Tuple[str, Optional[int]]
+
+
+def shareable(rules, cfg, msg_id: str, headers: Dict[str, str], size_estimate: int) -> bool:
+    """Whether a message with these (lower-cased) headers should be shared; counts the reason when not."""
+    if not rules.matches(headers.get("subject")):
+        metrics.inc("messages_skipped_total", reason="subject")
+        return False
+    if not headers.get("message-id"):
+        metrics.inc("messages_skipped_total", reason="no_message_id")
+        return False
+    return _fits(cfg, msg_id, size_estimate)
+
+
+def _fits(cfg, msg_id: str, size_estimate: int) -> bool:
+    if size_estimate > cfg.max_message_bytes:
+        logging.warning("Message %s is %d bytes, over MAX_MESSAGE_BYTES; not sharing", msg_id, size_estimate)
+        metrics.inc("messages_skipped_total", reason="too_large")
+        return False
+    return True
+
+
+def metadata_candidates(rules, cfg, message_ids: List[str], metas: Dict[str, Dict]) -> List[Candidate]:
+    """The shareable messages among message_ids, judged on their format=metadata responses."""
+    candidates = []
+    for msg_id in message_ids:
+        meta = metas.get(msg_id)
+        if meta is None:
+            metrics.inc("messages_skipped_total", reason="deleted")
+            continue
+        headers = {h["name"].lower(): h["value"] for h in meta.get("payload", {}).get("headers", [])}
+        size = int(meta.get("sizeEstimate") or 0)
+        if shareable(rules, cfg, msg_id, headers, size):
+            candidates.append((msg_id, size))
+    return candidates
+
+
+def sized_candidates(cfg, message_ids: List[str], minimals: Dict[str, Dict]) -> List[Candidate]:
+    """The message_ids still present and within MAX_MESSAGE_BYTES, judged on their format=minimal responses.
+
+    Subjects are not known yet; raw_items checks them on the raw headers.
+    """
+    candidates = []
+    for msg_id in dict.fromkeys(message_ids):
+        res = minimals.get(msg_id)
+        if res is None:
+            metrics.inc("messages_skipped_total", reason="deleted")
+            continue
+        size = int(res["sizeEstimate"]) if res.get("sizeEstimate") is not None else None
+        if size is None or _fits(cfg, msg_id, size):
+            candidates.append((msg_id, size))
+    return candidates
+
+
+def raw_chunks(candidates: List[Candidate], max_bytes: int) -> Iterator[List[str]]:
+    """Group candidate ids into raw fetches of at most RAW_BATCH_SIZE messages and about max_bytes.
+
+    A candidate of unknown size is fetched on its own, so no chunk can exceed
+    max_bytes by more than one message.
+    """
+    chunk: List[str] = []
+    chunk_bytes = 0
+    for msg_id, size in candidates:
+        if size is None:
+            if chunk:
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            yield [msg_id]
+            continue
+        if chunk and (len(chunk) >= RAW_BATCH_SIZE or chunk_bytes + size > max_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(msg_id)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+def raw_items(rules, cfg, chunk: List[str], raws: Dict[str, RawMessage]) -> List[Tuple[str, RawMessage]]:
+    """(rfc822 Message-Id, raw) for the fetched messages of chunk that are still shareable."""
+    items = []
+    for msg_id in chunk:
+        raw = raws.get(msg_id)
+        if raw is None:
+            metrics.inc("messages_skipped_total", reason="deleted")
+            continue
+        headers = {k.lower(): v for k, v in raw.headers.items()}
+        if shareable(rules, cfg, msg_id, headers, raw.size_estimate):
+            items.append((headers["message-id"], raw))
+    return items
+
+
+def ledger_location(known: Dict[str, Dict[str, Location]], rfc822id: str, target: str, outcome: TargetOutcome):
+    """The ledger's location for rfc822id in target, when it saves a search; counts the hit.
+
+    None means the target needs an rfc822msgid: search first.
+    """
+    handled = known.get(rfc822id, {}).get(target.lower())
+    if handled is None or handled == (None, None):
+        return None
+    outcome.skipped.append(rfc822id)
+    metrics.inc("dedupe_hits_total", source="index")
+    return handled
+
+
+def previously_handled(known: Dict[str, Dict[str, Location]], rfc822id: str, target: str) -> bool:
+    """Handled before even though the copy was never found: it must not be inserted again."""
+    return target.lower() in known.get(rfc822id, {})
+
+
+def search_hit(outcome: TargetOutcome, rfc822id: str, location: Location) -> None:
+    outcome.skipped.append(rfc822id)
+    metrics.inc("dedupe_hits_total", source="search" if location != (None, None) else "processed")
+
+
+def inserted(outcome: TargetOutcome, rfc822id: str, response: Dict) -> Location:
+    outcome.inserted.append(rfc822id)
+    metrics.inc("messages_inserted_total")
+    return response.get("id"), response.get("threadId")
+
+
+def add_location(location: Location, threads: Set[str], messages: Set[str]) -> None:
+    # Prefer thread-level if we have threadId, else label the message itself.
+    msg_id, thread_id = location
+    if thread_id:
+        threads.add(thread_id)
+    elif msg_id:
+        messages.add(msg_id)
+
+
+def merge_outcomes(into: Dict[str, TargetOutcome], more: Dict[str, TargetOutcome]) -> None:
+    for target, outcome in more.items():
+        merged = into.setdefault(target, TargetOutcome(target=target))
+        merged.inserted.extend(outcome.inserted)
+        merged.skipped.extend(outcome.skipped)
+        merged.labelled += outcome.labelled
+        merged.located.update(outcome.located)
+        merged.error = merged.error or outcome.error
+
+
+def handled_locations(outcomes: Dict[str, TargetOutcome]) -> Dict[str, Dict[str, Location]]:
+    """rfc822 Message-Id -> {target: location} for ProcessedLedger.record."""
+    handled: Dict[str, Dict[str, Location]] = {}
+    for target, outcome in outcomes.items():
+        for rfc822id, location in outcome.located.items():
+            handled.setdefault(rfc822id, {})[target] = location
+    return handled
@@ -0,0 +1,70 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.config import Config
+from src.sim.gmail import FakeGmailBackend
+from src.storage.cursors import advance_history_cursor
+from src.storage.memory_kv import InMemoryKV
+from src.utils import metrics
+from src.utils.circuit import configure_resilience
+from src.utils.ratelimit import configure_limiter
+from src.worker.context import WorkerContext
+
+TEAM = ["alice@example.com", "bob@example.com", "carol@example.com"]
+
+
+def notification(email: str, history_id: int):
+    """A Pub/Sub message as Gmail publishes it to the watch topic."""
+    payload = {"source": "gmail", "emailAddress": email, "historyId": str(history_id)}
+    return SimpleNamespace(data=json.dumps(payload).encode("utf-8"), attributes={"version": "1"})
+
+
+@pytest.fixture(autouse=True)
+def exporter():
+    exporter = metrics.InMemoryExporter()
+    metrics.configure_metrics(exporter)
+    configure_limiter(None)
+    configure_resilience(None)
+    yield exporter
+    metrics.configure_metrics()
+    configure_resilience(None)
+
+
+@pytest.fixture
+def cfg():
+    cfg = Config()
+    cfg.store_backend = "memory"
+    cfg.team_users = list(TEAM)
+    cfg.subject_rules = ""
+    cfg.mailbox_lease_seconds = 0
+    return cfg
+
+
+@pytest.fixture
+def kv():
+    return InMemoryKV()
+
+
+@pytest.fixture
+def backend(cfg, kv):
+    """Simulated mailboxes for the team, watched, with history cursors where notifications start."""
+    backend = FakeGmailBackend(seed=1)
+    backend.notifications = []
+    backend.notify = lambda email, hid: backend.notifications.append(notification(email, hid))
+    for user in cfg.team_users:
+        advance_history_cursor(kv, user, str(backend.watch(user)))
+    return backend
+
+
+@pytest.fixture
+def ctx(cfg, kv, backend):
+    ctx = WorkerContext(cfg, kv, backend)
+    yield ctx
+    ctx.close()
+
+
+def copies(backend: FakeGmailBackend, user: str, rfc822_id: str):
+    box = backend.mailbox(user)
+    return [m for m in box.messages.values() if m.header("Message-Id").strip("<>") == rfc822_id.strip("<>")]
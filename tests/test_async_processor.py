@@ -0,0 +1,99 @@
+import asyncio
+from base64 import urlsafe_b64encode
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from src.gmail.async_api import get_metadata_many
+from src.sim.gmail import http_error
+from src.storage.memory_kv import AsyncKVAdapter
+from src.worker.async_processor import AsyncProcessor
+from tests.conftest import copies
+
+
+class AsyncSimGmail:
+    """The AsyncGmail surface (src.gmail.async_client) over a simulated mailbox."""
+
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    async def history_list(self, **params):
+        return self.gmail.users().history().list(userId="me", **params).execute()
+
+    async def messages_get(self, msg_id, **params):
+        return self.gmail.users().messages().get(userId="me", id=msg_id, **params).execute()
+
+    async def messages_list(self, **params):
+        return self.gmail.users().messages().list(userId="me", **params).execute()
+
+    async def messages_insert(self, body):
+        return self.gmail.users().messages().insert(userId="me", body=body).execute()
+
+    async def messages_insert_media(self, rfc822):
+        return await self.messages_insert({"raw": urlsafe_b64encode(rfc822).decode("ascii")})
+
+    async def messages_batch_modify(self, body):
+        return self.gmail.users().messages().batchModify(userId="me", body=body).execute()
+
+    async def threads_modify(self, thread_id, body):
+        return self.gmail.users().threads().modify(userId="me", id=thread_id, body=body).execute()
+
+    async def labels_list(self):
+        return self.gmail.users().labels().list(userId="me").execute()
+
+    async def labels_create(self, body):
+        return self.gmail.users().labels().create(userId="me", body=body).execute()
+
+
+def test_async_processor_shares_like_the_sync_one(cfg, kv, backend):
+    processor = AsyncProcessor(cfg, AsyncKVAdapter(kv), lambda user: AsyncSimGmail(backend(user)))
+    drill = backend.deliver("alice@example.com", "Training Exercise", rfc822_id="<async-1@x>")
+    other = backend.deliver("alice@example.com", "Lunch?")
+
+    outcomes = asyncio.run(processor.process_history_event("alice@example.com", [drill, other]))
+    assert sorted(t for t, o in outcomes.items() if o.inserted) == ["bob@example.com", "carol@example.com"]
+    for user in cfg.team_users:
+        [copy] = copies(backend, user, "<async-1@x>")
+        assert backend.mailbox(user).label_id(cfg.label_name) in copy.label_ids
+
+    again = asyncio.run(processor.process_history_event("alice@example.com", [drill]))
+    assert not any(o.inserted for o in again.values())
+
+
+class SlowInsertGmail(AsyncSimGmail):
+    async def messages_insert(self, body):
+        await asyncio.sleep(0.01)  # lets the other sync search while this insert is in flight
+        return await super().messages_insert(body)
+
+
+def test_async_concurrent_fan_outs_insert_once(cfg, kv, backend):
+    processor = AsyncProcessor(cfg, AsyncKVAdapter(kv), lambda user: SlowInsertGmail(backend(user)))
+    sources = {user: backend.deliver(user, "Training Exercise", rfc822_id="<async-2@x>") for user in cfg.team_users[:2]}
+
+    async def main():
+        await asyncio.gather(*(processor.process_history_event(u, [m]) for u, m in sources.items()))
+
+    asyncio.run(main())
+    assert len(copies(backend, "carol@example.com", "<async-2@x>")) == 1
+
+
+def test_failed_fetch_cancels_the_others():
+    cancelled = []
+
+    class Gmail:
+        async def messages_get(self, msg_id, **params):
+            if msg_id == "bad":
+                raise http_error(400, "Invalid id", reason="invalidArgument")
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(msg_id)
+                raise
+
+    async def main():
+        with pytest.raises(HttpError):
+            await asyncio.wait_for(get_metadata_many(Gmail(), ["a", "b", "bad"]), 1)
+        # Gone by the time the error reaches the caller, not left running until the loop closes.
+        assert sorted(cancelled) == ["a", "b"]
+
+    asyncio.run(main())
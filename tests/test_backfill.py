@@ -0,0 +1,36 @@
+from src.gmail.backfill import Backfill
+from tests.conftest import copies
+
+
+def _backfill(cfg, kv, backend, ctx, **kwargs):
+    return Backfill(cfg, kv, backend, ctx.processor, max_messages_per_sec=0, **kwargs).run()
+
+
+def test_backfill_fills_gaps_and_labels(cfg, kv, backend, ctx):
+    backend.deliver("bob@example.com", "Training Exercise", rfc822_id="<only-bob@x>")
+    for user in cfg.team_users:
+        backend.deliver(user, "Training Exercise", rfc822_id="<everyone@x>")
+    backend.deliver("alice@example.com", "Lunch?", rfc822_id="<lunch@x>")
+
+    dry = _backfill(cfg, kv, backend, ctx, dry_run=True)
+    assert dry.unique == 2
+    assert dry.missing == {"alice@example.com": 1, "carol@example.com": 1}
+    assert dry.unlabelled == {user: 1 for user in cfg.team_users}
+
+    report = _backfill(cfg, kv, backend, ctx)
+    assert report.inserted == 2 and not report.failed
+    for user in cfg.team_users:
+        label = backend.mailbox(user).label_id(cfg.label_name)
+        for rid in ("<only-bob@x>", "<everyone@x>"):
+            [copy] = copies(backend, user, rid)
+            assert label in copy.label_ids
+    assert copies(backend, "bob@example.com", "<lunch@x>") == []
+
+
+def test_backfill_shares_with_scanned_sizes(cfg, kv, backend, ctx):
+    for _ in range(3):
+        backend.deliver("alice@example.com", "Training Exercise")
+    backend.reset_counters()
+    _backfill(cfg, kv, backend, ctx, run_id="sizes")
+    # The scan's metadata fetch is the only one; the share step goes straight to raw.
+    assert backend.calls["messages.get"] == 3 + 3
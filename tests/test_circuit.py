@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+from googleapiclient.errors import HttpError
+
+from src.gmail import batch
+from src.gmail.messages import get_metadata_many
+from src.sim.gmail import FakeGmailBackend, http_error
+from src.utils.circuit import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    Resilience,
+    RetryBudget,
+    configure_resilience,
+    get_resilience,
+)
+from src.utils.retry import exponential_backoff_retry, is_retryable_googleapi_error
+
+
+def test_breaker_state_machine(exporter):
+    breaker = CircuitBreaker("gmail:a@x", failure_threshold=2, reset_seconds=0.05)
+    breaker.before_call()
+    breaker.on_failure()
+    assert breaker.state == CLOSED
+    breaker.on_failure()
+    assert breaker.state == OPEN
+    assert exporter.counter("circuit_opened_total", dependency="gmail") == 1
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()  # the half-open trial
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # only one trial at a time
+    breaker.on_failure()
+    assert breaker.state == OPEN and breaker.trips == 2
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.on_success()
+    assert (breaker.state, breaker.failures, breaker.trips) == (CLOSED, 0, 2)
+
+
+def test_breaker_state_is_exported_as_a_gauge(exporter):
+    breaker = CircuitBreaker("gmail:a@x", failure_threshold=1, reset_seconds=0.01)
+    assert exporter.gauge("circuit_state", dependency="gmail", mailbox="a@x") == 0
+    breaker.on_failure()
+    assert exporter.gauge("circuit_state", dependency="gmail", mailbox="a@x") == 2
+    time.sleep(0.02)
+    breaker.before_call()
+    assert exporter.gauge("circuit_state", dependency="gmail", mailbox="a@x") == 1
+    CircuitBreaker("firestore")
+    assert exporter.gauge("circuit_state", dependency="firestore") == 0
+
+
+@pytest.mark.parametrize(
+    "error, trips",
+    [
+        (http_error(503, "Backend Error"), True),
+        (http_error(429, "Too Many Requests", reason="rateLimitExceeded"), False),
+        (http_error(403, "User-rate limit exceeded", reason="userRateLimitExceeded"), False),
+    ],
+)
+def test_throttling_does_not_count_as_failure(error, trips):
+    breaker = CircuitBreaker("gmail", failure_threshold=2)
+
+    def call():
+        raise error
+
+    with pytest.raises(type(error)):
+        exponential_backoff_retry(
+            call, is_retryable=is_retryable_googleapi_error, base_seconds=0, max_retries=1, breakers=[breaker]
+        )
+    assert (breaker.state == OPEN) is trips
+
+
+@pytest.mark.parametrize("status", [429, 403])
+def test_throttled_batch_parts_leave_breakers_closed(monkeypatch, status):
+    monkeypatch.setattr(batch, "backoff_seconds", lambda attempt: 0)
+    backend = FakeGmailBackend(error_rates={status: 1.0})
+    ids = [backend.deliver("a@x", f"m{i}") for i in range(3)]
+    configure_resilience(Resilience(failure_threshold=2, dependency_failure_threshold=2))
+
+    with pytest.raises(HttpError) as err:
+        get_metadata_many(backend("a@x"), ids)
+    assert not isinstance(err.value, CircuitOpenError)
+    assert backend.calls["messages.get"] > 2
+    assert get_resilience().breaker("gmail:a@x").state == CLOSED
+    assert get_resilience().breaker("gmail").state == CLOSED
+
+
+def test_success_resets_consecutive_failures():
+    breaker = CircuitBreaker("firestore", failure_threshold=2)
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+    assert breaker.state == CLOSED
+
+
+def test_retry_budget_caps_retries_at_ratio_of_calls(exporter):
+    budget = RetryBudget(ratio=0.5, window_seconds=10, min_retries=1, name="gmail")
+    for _ in range(4):
+        budget.record_call()
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+    assert exporter.counter("retry_budget_exhausted_total", dependency="gmail") == 1
+
+
+def test_retry_budget_window_slides():
+    budget = RetryBudget(ratio=0.0, window_seconds=0.05, min_retries=1)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    time.sleep(0.06)
+    assert budget.try_spend()
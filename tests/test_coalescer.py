@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.worker.coalescer import AsyncMailboxCoalescer, MailboxCoalescer
+
+
+def test_concurrent_notifications_fold_into_one_more_sync():
+    coalescer = MailboxCoalescer()
+    started, release = threading.Event(), threading.Event()
+    synced = []
+
+    def sync(hid):
+        synced.append(hid)
+        if len(synced) == 1:
+            started.set()
+            release.wait(5)
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(coalescer.run("A@x", 10, sync)))
+    first.start()
+    assert started.wait(5)
+    assert coalescer.run("a@x", 12, sync) is False
+    assert coalescer.run("a@x", 11, sync) is False
+    release.set()
+    first.join(5)
+    assert results == [True]
+    assert synced == [10, 12]
+    assert coalescer.active() == 0
+
+
+def test_failed_sync_clears_state():
+    coalescer = MailboxCoalescer()
+
+    def fail(hid):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        coalescer.run("a@x", 1, fail)
+    assert coalescer.active() == 0
+    assert coalescer.run("a@x", 2, lambda hid: None) is True
+
+
+def test_failure_keeps_coalesced_history_id_for_the_redelivery():
+    coalescer = MailboxCoalescer()
+    started, release = threading.Event(), threading.Event()
+    synced = []
+
+    def fail(hid):
+        synced.append(hid)
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    first = threading.Thread(target=lambda: pytest.raises(RuntimeError, coalescer.run, "a@x", 10, fail))
+    first.start()
+    assert started.wait(5)
+    assert coalescer.run("a@x", 15, fail) is False  # acked; only the failing caller is redelivered
+    release.set()
+    first.join(5)
+
+    # The redelivered notification still carries 10, but the sync must cover 15.
+    assert coalescer.run("a@x", 10, synced.append) is True
+    assert synced == [10, 15]
+    assert coalescer.run("a@x", 16, synced.append) is True
+    assert synced == [10, 15, 16]
+
+
+def test_async_coalescer():
+    async def main():
+        coalescer = AsyncMailboxCoalescer()
+        gate = asyncio.Event()
+        synced = []
+
+        async def sync(hid):
+            synced.append(hid)
+            if len(synced) == 1:
+                await gate.wait()
+
+        task = asyncio.ensure_future(coalescer.run("a@x", 1, sync))
+        await asyncio.sleep(0)
+        assert await coalescer.run("a@x", 5, sync) is False
+        gate.set()
+        assert await task is True
+        return synced, coalescer.active()
+
+    assert asyncio.run(main()) == ([1, 5], 0)
+
+
+def test_async_failure_keeps_coalesced_history_id():
+    async def main():
+        coalescer = AsyncMailboxCoalescer()
+        gate = asyncio.Event()
+        synced = []
+
+        async def fail(hid):
+            await gate.wait()
+            raise RuntimeError("boom")
+
+        async def sync(hid):
+            synced.append(hid)
+
+        task = asyncio.ensure_future(coalescer.run("a@x", 1, fail))
+        await asyncio.sleep(0)
+        assert await coalescer.run("a@x", 5, fail) is False
+        gate.set()
+        with pytest.raises(RuntimeError):
+            await task
+        assert await coalescer.run("a@x", 1, sync) is True
+        return synced
+
+    assert asyncio.run(main()) == [5]
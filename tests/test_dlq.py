@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from src.gcp import dlq
+from src.gcp.dlq import DeadLetterReplayer, ReplayFilter
+
+
+def _received(ack_id, message_id, email, history_id):
+    data = json.dumps({"emailAddress": email, "historyId": history_id}).encode("utf-8")
+    message = SimpleNamespace(message_id=message_id, data=data, attributes={}, publish_time=None)
+    return SimpleNamespace(ack_id=ack_id, message=message)
+
+
+class FakeSubscriber:
+    """Hands out scripted pulls and records what the replayer does with the ack ids."""
+
+    def __init__(self, pulls):
+        self.pulls = list(pulls)
+        self.acked = []
+        self.deadlines = []  # (ack ids, seconds) per modifyAckDeadline call
+        self.lock = threading.Lock()
+
+    def subscription_path(self, project, subscription):
+        return f"projects/{project}/subscriptions/{subscription}"
+
+    def pull(self, request, timeout=None):
+        return SimpleNamespace(received_messages=self.pulls.pop(0) if self.pulls else [])
+
+    def acknowledge(self, request):
+        self.acked.extend(request["ack_ids"])
+
+    def modify_ack_deadline(self, request):
+        with self.lock:
+            self.deadlines.append((list(request["ack_ids"]), request["ack_deadline_seconds"]))
+
+    def close(self):
+        pass
+
+
+def _replayer(client, handler, **kwargs):
+    kwargs.setdefault("replays_per_sec", 0)
+    return DeadLetterReplayer("p", "dlq", handler, client=client, **kwargs)
+
+
+def test_redelivery_does_not_end_the_run():
+    client = FakeSubscriber([
+        [_received("a1", "m1", "a@x", 5), _received("a2", "m2", "a@x", 7)],
+        [_received("a1-again", "m1", "a@x", 5)],
+        [_received("b1", "m3", "b@x", 3)],
+    ])
+    replayed = []
+    report = _replayer(client, lambda m: replayed.append(json.loads(m.data)["historyId"])).run()
+    assert replayed == [7, 3]
+    assert sorted(client.acked) == ["a1", "a1-again", "a2", "b1"]
+    assert report.pulled == 3 and report.acked == 4
+
+
+def test_held_ack_ids_are_extended_until_released(monkeypatch):
+    monkeypatch.setattr(dlq, "HOLD_DEADLINE_SECONDS", 0.06)
+    client = FakeSubscriber([[_received("ok", "m1", "a@x", 1), _received("bad", "m2", "b@x", 1)]])
+
+    def handler(message):
+        time.sleep(0.1)  # a replay outlasting the deadline
+        if json.loads(message.data)["emailAddress"] == "b@x":
+            raise RuntimeError("still failing")
+
+    report = _replayer(client, handler, concurrency=1).run()
+    assert client.acked == ["ok"]
+    assert report.failed and "b@x" in report.failed
+    extensions = [ids for ids, seconds in client.deadlines if seconds == 0.06]
+    assert len(extensions) >= 2 and all("bad" in ids for ids in extensions)
+    assert client.deadlines[-1] == (["bad"], 0)
+
+
+def test_last_error_is_looked_up_once_per_mailbox():
+    client = FakeSubscriber([[_received(f"a{i}", f"m{i}", "A@x" if i % 2 else "a@x", i) for i in range(6)]])
+    lookups = []
+
+    def last_error_of(email):
+        lookups.append(email)
+        return "HttpError403"
+
+    report = _replayer(
+        client, lambda m: None, last_error_of=last_error_of, replay_filter=ReplayFilter(error_class="HttpError500")
+    ).run()
+    assert len(lookups) == 1
+    assert report.filtered_out == 6
+    assert client.deadlines[-1][1] == 0 and len(client.deadlines[-1][0]) == 6
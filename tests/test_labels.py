@@ -0,0 +1,35 @@
+import pytest
+
+from src.gmail.labels import is_label_not_found
+from src.sim.gmail import http_error
+from tests.conftest import copies
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (http_error(400, "Invalid label: Label_7", reason="invalidArgument"), True),
+        (http_error(400, "Invalid label: Label_8", reason="invalidArgument"), False),
+        (http_error(400, "Invalid label name", reason="invalidArgument"), False),
+        (http_error(404, "Requested entity was not found.", reason="notFound"), False),
+        (http_error(403, "Label quota exceeded", reason="forbidden"), False),
+        (ValueError("Invalid label: Label_7"), False),
+    ],
+)
+def test_label_not_found_matches_only_the_stale_label(error, expected):
+    assert is_label_not_found(error, "Label_7") is expected
+
+
+def test_deleted_label_is_recreated_and_applied(cfg, ctx, backend):
+    ctx.labels.warm(cfg.team_users, cfg.label_name)
+    bob = backend.mailbox("bob@example.com")
+    stale = bob.label_id(cfg.label_name)
+    del bob.labels[stale]
+    backend.reset_counters()
+
+    msg_id = backend.deliver("alice@example.com", "Training Exercise", rfc822_id="<relabel@x>")
+    ctx.processor.process_history_event("alice@example.com", [msg_id])
+    assert backend.calls["labels.create"] == 1
+    fresh = bob.label_id(cfg.label_name)
+    [copy] = copies(backend, "bob@example.com", "<relabel@x>")
+    assert fresh in copy.label_ids
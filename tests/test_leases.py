@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from src.worker.leases import LeaseLostError, MailboxLeases, lease_key
+
+
+@pytest.fixture
+def replicas(kv):
+    a = MailboxLeases(kv, ttl_seconds=30, owner="a")
+    b = MailboxLeases(kv, ttl_seconds=30, owner="b")
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_handoff_to_the_lease_owner(kv, replicas, exporter):
+    a, b = replicas
+    assert a.acquire("U@x", 10)
+    assert not b.acquire("u@x", 12)
+    assert not b.acquire("u@x", 11)
+    assert exporter.counter("mailbox_leases_total", result="handed_off") == 2
+    # The owner is told to sync again up to what was left pending, keeping the lease.
+    assert a.release("u@x") == 12
+    a.check("u@x")
+    assert a.release("u@x") is None
+    with pytest.raises(LeaseLostError):
+        a.check("u@x")
+    assert b.acquire("u@x", 13)
+
+
+def test_expired_lease_is_taken_over(kv, replicas):
+    a, b = replicas
+    kv.set(lease_key("u@x"), json.dumps({"owner": "dead", "expires": 0, "pending": 7}))
+    assert a.acquire("u@x", 8)
+    assert json.loads(kv.get(lease_key("u@x")))["owner"] == "a"
+
+
+def test_failed_sync_leaves_pending_for_the_next_owner(replicas):
+    a, b = replicas
+    a.acquire("u@x", 1)
+    assert not b.acquire("u@x", 5)  # acked by b; only a's notification is redelivered
+    assert a.release("u@x", handoff=False, unsynced=1) is None
+    # The redelivery is older than what b left pending, so the new owner goes on to 5.
+    assert b.acquire("u@x", 1)
+    assert b.release("u@x") == 5
+    assert b.release("u@x") is None
+
+
+def test_pending_already_covered_is_dropped_on_acquire(kv, replicas):
+    a, b = replicas
+    a.acquire("u@x", 1)
+    a.release("u@x", handoff=False, unsynced=4)
+    assert b.acquire("u@x", 9)
+    assert b.release("u@x") is None
@@ -0,0 +1,69 @@
+import json
+import time
+
+from src.storage.ledger import MEMBERS_KEY, ProcessedLedger, ledger_key
+from tests.conftest import TEAM
+
+
+def test_records_merge_per_target(kv):
+    ledger = ProcessedLedger(kv, TEAM)
+    ledger.record({"<m1>": {"alice@example.com": ("a1", "t1")}})
+    ledger.record({"<m1>": {"Bob@example.com": ("b1", "t2"), "carol@example.com": (None, None)}})
+    assert ledger.get_many(["<m1>", "<m2>"]) == {
+        "<m1>": {"alice@example.com": ("a1", "t1"), "bob@example.com": ("b1", "t2"), "carol@example.com": (None, None)}
+    }
+
+
+def test_location_is_not_forgotten(kv):
+    ledger = ProcessedLedger(kv, TEAM)
+    ledger.record({"<m>": {"alice@example.com": ("a1", "t1")}})
+    ledger.record({"<m>": {"alice@example.com": (None, None)}})
+    assert ledger.get_many(["<m>"])["<m>"]["alice@example.com"] == ("a1", "t1")
+
+
+def test_records_expire(kv):
+    ledger = ProcessedLedger(kv, TEAM, ttl_seconds=0.05)
+    ledger.record({"<m>": {"alice@example.com": ("a1", "t1")}})
+    assert ledger.get_many(["<m>"])
+    time.sleep(0.06)
+    assert ledger.get_many(["<m>"]) == {}
+
+
+def test_claim_is_granted_once_and_released_on_failure(kv):
+    first, second = ProcessedLedger(kv, TEAM), ProcessedLedger(kv, TEAM)
+    assert first.claim("<m>", "carol@example.com") is None
+    assert second.claim("<m>", "Carol@example.com") == (None, None)
+    first.release("<m>", "carol@example.com")
+    assert second.claim("<m>", "carol@example.com") is None
+    second.record({"<m>": {"carol@example.com": ("c1", "t1")}})
+    second.release("<m>", "carol@example.com")  # a recorded location is kept
+    assert first.claim("<m>", "carol@example.com") == ("c1", "t1")
+
+
+def test_write_without_ttl_clears_the_expiry(kv):
+    kv.update_many({"a": lambda cur: "1", "b": lambda cur: "1", "c": lambda cur: "1"}, ttl_seconds=0.05)
+    kv.set("a", "2")
+    kv.update("b", lambda cur: "2")
+    kv.update_many({"c": lambda cur: "2"})
+    time.sleep(0.06)
+    assert kv.get_many(["a", "b", "c"]) == {"a": "2", "b": "2", "c": "2"}
+
+
+def test_team_changes_keep_existing_bits(kv):
+    ProcessedLedger(kv, TEAM).record({"<m>": {"alice@example.com": ("a1", "t1"), "carol@example.com": ("c1", "t3")}})
+
+    grown = ProcessedLedger(kv, ["dave@example.com"] + TEAM)
+    assert grown.get_many(["<m>"])["<m>"] == {"alice@example.com": ("a1", "t1"), "carol@example.com": ("c1", "t3")}
+    grown.record({"<m>": {"dave@example.com": ("d1", "t4")}})
+
+    shrunk = ProcessedLedger(kv, ["carol@example.com", "dave@example.com"])
+    assert shrunk.get_many(["<m>"])["<m>"] == {"carol@example.com": ("c1", "t3"), "dave@example.com": ("d1", "t4")}
+    assert json.loads(kv.get(MEMBERS_KEY)) == TEAM + ["dave@example.com"]
+
+
+def test_records_from_the_fingerprint_format_are_ignored(kv):
+    kv.set(ledger_key("<old>"), json.dumps({"team": "9c1e04a7", "done": 1, "loc": [["a1", "t1"]]}))
+    ledger = ProcessedLedger(kv, TEAM)
+    assert ledger.get_many(["<old>"]) == {}
+    ledger.record({"<old>": {"bob@example.com": ("b1", "t2")}})
+    assert ledger.get_many(["<old>"]) == {"<old>": {"bob@example.com": ("b1", "t2")}}
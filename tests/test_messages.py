@@ -0,0 +1,45 @@
+from base64 import urlsafe_b64encode
+
+from src.domain.model import RawMessage
+from src.gmail import messages
+from src.gmail.messages import decode_raw, insert_raw_message, parse_raw_headers
+from src.sim.gmail import FakeGmailBackend
+
+
+def _b64(raw: bytes) -> str:
+    return urlsafe_b64encode(raw).decode("ascii")
+
+
+def test_parses_and_unfolds_headers():
+    raw = b"Subject: Week 1\r\n Training Exercise\r\nMessage-Id: <a@b>\r\n\r\nbody\r\n"
+    headers = parse_raw_headers(_b64(raw))
+    assert headers["Subject"] == "Week 1 Training Exercise"
+    assert headers["Message-Id"] == "<a@b>"
+
+
+def test_bare_newlines_and_body_never_parsed():
+    raw = b"Subject: hi\nMessage-Id: <x@y>\n\nNot-A-Header: no\n" + b"x" * 200000
+    headers = parse_raw_headers(_b64(raw))
+    assert headers == {"Subject": "hi", "Message-Id": "<x@y>"}
+
+
+def test_decodes_rfc2047_encoded_words():
+    raw = (
+        b"Subject: =?UTF-8?B?w4lxdWlwZSBUcmFpbmluZyBFeGVyY2lzZQ==?=\r\n"
+        b"From: =?utf-8?q?Ren=C3=A9e?= <r@x>\r\n"
+        b"X-Odd: =?no-such-charset?Q?a?=\r\n\r\n"
+    )
+    headers = parse_raw_headers(_b64(raw))
+    assert headers["Subject"] == "Équipe Training Exercise"
+    assert headers["From"] == "Renée <r@x>"
+    assert headers["X-Odd"] == "=?no-such-charset?Q?a?="
+
+
+def test_large_insert_decodes_unpadded_raw(monkeypatch):
+    rfc822 = b"Subject: Training Exercise\r\nMessage-Id: <pad@x>\r\n\r\nbody!\r\n"
+    raw = _b64(rfc822).rstrip("=")
+    assert raw != _b64(rfc822) and decode_raw(raw) == rfc822
+    monkeypatch.setattr(messages, "SIMPLE_INSERT_MAX_CHARS", 0)  # take the media upload path
+    backend = FakeGmailBackend()
+    res = insert_raw_message(backend("a@x"), RawMessage(id="m", raw=raw))
+    assert backend.mailbox("a@x").messages[res["id"]].raw == rfc822
@@ -0,0 +1,42 @@
+from src.utils import metrics
+
+
+def test_prometheus_render_format():
+    exporter = metrics.PrometheusExporter(buckets=(0.1, 1.0))
+    metrics.configure_metrics(exporter)
+    metrics.inc("messages_inserted_total")
+    metrics.inc("messages_skipped_total", reason='sub"ject')
+    metrics.set_gauge("circuit_state", 2, dependency="gmail")
+    metrics.observe("gmail_call_seconds", 0.05, method="messages.get")
+    metrics.observe("gmail_call_seconds", 0.5, method="messages.get")
+    assert exporter.render().splitlines() == [
+        "# TYPE messages_inserted_total counter",
+        "messages_inserted_total 1",
+        "# TYPE messages_skipped_total counter",
+        'messages_skipped_total{reason="sub\\"ject"} 1',
+        "# TYPE circuit_state gauge",
+        'circuit_state{dependency="gmail"} 2',
+        "# TYPE gmail_call_seconds histogram",
+        'gmail_call_seconds_bucket{method="messages.get",le="0.1"} 1',
+        'gmail_call_seconds_bucket{method="messages.get",le="1"} 2',
+        'gmail_call_seconds_bucket{method="messages.get",le="+Inf"} 2',
+        'gmail_call_seconds_sum{method="messages.get"} 0.55',
+        'gmail_call_seconds_count{method="messages.get"} 2',
+    ]
+
+
+def test_timed_observes_on_error(exporter):
+    try:
+        with metrics.timed("stage_seconds", stage="x"):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert exporter.histogram("stage_seconds", stage="x")[0] == 1
+
+
+def test_nothing_recorded_without_exporters():
+    metrics.configure_metrics()
+    metrics.inc("x")
+    with metrics.timed("y"):
+        pass
+    assert metrics.get_exporters() == []
@@ -0,0 +1,100 @@
+import threading
+
+from src.main import handle_pubsub_message
+from tests.conftest import TEAM, copies
+
+
+def _drain(backend, ctx):
+    while backend.notifications:
+        handle_pubsub_message(backend.notifications.pop(0), ctx)
+
+
+def test_matching_message_reaches_every_mailbox_once_labelled(cfg, ctx, backend, exporter):
+    backend.deliver("alice@example.com", "Week 2 Training Exercise", rfc822_id="<drill-1@x>")
+    backend.deliver("alice@example.com", "Lunch?", rfc822_id="<lunch@x>")
+    _drain(backend, ctx)
+
+    for user in cfg.team_users:
+        found = copies(backend, user, "<drill-1@x>")
+        assert len(found) == 1
+        box = backend.mailbox(user)
+        assert box.label_id(cfg.label_name) in found[0].label_ids
+        if user != "alice@example.com":
+            assert copies(backend, user, "<lunch@x>") == []
+    assert exporter.counter("messages_inserted_total") == 2
+
+
+def test_redelivery_does_not_duplicate(cfg, ctx, backend, kv):
+    backend.deliver("alice@example.com", "Training Exercise", rfc822_id="<drill-2@x>")
+    first = list(backend.notifications)
+    _drain(backend, ctx)
+    # Same notification again, after the cursor moved on and with the cursor reset.
+    for message in first:
+        handle_pubsub_message(message, ctx)
+    outcomes = ctx.processor.process_history_event(
+        "alice@example.com", [m.id for m in copies(backend, "alice@example.com", "<drill-2@x>")]
+    )
+    assert all(not o.inserted for o in outcomes.values())
+    for user in cfg.team_users:
+        assert len(copies(backend, user, "<drill-2@x>")) == 1
+
+
+def test_copy_shared_back_from_teammate_is_not_reinserted(cfg, ctx, backend):
+    backend.deliver("alice@example.com", "Training Exercise", rfc822_id="<drill-3@x>")
+    _drain(backend, ctx)
+    # Bob's inserted copy shows up in his history too; sharing it again must be a no-op.
+    bob_copy = copies(backend, "bob@example.com", "<drill-3@x>")[0]
+    outcomes = ctx.processor.process_history_event("bob@example.com", [bob_copy.id])
+    assert sum(len(o.inserted) for o in outcomes.values()) == 0
+
+
+def test_concurrent_fan_outs_insert_once(cfg, ctx, backend):
+    # The same message reached alice and bob directly; both syncs fan it out to carol at once.
+    sources = {user: backend.deliver(user, "Training Exercise", rfc822_id="<drill-4@x>") for user in TEAM[:2]}
+    backend.latency_seconds = 0.02
+    threads = [
+        threading.Thread(target=ctx.processor.process_history_event, args=(user, [msg_id]))
+        for user, msg_id in sources.items()
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    backend.latency_seconds = 0
+    assert len(copies(backend, "carol@example.com", "<drill-4@x>")) == 1
+
+
+ENCODED = "=?UTF-8?B?w4lxdWlwZSBUcmFpbmluZyBFeGVyY2lzZQ==?="  # "Équipe Training Exercise"
+
+
+def test_encoded_subject_is_shared(cfg, ctx, backend):
+    backend.deliver("alice@example.com", ENCODED, rfc822_id="<utf8-1@x>")
+    _drain(backend, ctx)
+    for user in cfg.team_users:
+        assert len(copies(backend, user, "<utf8-1@x>")) == 1
+
+
+def test_encoded_subject_is_shared_when_prefiltered(cfg, ctx, backend):
+    msg_id = backend.deliver("alice@example.com", ENCODED, rfc822_id="<utf8-2@x>")
+    outcomes = ctx.processor.process_history_event("alice@example.com", [msg_id], prefiltered=True)
+    assert sorted(t for t, o in outcomes.items() if o.inserted) == ["bob@example.com", "carol@example.com"]
+
+
+def test_known_sizes_bound_raw_batches(cfg, ctx, backend):
+    def deliver_four():
+        return [backend.deliver("alice@example.com", "Training Exercise", body_bytes=1000) for _ in range(4)]
+
+    sized, prefiltered = deliver_four(), deliver_four()
+    size = len(backend.mailbox("alice@example.com").messages[sized[0]].raw)
+    cfg.raw_batch_max_bytes = 2 * size
+    for user in cfg.team_users:
+        ctx.processor.labels.get(user, cfg.label_name)
+
+    backend.reset_counters()
+    ctx.processor.share_candidates("alice@example.com", [(i, size) for i in sized])
+    with_sizes = backend.http_requests
+    backend.reset_counters()
+    ctx.processor.process_history_event("alice@example.com", prefiltered, prefiltered=True)
+    # Prefiltered ids cost one format=minimal batch for their sizes; the raws still go in two batches of two.
+    assert backend.http_requests - with_sizes == 1
+
@@ -0,0 +1,42 @@
+import time
+
+from src.utils.ratelimit import QuotaLimiter, TokenBucket
+
+
+def test_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=100, capacity=1)
+    assert bucket.acquire() == 0.0
+    waited = bucket.acquire()
+    assert 0.005 <= waited <= 0.1
+
+
+def test_oversized_request_is_admitted_when_full():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    assert bucket.acquire(50) == 0.0
+    assert bucket.acquire(1) > 0
+
+
+def test_throttling_halves_rate_and_success_recovers():
+    bucket = TokenBucket(rate=100)
+    bucket.on_throttled()
+    assert bucket.rate == 50
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 100
+
+
+def test_retry_after_blocks_admission():
+    bucket = TokenBucket(rate=1000)
+    bucket.on_throttled(retry_after=0.05)
+    started = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.04
+
+
+def test_quota_limiter_buckets_are_per_user():
+    limiter = QuotaLimiter(per_user_units_per_sec=10, project_units_per_sec=1000)
+    assert limiter.acquire("a@x", 10) == 0.0
+    assert limiter.acquire("B@x", 10) == 0.0
+    limiter.on_throttled("A@X")
+    assert limiter._user_bucket("a@x").rate == 5
+    assert limiter._user_bucket("b@x").rate == 10
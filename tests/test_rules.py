@@ -0,0 +1,51 @@
+import pytest
+
+from src.domain.rules import DEFAULT_RULES, compile_rules, parse_rules
+
+
+@pytest.mark.parametrize(
+    "subject, expected",
+    [
+        ("Training Exercise", True),
+        ("Week 3 Training Exercise  ", True),
+        ("Training Exercise follow-up", False),
+        ("training exercise", False),
+        (None, False),
+    ],
+)
+def test_default_rule_is_suffix(subject, expected):
+    assert compile_rules(DEFAULT_RULES).matches(subject) is expected
+
+
+def test_each_kind():
+    rules = compile_rules("exact:Drill;prefix:[Ops];contains:fire alarm;regex:^Q\\d Review$")
+    assert rules.matches(" Drill ")
+    assert not rules.matches("Drill 2")
+    assert rules.matches("[Ops] rota")
+    assert rules.matches("Re: fire alarm test")
+    assert rules.matches("Q3 Review")
+    assert not rules.matches("Q3 Reviews")
+
+
+def test_query_single_or_group_or_none():
+    assert compile_rules("suffix:Training Exercise").query == 'subject:"Training Exercise"'
+    assert compile_rules("exact:A;prefix:B;contains:A").query == '{subject:"A" subject:"B"}'
+    assert compile_rules("suffix:A;regex:B+").query is None
+
+
+def test_search_query_adds_after():
+    rules = compile_rules("suffix:Training Exercise")
+    assert rules.search_query(after=1700000000.9) == 'subject:"Training Exercise" after:1700000000'
+    assert compile_rules("regex:x").search_query(after=5) == "after:5"
+
+
+@pytest.mark.parametrize("spec", ["suffix", "glob:x", "prefix:  ", "regex:("])
+def test_invalid_specs_raise(spec):
+    with pytest.raises(ValueError):
+        compile_rules(spec)
+
+
+def test_parse_strips_patterns_except_inside_regex():
+    regex, suffix = parse_rules("regex: a  b;suffix: c ")
+    assert regex.pattern == " a  b"
+    assert suffix.pattern == "c"
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+from src.worker.sharing import RAW_BATCH_SIZE, raw_chunks, sized_candidates
+
+
+def test_chunks_cut_on_count_and_bytes():
+    candidates = [(str(i), 10) for i in range(RAW_BATCH_SIZE + 2)]
+    assert [len(c) for c in raw_chunks(candidates, max_bytes=1000)] == [RAW_BATCH_SIZE, 2]
+    assert list(raw_chunks([("a", 60), ("b", 50), ("c", 10)], max_bytes=100)) == [["a"], ["b", "c"]]
+
+
+def test_oversized_message_gets_its_own_chunk():
+    assert list(raw_chunks([("a", 500), ("b", 1)], max_bytes=100)) == [["a"], ["b"]]
+
+
+def test_unknown_sizes_are_fetched_alone():
+    candidates = [("a", 1), ("b", None), ("c", None), ("d", 1), ("e", 1)]
+    assert list(raw_chunks(candidates, max_bytes=100)) == [["a"], ["b"], ["c"], ["d", "e"]]
+
+
+def test_sized_candidates_drop_deleted_and_oversized(exporter):
+    cfg = SimpleNamespace(max_message_bytes=100)
+    minimals = {"a": {"id": "a", "sizeEstimate": 50}, "b": {"id": "b", "sizeEstimate": 500}, "d": {"id": "d"}}
+    assert sized_candidates(cfg, ["a", "b", "c", "d", "a"], minimals) == [("a", 50), ("d", None)]
+    assert exporter.counter("messages_skipped_total", reason="too_large") == 1
+    assert exporter.counter("messages_skipped_total", reason="deleted") == 1
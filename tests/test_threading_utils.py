@@ -0,0 +1,38 @@
+import threading
+import time
+
+from src.utils.threading_utils import KeyedExecutor
+
+
+def test_per_key_limit_serialises_a_key_but_not_others():
+    ex = KeyedExecutor(max_workers=4, per_key_limit=1)
+    running = {"a": 0, "b": 0}
+    peak = {"a": 0, "b": 0}
+    lock = threading.Lock()
+
+    def task(key):
+        with lock:
+            running[key] += 1
+            peak[key] = max(peak[key], running[key])
+        time.sleep(0.02)
+        with lock:
+            running[key] -= 1
+        return key
+
+    futures = [ex.submit(k, task, k) for k in "aaabbb"]
+    assert [f.result(timeout=5) for f in futures] == list("aaabbb")
+    ex.shutdown()
+    assert peak == {"a": 1, "b": 1}
+
+
+def test_exception_releases_the_key():
+    ex = KeyedExecutor(max_workers=1, per_key_limit=1)
+
+    def boom():
+        raise ValueError("x")
+
+    first = ex.submit("k", boom)
+    second = ex.submit("k", lambda: 42)
+    assert isinstance(first.exception(timeout=5), ValueError)
+    assert second.result(timeout=5) == 42
+    ex.shutdown()
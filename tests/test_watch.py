@@ -0,0 +1,35 @@
+import json
+import time
+
+from src.gmail.watch import WatchManager, renew_lease_key
+
+
+def _manager(cfg, kv, backend, owner):
+    cfg.topic = "projects/p/topics/gmail"
+    cfg.worker_id = owner
+    return WatchManager(cfg, kv, backend)
+
+
+def test_only_one_replica_registers(cfg, kv, backend):
+    backend.reset_counters()
+    first = _manager(cfg, kv, backend, "a")
+    second = _manager(cfg, kv, backend, "b")
+    assert set(first.ensure_all()) == set(cfg.team_users)
+    assert set(second.ensure_all()) == set(cfg.team_users)
+    assert backend.calls["users.watch"] == len(cfg.team_users)
+
+
+def test_renewal_leased_elsewhere_is_skipped(cfg, kv, backend, exporter):
+    backend.reset_counters()
+    user = cfg.team_users[0]
+    kv.set(renew_lease_key(user), json.dumps({"owner": "other", "expires": time.time() + 60}))
+    manager = _manager(cfg, kv, backend, "a")
+    assert manager.ensure(user) is None
+    assert user not in manager.ensure_all()
+    assert backend.calls["users.watch"] == len(cfg.team_users) - 1
+    assert exporter.counter("watch_renewals_total", result="leased_elsewhere") == 2
+
+    # An expired lease (its holder crashed) is taken over.
+    kv.set(renew_lease_key(user), json.dumps({"owner": "other", "expires": 0}))
+    assert manager.ensure(user)["history_id"]
+    assert json.loads(kv.get(renew_lease_key(user)))["owner"] == ""